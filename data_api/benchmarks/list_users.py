@@ -0,0 +1,117 @@
+"""Compare the serialization paths of the user list endpoint.
+
+The ORM path loads User objects with their job and department, validates them
+into UserResponse and encodes them like FastAPI does for a response_model. The
+row path selects the response columns as plain rows and encodes them with
+orjson. Both run on a fresh session per page, as a request would.
+
+Usage:
+    python -m benchmarks.list_users --users 10000 --limit 1000 --repeat 20
+
+Users are upserted into the database configured by DB_DSN (or --dsn) before
+timing, so running it twice does not grow the table.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+import config
+from db.migrate import run_migrations
+from db.schemas.user import UserResponse
+from db.storage.department import DepartmentStorage
+from db.storage.job import JobStorage
+from db.storage.user import UserStorage
+from util.storage import get_session
+
+
+def seed(engine, users: int) -> None:
+    session = get_session(engine=engine)
+    try:
+        JobStorage(session=session).bulk_upsert(
+            [{"job": f"Benchmark job {i}"} for i in range(10)]
+        )
+        DepartmentStorage(session=session).bulk_upsert(
+            [{"department": f"Benchmark department {i}"} for i in range(10)]
+        )
+        session.commit()
+        job_ids = sorted(JobStorage(session=session).existing_ids(range(1, 1000)))
+        department_ids = sorted(
+            DepartmentStorage(session=session).existing_ids(range(1, 1000))
+        )
+        storage = UserStorage(session=session)
+        for start in range(0, users, 1000):
+            storage.bulk_upsert(
+                [
+                    {
+                        "name": f"Benchmark user {i}",
+                        "datetime": "2021-11-07T02:48:42",
+                        "job_id": job_ids[i % len(job_ids)],
+                        "department_id": department_ids[i % len(department_ids)],
+                    }
+                    for i in range(start, min(start + 1000, users))
+                ]
+            )
+            session.commit()
+    finally:
+        session.close()
+
+
+def orm_page(engine, limit: int) -> bytes:
+    session = get_session(engine=engine)
+    try:
+        users = UserStorage(session=session).all(limit=limit)
+        content = [UserResponse.from_orm(user) for user in users]
+        return JSONResponse(jsonable_encoder(content)).body
+    finally:
+        session.close()
+
+
+def row_page(engine, limit: int) -> bytes:
+    session = get_session(engine=engine)
+    try:
+        rows = UserStorage(session=session).rows(UserResponse, limit=limit)
+        return ORJSONResponse(rows).body
+    finally:
+        session.close()
+
+
+def measure(page: Callable, engine, limit: int, repeat: int) -> float:
+    """Median rows per second of a serialization path."""
+    page(engine, limit)  # Warm up the pool and the statement cache
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page(engine, limit)
+        timings.append(time.perf_counter() - start)
+    return limit / statistics.median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dsn", default=None, help="Defaults to DB_DSN")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    url = make_url(args.dsn) if args.dsn else config.DB_DSN
+    engine = create_engine(url=url)
+    run_migrations(engine=engine)
+    seed(engine, args.users)
+
+    orm = measure(orm_page, engine, args.limit, args.repeat)
+    rows = measure(row_page, engine, args.limit, args.repeat)
+    print(f"ORM + response_model: {orm:12,.0f} rows/s")
+    print(f"rows + orjson:        {rows:12,.0f} rows/s")
+    print(f"speedup:              {rows / orm:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Measure the per-request overhead of the API middleware.
+
+Requests are sent straight to the ASGI application, without a server or a
+network, to a small JSON endpoint and to a streamed one. The application runs
+without middleware, with the previous BaseHTTPMiddleware implementations, and
+with the current pure ASGI ones. Log output is discarded, so only the cost of
+the middleware itself is measured.
+
+Usage:
+    python -m benchmarks.middleware --requests 20000
+"""
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse
+
+from util.logger import get_logger
+from util.middleware import error_content, ExceptionMiddleware, LoggingMiddleware
+
+
+class BaseHTTPExceptionMiddleware(BaseHTTPMiddleware):
+    """The exception middleware as it was, on top of BaseHTTPMiddleware."""
+
+    async def dispatch(self, request, call_next):
+        try:
+            return await call_next(request)
+        except Exception as exc:
+            status_code, content = error_content(exc) or (500, {"detail": str(exc)})
+            get_logger().error(f"Error Response: {content}")
+            return JSONResponse(status_code=status_code, content=content)
+
+
+class BaseHTTPLoggingMiddleware(BaseHTTPMiddleware):
+    """The logging middleware as it was, on top of BaseHTTPMiddleware."""
+
+    async def dispatch(self, request, call_next):
+        start = time.time()
+        response = await call_next(request)
+        response_time = time.time() - start
+        get_logger().info(
+            f"Request: {request.method} {request.url} {response.status_code} - {response_time:.2f}s"
+        )
+        return response
+
+
+def create_app(middleware) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/item")
+    async def item():
+        return {"id": 1, "name": "item"}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(10):
+                yield b"x" * 1024
+
+        return StreamingResponse(chunks())
+
+    for middleware_class in middleware:
+        app.add_middleware(middleware_class)
+    return app
+
+
+def scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"benchmark")],
+        "server": ("benchmark", 80),
+        "client": ("benchmark", 1234),
+    }
+
+
+async def measure(app, path: str, requests: int) -> float:
+    """Mean microseconds per request."""
+
+    disconnected = asyncio.Event()
+
+    def receiver():
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # The client stays connected until the response is sent
+            await disconnected.wait()
+
+        return receive
+
+    async def send(message):
+        pass
+
+    for _ in range(100):  # Warm up
+        await app(scope(path), receiver(), send)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(scope(path), receiver(), send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    get_logger().remove()
+    variants = {
+        "no middleware": [],
+        "BaseHTTPMiddleware": [BaseHTTPExceptionMiddleware, BaseHTTPLoggingMiddleware],
+        "pure ASGI": [ExceptionMiddleware, LoggingMiddleware],
+    }
+    for path in ("/item", "/stream"):
+        print(f"GET {path}")
+        baseline = None
+        for name, middleware in variants.items():
+            app = create_app(middleware)
+            per_request = asyncio.run(measure(app, path, args.requests))
+            baseline = per_request if baseline is None else baseline
+            overhead = per_request - baseline
+            print(f"  {name:20} {per_request:8.1f} us/request  ({overhead:+.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
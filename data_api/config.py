@@ -1,6 +1,9 @@
+import os
+import tempfile
+
 from sqlalchemy.engine.url import URL, make_url
 from starlette.config import Config
-from starlette.datastructures import Secret
+from starlette.datastructures import CommaSeparatedStrings, Secret
 
 config = Config(".env")
 
@@ -22,7 +25,101 @@ DB_DSN = config(
         database=DB_NAME,
     ),
 )
+# The async endpoints use the same database through asyncpg
+DB_ASYNC_DSN = config(
+    "DB_ASYNC_DSN",
+    cast=make_url,
+    default=DB_DSN.set(drivername="postgresql+asyncpg"),
+)
+# Optional read replicas, as a comma separated list of DSNs. Reads are spread
+# over the replicas lagging less than DB_REPLICA_MAX_LAG seconds behind.
+DB_REPLICA_DSN = [
+    make_url(dsn)
+    for dsn in config("DB_REPLICA_DSN", cast=CommaSeparatedStrings, default="")
+]
+DB_REPLICA_MAX_LAG = config("DB_REPLICA_MAX_LAG", cast=float, default=5.0)
+DB_REPLICA_LAG_INTERVAL = config("DB_REPLICA_LAG_INTERVAL", cast=float, default=5.0)
 
 DB_ECHO = config("DB_ECHO", cast=bool, default=False)
+LOGGER_LEVEL = config("LOGGER_LEVEL", default="DEBUG")
+# Logs are shipped as GELF to LOGGER_HOST:LOGGER_PORT over udp or tcp when enabled
+LOGGER_GELF_ENABLED = config("LOGGER_GELF_ENABLED", cast=bool, default=False)
+LOGGER_PROTOCOL = config("LOGGER_PROTOCOL", default="udp")
 LOGGER_HOST = config("LOGGER_HOST", default="localhost")
 LOGGER_PORT = config("LOGGER_PORT", cast=int, default=12201)
+# Records waiting to be written, and written at once, by each log sink
+LOGGER_QUEUE_SIZE = config("LOGGER_QUEUE_SIZE", cast=int, default=10000)
+LOGGER_BATCH_SIZE = config("LOGGER_BATCH_SIZE", cast=int, default=100)
+LOGGER_FLUSH_INTERVAL = config("LOGGER_FLUSH_INTERVAL", cast=float, default=0.5)
+# Share of the successful request logs shipped as GELF
+LOGGER_SUCCESS_SAMPLE_RATE = config(
+    "LOGGER_SUCCESS_SAMPLE_RATE", cast=float, default=1.0
+)
+COPY_SPOOL_MAX_SIZE = config("COPY_SPOOL_MAX_SIZE", cast=int, default=16 * 1024 * 1024)
+# Rows fetched from the server-side cursor, and sent as one chunk, by exports and reports
+EXPORT_BATCH_SIZE = config("EXPORT_BATCH_SIZE", cast=int, default=1000)
+
+FK_CACHE_ENABLED = config("FK_CACHE_ENABLED", cast=bool, default=True)
+FK_CACHE_TTL = config("FK_CACHE_TTL", cast=float, default=300.0)
+FK_CACHE_CHANNEL = config("FK_CACHE_CHANNEL", default="fk_cache")
+
+# Connection pool of both engines. Connections are recycled before the server
+# drops them and pinged on checkout, so stale connections are not handed out.
+DB_POOL_SIZE = config("DB_POOL_SIZE", cast=int, default=5)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", cast=int, default=10)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", cast=float, default=30.0)
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", cast=int, default=1800)
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", cast=bool, default=True)
+# Waits for a connection and checkouts held longer than these, in seconds, are logged
+DB_POOL_WAIT_WARNING = config("DB_POOL_WAIT_WARNING", cast=float, default=1.0)
+DB_POOL_LEAK_THRESHOLD = config("DB_POOL_LEAK_THRESHOLD", cast=float, default=30.0)
+
+# Statements slower than this, in seconds, are logged along with their plan.
+# A statement run this many times in one request is reported as a likely N+1.
+DB_SLOW_QUERY_THRESHOLD = config("DB_SLOW_QUERY_THRESHOLD", cast=float, default=0.5)
+DB_SLOW_QUERY_EXPLAIN = config("DB_SLOW_QUERY_EXPLAIN", cast=bool, default=True)
+DB_REPEATED_QUERY_THRESHOLD = config(
+    "DB_REPEATED_QUERY_THRESHOLD", cast=int, default=10
+)
+
+# Rendered reports kept per worker. Entries expire after the TTL, or as soon as
+# the hires of their year change; larger reports are not cached.
+REPORT_CACHE_SIZE = config("REPORT_CACHE_SIZE", cast=int, default=128)
+REPORT_CACHE_TTL = config("REPORT_CACHE_TTL", cast=float, default=3600.0)
+REPORT_CACHE_MAX_ENTRY_SIZE = config(
+    "REPORT_CACHE_MAX_ENTRY_SIZE", cast=int, default=8 * 1024 * 1024
+)
+# Years of a multi-year report queried at once, each on its own pooled connection
+REPORT_MAX_WORKERS = config("REPORT_MAX_WORKERS", cast=int, default=4)
+
+# Report jobs render reports in the background to files in REPORT_JOB_DIR,
+# kept for REPORT_JOB_TTL seconds once finished
+REPORT_JOB_WORKERS = config("REPORT_JOB_WORKERS", cast=int, default=2)
+REPORT_JOB_DIR = config(
+    "REPORT_JOB_DIR", default=os.path.join(tempfile.gettempdir(), "report_jobs")
+)
+REPORT_JOB_TTL = config("REPORT_JOB_TTL", cast=float, default=3600.0)
+
+# In-process columnar snapshot of the users, answering aggregations while it is
+# no more than ANALYTICS_MAX_LAG seconds old
+ANALYTICS_SNAPSHOT_ENABLED = config(
+    "ANALYTICS_SNAPSHOT_ENABLED", cast=bool, default=False
+)
+ANALYTICS_REFRESH_INTERVAL = config(
+    "ANALYTICS_REFRESH_INTERVAL", cast=float, default=5.0
+)
+ANALYTICS_FULL_REFRESH_INTERVAL = config(
+    "ANALYTICS_FULL_REFRESH_INTERVAL", cast=float, default=900.0
+)
+ANALYTICS_MAX_LAG = config("ANALYTICS_MAX_LAG", cast=float, default=60.0)
+
+# Requests with an X-Profile header matching PROFILING_TOKEN, and a sample of
+# PROFILING_SAMPLE_RATE of all requests, are profiled. Profiles are written to
+# PROFILING_DIR, or returned instead of the response when asked for inline.
+PROFILING_ENABLED = config("PROFILING_ENABLED", cast=bool, default=False)
+PROFILING_TOKEN = config("PROFILING_TOKEN", cast=Secret, default=None)
+PROFILING_SAMPLE_RATE = config("PROFILING_SAMPLE_RATE", cast=float, default=0.0)
+PROFILING_INTERVAL = config("PROFILING_INTERVAL", cast=float, default=0.001)
+PROFILING_DIR = config(
+    "PROFILING_DIR", default=os.path.join(tempfile.gettempdir(), "profiles")
+)
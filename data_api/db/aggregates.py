@@ -0,0 +1,175 @@
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from db.models import engine as default_engine
+from util.logger import get_logger
+
+# Adds the hire counts of a set of changes, given as (datetime, department_id,
+# job_id, delta) rows, to the aggregate and bumps the version of the years they
+# belong to. Keys are locked in a fixed order so that concurrent writers cannot
+# deadlock on them.
+_APPLY_CHANGES = """
+WITH applied AS (
+    INSERT INTO hires_aggregate AS aggregate (year, quarter, department_id, job_id, hires)
+    SELECT
+        EXTRACT(YEAR FROM datetime)::int,
+        EXTRACT(QUARTER FROM datetime)::int,
+        department_id,
+        job_id,
+        SUM(delta)
+    FROM ({changes}) AS changes
+    WHERE datetime IS NOT NULL
+    GROUP BY 1, 2, 3, 4
+    HAVING SUM(delta) <> 0
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (year, quarter, department_id, job_id)
+    DO UPDATE SET hires = aggregate.hires + excluded.hires
+    RETURNING year
+)
+INSERT INTO report_version AS report (year, version, updated_at)
+SELECT year, 1, now() FROM applied GROUP BY year ORDER BY year
+ON CONFLICT (year)
+DO UPDATE SET version = report.version + 1, updated_at = excluded.updated_at;
+"""
+_NEW_ROWS = "SELECT datetime, department_id, job_id, 1 AS delta FROM new_rows"
+_OLD_ROWS = "SELECT datetime, department_id, job_id, -1 AS delta FROM old_rows"
+
+# Statement level triggers see the rows written by a statement as transition
+# tables, so a bulk insert or COPY updates each key once rather than per row.
+HIRES_TRIGGER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION hires_aggregate_apply() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        TRUNCATE hires_aggregate;
+        UPDATE report_version SET version = version + 1, updated_at = now();
+        RETURN NULL;
+    ELSIF TG_OP = 'INSERT' THEN
+        {_APPLY_CHANGES.format(changes=_NEW_ROWS)}
+    ELSIF TG_OP = 'DELETE' THEN
+        {_APPLY_CHANGES.format(changes=_OLD_ROWS)}
+    ELSE
+        {_APPLY_CHANGES.format(changes=f"{_NEW_ROWS} UNION ALL {_OLD_ROWS}")}
+    END IF;
+    DELETE FROM hires_aggregate WHERE hires = 0;
+    RETURN NULL;
+END;
+$$;
+"""
+HIRES_TRIGGERS = [
+    """
+    CREATE OR REPLACE TRIGGER hires_aggregate_insert AFTER INSERT ON "user"
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION hires_aggregate_apply()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER hires_aggregate_update AFTER UPDATE ON "user"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION hires_aggregate_apply()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER hires_aggregate_delete AFTER DELETE ON "user"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION hires_aggregate_apply()
+    """,
+    """
+    CREATE OR REPLACE TRIGGER hires_aggregate_truncate AFTER TRUNCATE ON "user"
+    FOR EACH STATEMENT EXECUTE FUNCTION hires_aggregate_apply()
+    """,
+]
+# Every year may have changed, including those without hires anymore
+BUMP_REPORT_VERSIONS = """
+WITH bumped AS (
+    UPDATE report_version SET version = version + 1, updated_at = now()
+    RETURNING year
+)
+INSERT INTO report_version (year, version, updated_at)
+SELECT DISTINCT year, 1, now() FROM hires_aggregate
+WHERE year NOT IN (SELECT year FROM bumped)
+"""
+# Reports show the names of departments and jobs, so renaming or deleting one
+# changes the reports of every year. Inserts are not shown until hires refer to
+# them, which the triggers on "user" already account for.
+REPORT_DIMENSION_TRIGGER_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION report_dimension_changed() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- TRUNCATE has no transition table, and UPDATE or DELETE may match no row
+    IF TG_OP = 'TRUNCATE' THEN
+        {BUMP_REPORT_VERSIONS};
+    ELSIF EXISTS (SELECT 1 FROM old_rows) THEN
+        {BUMP_REPORT_VERSIONS};
+    END IF;
+    RETURN NULL;
+END;
+$$;
+"""
+REPORT_DIMENSION_TRIGGERS = [
+    trigger.format(table=table)
+    for table in ("department", "job")
+    for trigger in (
+        """
+        CREATE OR REPLACE TRIGGER {table}_report_update AFTER UPDATE ON {table}
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION report_dimension_changed()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER {table}_report_delete AFTER DELETE ON {table}
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION report_dimension_changed()
+        """,
+        """
+        CREATE OR REPLACE TRIGGER {table}_report_truncate AFTER TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION report_dimension_changed()
+        """,
+    )
+]
+REBUILD_HIRES = """
+INSERT INTO hires_aggregate (year, quarter, department_id, job_id, hires)
+SELECT
+    EXTRACT(YEAR FROM datetime)::int,
+    EXTRACT(QUARTER FROM datetime)::int,
+    department_id,
+    job_id,
+    COUNT(*)
+FROM "user"
+WHERE datetime IS NOT NULL
+GROUP BY 1, 2, 3, 4
+"""
+
+
+def install_hires_triggers(connection: Connection) -> None:
+    """Create, or replace, the triggers maintaining the hires aggregate and the
+    report versions.
+    """
+    connection.execute(text(HIRES_TRIGGER_FUNCTION))
+    connection.execute(text(REPORT_DIMENSION_TRIGGER_FUNCTION))
+    for trigger in HIRES_TRIGGERS + REPORT_DIMENSION_TRIGGERS:
+        connection.execute(text(trigger))
+
+
+def rebuild_hires_aggregate(engine: Optional[Engine] = None) -> int:
+    """Recompute the hires aggregate from the user table.
+    Writes to the user table wait until the rebuild commits, so no change is
+    counted twice or missed.
+    Args:
+        engine (Engine): The engine to use. Defaults to the default engine.
+    Returns:
+        int: Number of aggregate rows.
+    """
+    engine = engine or default_engine
+    with engine.begin() as connection:
+        connection.execute(text('LOCK TABLE "user" IN SHARE MODE'))
+        connection.execute(text("TRUNCATE hires_aggregate"))
+        rows = connection.execute(text(REBUILD_HIRES)).rowcount
+        connection.execute(text(BUMP_REPORT_VERSIONS))
+        return rows
+
+
+if __name__ == "__main__":
+    logger = get_logger()
+    logger.info("Rebuilding the hires aggregate...")
+    rows = rebuild_hires_aggregate()
+    logger.info(f"Hires aggregate rebuilt with {rows} rows.")
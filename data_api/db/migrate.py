@@ -1,4 +1,7 @@
-from db.models import engine as default_engine
+from sqlalchemy import inspect
+
+from db.aggregates import install_hires_triggers, rebuild_hires_aggregate
+from db.models import engine as default_engine, HiresAggregate
 from db.models.base import Base
 from util.db import wait_for_connection
 
@@ -7,7 +10,17 @@ def run_migrations(engine: default_engine = None):
     """Create database tables."""
     engine = engine or default_engine
     wait_for_connection(engine)
+    is_new = not inspect(engine).has_table(HiresAggregate.__tablename__)
     Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        # create_all only indexes the tables it creates
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        install_hires_triggers(connection)
+    if is_new:
+        # Existing users are only counted by triggers from now on
+        rebuild_hires_aggregate(engine)
 
 
 if __name__ == "__main__":
@@ -1,10 +1,27 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 
 import config
+from util.pool import pool_options
+from util.query_stats import instrument_engine
 from .department import Department
+from .hires import HiresAggregate, ReportVersion
 from .job import Job
 from .user import User
 
-engine = create_engine(url=config.DB_DSN, echo=config.DB_ECHO)
+engine = create_engine(url=config.DB_DSN, echo=config.DB_ECHO, **pool_options())
+async_engine = create_async_engine(
+    url=config.DB_ASYNC_DSN, echo=config.DB_ECHO, **pool_options(is_async=True)
+)
+instrument_engine(engine)
+instrument_engine(async_engine)
 
-__all__ = [engine, Department, Job, User]
+__all__ = [
+    engine,
+    async_engine,
+    Department,
+    HiresAggregate,
+    Job,
+    ReportVersion,
+    User,
+]
@@ -0,0 +1,27 @@
+from sqlalchemy import BigInteger, Column, DateTime, Integer, SmallInteger
+
+from db.models.base import Base
+
+
+class HiresAggregate(Base):
+    """Number of users hired per year, quarter, department and job.
+    Kept up to date by triggers on the user table, see db/aggregates.py.
+    """
+
+    __tablename__ = "hires_aggregate"
+    year = Column(Integer, primary_key=True)
+    quarter = Column(SmallInteger, primary_key=True)
+    department_id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, primary_key=True)
+    hires = Column(BigInteger, nullable=False, default=0)
+
+
+class ReportVersion(Base):
+    """Version of the hires of a year, bumped whenever they change.
+    Cached reports of a year are valid for as long as its version is unchanged.
+    """
+
+    __tablename__ = "report_version"
+    year = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
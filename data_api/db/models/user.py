@@ -14,7 +14,7 @@ from db.models.base import BaseModel
 class User(BaseModel):
     __tablename__ = "user"
     name = Column(String(255), nullable=False, index=True)
-    datetime = Column(DateTime)
+    datetime = Column(DateTime, index=True)
     job_id = Column(Integer, ForeignKey("job.id"), nullable=False)
     department_id = Column(Integer, ForeignKey("department.id"), nullable=False)
     job = relationship(
@@ -0,0 +1,161 @@
+import itertools
+import math
+import threading
+from typing import List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, URL
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+import config
+from db.models import engine as primary_engine
+from util.logger import get_logger
+from util.pool import pool_options
+from util.query_stats import instrument_engine
+
+# Seconds since the last replayed transaction, or 0 when the replica has
+# replayed everything it received. Primaries report no lag.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """)
+
+
+class Replica:
+    """A read replica, reachable through a sync and an async engine."""
+
+    def __init__(self, engine: Engine, async_engine: Optional[AsyncEngine] = None):
+        self.engine = engine
+        self.async_engine = async_engine
+        # Unknown until first measured, replicas are used until then
+        self.lag: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def is_usable(self, max_lag: float) -> bool:
+        return self.lag is None or self.lag <= max_lag
+
+    def measure_lag(self) -> float:
+        """Query the replication lag of the replica.
+        Returns:
+            float: The lag in seconds, or infinity if the replica is unreachable.
+        """
+        try:
+            with self.engine.connect() as connection:
+                self.lag = float(connection.execute(LAG_QUERY).scalar())
+        except DBAPIError:
+            self.lag = math.inf
+        return self.lag
+
+
+class ReplicaSet:
+    """Round-robin over the replicas within the allowed lag."""
+
+    def __init__(self, replicas: List[Replica], max_lag: Optional[float] = None):
+        self.replicas = replicas
+        self.max_lag = config.DB_REPLICA_MAX_LAG if max_lag is None else max_lag
+        self._cycle = itertools.cycle(replicas)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, urls: List[URL]) -> "ReplicaSet":
+        replicas = [
+            Replica(
+                create_engine(url=url, echo=config.DB_ECHO, **pool_options()),
+                create_async_engine(
+                    url=url.set(drivername="postgresql+asyncpg"),
+                    echo=config.DB_ECHO,
+                    **pool_options(is_async=True),
+                ),
+            )
+            for url in urls
+        ]
+        for replica in replicas:
+            instrument_engine(replica.engine)
+            instrument_engine(replica.async_engine)
+        return cls(replicas)
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """Pick the next usable replica.
+        Returns:
+            Optional[Replica]: A replica, or None if all of them lag too far behind.
+        """
+        with self._lock:
+            for _ in range(len(self.replicas)):
+                replica = next(self._cycle)
+                if replica.is_usable(self.max_lag):
+                    return replica
+        return None
+
+    def status(self) -> List[dict]:
+        """Get the last measured lag of each replica."""
+        return [
+            {
+                "name": replica.name,
+                "lag": replica.lag,
+                "usable": replica.is_usable(self.max_lag),
+            }
+            for replica in self.replicas
+        ]
+
+    def dispose(self) -> None:
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+class ReplicaLagMonitor(threading.Thread):
+    """Background thread measuring the lag of the replicas at a fixed interval.
+    Replicas falling behind more than the allowed lag, or unreachable, stop
+    receiving reads until they catch up.
+    """
+
+    def __init__(self, replica_set: "ReplicaSet", interval: Optional[float] = None):
+        super().__init__(name="replica-lag-monitor", daemon=True)
+        self.replica_set = replica_set
+        self.interval = config.DB_REPLICA_LAG_INTERVAL if interval is None else interval
+        self._stopped = threading.Event()
+        self.logger = get_logger()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        self.join(timeout)
+
+    def check(self) -> None:
+        for replica in self.replica_set.replicas:
+            was_usable = replica.is_usable(self.replica_set.max_lag)
+            lag = replica.measure_lag()
+            is_usable = replica.is_usable(self.replica_set.max_lag)
+            if was_usable and not is_usable:
+                self.logger.warning(
+                    f"Replica {replica.name} is {lag:.1f}s behind, reading from other replicas or the primary"
+                )
+            elif is_usable and not was_usable:
+                self.logger.info(
+                    f"Replica {replica.name} caught up ({lag:.1f}s behind)"
+                )
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            self.check()
+            self._stopped.wait(self.interval)
+
+
+replicas = ReplicaSet.from_urls(config.DB_REPLICA_DSN)
+
+
+def read_engine() -> Engine:
+    """Get the engine to run read-only queries on.
+    Returns:
+        Engine: The engine of a usable replica, or the primary's if there is none.
+    """
+    replica = replicas.choose()
+    return replica.engine if replica else primary_engine
@@ -0,0 +1,10 @@
+from pydantic import BaseModel as PydanticBase
+
+
+class BulkUpsertResponse(PydanticBase):
+    """Outcome counts of a bulk upsert."""
+
+    inserted: int = 0
+    updated: int = 0
+    reactivated: int = 0
+    unchanged: int = 0
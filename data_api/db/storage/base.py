@@ -1,7 +1,50 @@
-from typing import Optional, List, Type, Union
+from datetime import datetime
+from functools import partial
+from typing import (
+    Optional,
+    List,
+    Type,
+    Union,
+    Tuple,
+    IO,
+    Iterable,
+    Set,
+    Dict,
+    AsyncIterator,
+)
 
+from sqlalchemy import (
+    select,
+    any_,
+    bindparam,
+    or_,
+    and_,
+    not_,
+    case,
+    cast,
+    exists,
+    func,
+    literal,
+    literal_column,
+    true,
+    type_coerce,
+    Table,
+    MetaData,
+    Column,
+    BigInteger,
+    Text,
+    Identity,
+)
+from sqlalchemy.dialects.postgresql import (
+    insert as pg_insert,
+    aggregate_order_by,
+    ARRAY,
+)
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel as PydanticBase
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.interfaces import LoaderOption
 
 from db.models.base import BaseModel
 from util.exceptions import (
@@ -9,14 +52,27 @@ from util.exceptions import (
     RecordNotActive,
     DatabaseError,
     RecordAlreadyExists,
+    DuplicateRecords,
+    InvalidRecords,
 )
-from util.storage import get_session
+from db.storage.cache import IdCache, mark_stale
+from util.metrics import ROWS_INGESTED
+from util.pagination import encode_cursor, decode_cursor
+from util.storage import get_session, use_primary
 
 
 class BaseStorage:
     def __init__(self, session: Optional[Session] = None):
         self.session = session or get_session()
         self.model: Optional[Type[BaseModel]] = None
+        # Columns of the unique key used to detect conflicts on upsert
+        self.unique_fields: Tuple[str, ...] = ()
+        # Number of offending lines reported per validation error on CSV loads
+        self.max_reported_lines = 10
+        # Cache of active ids, for tables referenced by foreign keys
+        self.id_cache: Optional[IdCache] = None
+        # Relationship loader options applied when reading records
+        self.load_options: List[LoaderOption] = []
 
     def read(self, id: int, is_active_only: bool = True) -> Union[BaseModel, None]:
         """Read a record from the table.
@@ -26,7 +82,7 @@ class BaseStorage:
         Returns:
             Union[ModelType, None]: The record if it exists, else None.
         """
-        db_obj = self.session.get(self.model, id)
+        db_obj = self.session.get(self.model, id, options=self.load_options)
         if not db_obj:
             raise RecordNotFound(id)
         if is_active_only and not db_obj.is_active:
@@ -40,6 +96,7 @@ class BaseStorage:
         Returns:
             BaseModel: The created model.
         """
+        use_primary(self.session)
         try:
             self.session.add(model)
         except SQLAlchemyError as e:
@@ -52,7 +109,9 @@ class BaseStorage:
             id (int): ID of the record to update.
             data (dict): Dictionary of the data to update.
         """
+        use_primary(self.session)
         db_object = self.read(id)
+        self._mark_stale()
         try:
             db_object.update(data)
             self.session.add(db_object)
@@ -62,7 +121,19 @@ class BaseStorage:
             raise RecordAlreadyExists(data=data) from e
         return db_object
 
+    def refresh(self, db_obj: BaseModel) -> BaseModel:
+        """Reload a record along with its relationships.
+        Args:
+            db_obj (BaseModel): The record to reload.
+        Returns:
+            BaseModel: The reloaded record.
+        """
+        return self.session.get(
+            self.model, db_obj.id, options=self.load_options, populate_existing=True
+        )
+
     def upsert(self, data: dict) -> BaseModel:
+        use_primary(self.session)
         db_object = self.session.query(self.model).filter_by(**data).first()
         if db_object:
             db_object.is_active = True
@@ -77,7 +148,9 @@ class BaseStorage:
             id (int): ID of the record to delete.
             soft_delete (bool, optional): Whether to soft delete the record. Defaults to True.
         """
+        use_primary(self.session)
         db_object = self.read(id)
+        self._mark_stale()
         if soft_delete:
             db_object.soft_delete()
         else:
@@ -93,25 +166,132 @@ class BaseStorage:
         is_active = kwargs.pop("is_active", True)
         return (
             self.session.query(self.model)
+            .options(*self.load_options)
             .filter_by(is_active=is_active, **kwargs)
             .all()
         )
 
-    def all(self, skip: int = 0, limit: int = 100) -> List[BaseModel]:
-        """Get all records from the table.
+    def all(
+        self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> List[BaseModel]:
+        """Get all records from the table, ordered by id.
         Args:
             skip (int, optional): Number of records to skip. Defaults to 0.
             limit (int, optional): Maximum number of records to return. Defaults to 100.
+            cursor (str, optional): Cursor returned by next_cursor. When given, the page
+                starts right after the cursor position and skip is ignored. Defaults to None.
         Returns:
             List[ModelType]: List of records.
         """
-        return (
+        query = (
             self.session.query(self.model)
+            .options(*self.load_options)
             .filter_by(is_active=True)
-            .offset(skip)
-            .limit(limit)
-            .all()
         )
+        return self._paginate(query, skip, limit, cursor).all()
+
+    def _paginate(self, query, skip: int, limit: int, cursor: Optional[str]):
+        last_id = decode_cursor(cursor)
+        if last_id is not None:
+            query = query.filter(self.model.id > last_id)
+        elif skip:
+            query = query.offset(skip)
+        return query.order_by(self.model.id).limit(limit)
+
+    def _row_columns(self, schema: Type[PydanticBase]):
+        """Columns selected to fill a response schema.
+        Fields holding a nested schema are read from the relationship of the same
+        name, outer joined so that missing or inactive records come back as NULLs.
+        Args:
+            schema (Type[PydanticBase]): The response schema.
+        Returns:
+            Tuple[list, list, Dict[str, List[str]]]: The labeled columns, the joins
+                and the fields of each nested schema.
+        """
+        columns, joins, nested = [], [], {}
+        for name, field in schema.__fields__.items():
+            if isinstance(field.type_, type) and issubclass(field.type_, PydanticBase):
+                relationship = getattr(self.model, name)
+                target = aliased(relationship.property.mapper.class_, name=name)
+                joins.append(relationship.of_type(target))
+                nested[name] = list(field.type_.__fields__)
+                columns.extend(
+                    getattr(target, sub_name).label(f"{name}__{sub_name}")
+                    for sub_name in nested[name]
+                )
+            else:
+                columns.append(getattr(self.model, name).label(name))
+        return columns, joins, nested
+
+    def rows(
+        self,
+        schema: Type[PydanticBase],
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> List[dict]:
+        """Get all records from the table as plain dicts, ordered by id.
+        Only the columns of the response schema are selected, with nested schemas
+        joined in the same query, and rows are not loaded as ORM objects. The
+        dicts can be serialized as they are, without validating them again.
+        Args:
+            schema (Type[PydanticBase]): Response schema whose fields are selected.
+            skip (int, optional): Number of records to skip. Defaults to 0.
+            limit (int, optional): Maximum number of records to return. Defaults to 100.
+            cursor (str, optional): Cursor returned by next_cursor. Defaults to None.
+        Returns:
+            List[dict]: List of records.
+        """
+        query, nested = self._rows_query(schema)
+        query = self._paginate(query, skip, limit, cursor)
+        return self._to_records(self.session.execute(query).mappings(), nested)
+
+    def _rows_query(self, schema: Type[PydanticBase]):
+        columns, joins, nested = self._row_columns(schema)
+        query = select(*columns).select_from(self.model)
+        for join in joins:
+            query = query.outerjoin(join)
+        return query.where(self.model.is_active.is_(True)), nested
+
+    @staticmethod
+    def _to_records(rows: Iterable, nested: Dict[str, List[str]]) -> List[dict]:
+        """Turn rows selected by _rows_query into dicts shaped like the schema."""
+        if not nested:
+            return [dict(row) for row in rows]
+        records = []
+        for row in rows:
+            record = {key: value for key, value in row.items() if "__" not in key}
+            for name, fields in nested.items():
+                record[name] = None
+                if row[f"{name}__id"] is not None:
+                    record[name] = {field: row[f"{name}__{field}"] for field in fields}
+            records.append(record)
+        return records
+
+    def export_query(self, schema: Type[PydanticBase]):
+        """Query selecting every active record as rows shaped like a schema.
+        Args:
+            schema (Type[PydanticBase]): Response schema whose fields are selected.
+        Returns:
+            Tuple[Select, Callable]: The query, ordered by id, and a function turning
+                a batch of its rows into dicts.
+        """
+        query, nested = self._rows_query(schema)
+        return query.order_by(self.model.id), partial(self._to_records, nested=nested)
+
+    @staticmethod
+    def next_cursor(records: List[Union[BaseModel, dict]], limit: int) -> Optional[str]:
+        """Cursor of the page following a page of records.
+        Args:
+            records (List[Union[ModelType, dict]]): The current page, as records or rows.
+            limit (int): Page size the records were requested with.
+        Returns:
+            Optional[str]: The cursor, or None if this is the last page.
+        """
+        if not records or len(records) < limit:
+            return None
+        last = records[-1]
+        return encode_cursor(last["id"] if isinstance(last, dict) else last.id)
 
     def count(self, **kwargs) -> int:
         """Count records from the table.
@@ -136,21 +316,411 @@ class BaseStorage:
             bool: True if the record exists, else False.
         """
         is_active = kwargs.pop("is_active", True)
-        return (
-            self.session.query(self.model)
-            .filter_by(id=id, is_active=is_active, **kwargs)
-            .scalar()
-            is not None
+        query = self.session.query(self.model.id).filter_by(
+            id=id, is_active=is_active, **kwargs
+        )
+        return self.session.query(query.exists()).scalar()
+
+    def existing_ids(self, ids: Iterable[int], is_active: bool = True) -> Set[int]:
+        """Find which of the given ids exist in the table, with at most one query.
+        Active ids are answered from the id cache when the storage has one. Ids
+        missing from the cache are checked against the database, as they may
+        have been created since the cache was loaded.
+        Args:
+            ids (Iterable[int]): IDs of the records to check.
+            is_active (bool, optional): Whether to only match active records. Defaults to True.
+        Returns:
+            Set[int]: The ids that exist.
+        """
+        ids = set(ids)
+        found = set()
+        if self.id_cache is not None and is_active:
+            if not self.id_cache.is_fresh():
+                self._load_id_cache()
+            uncached = self.id_cache.missing(ids)
+            if uncached is not None:
+                found = ids - uncached
+                ids = uncached
+        if not ids:
+            return found
+        query = select(self.model.id).where(
+            self.model.id == any_(bindparam("ids", list(ids), type_=ARRAY(BigInteger))),
+            self.model.is_active == is_active,
+        )
+        return found | set(self.session.execute(query).scalars())
+
+    def _load_id_cache(self) -> None:
+        version = self.id_cache.version
+        query = (
+            select(self.model.id)
+            .where(self.model.is_active.is_(True))
+            .order_by(self.model.id)
         )
+        self.id_cache.load(self.session.execute(query).scalars(), version)
+
+    def _mark_stale(self) -> None:
+        """Invalidate the id cache of the table once the session commits."""
+        if self.id_cache is not None:
+            mark_stale(self.session, self.model.__tablename__)
+
+    def _check_duplicates(self, data: list) -> None:
+        """Reject payloads that contain the same unique key more than once.
+        Postgres cannot apply ON CONFLICT DO UPDATE twice to the same row
+        within a single statement.
+        """
+        seen = set()
+        duplicates = []
+        for row in data:
+            key = tuple(row.get(field) for field in self.unique_fields)
+            if key in seen:
+                duplicates.append(key)
+            seen.add(key)
+        if duplicates:
+            raise DuplicateRecords(keys=duplicates)
 
-    def bulk_upsert(self, data: list):
+    def _upsert_statement(self, insert_stmt, fields: List[str]):
+        """Turn an INSERT into an ON CONFLICT DO UPDATE on the unique key.
+        Rows that are already active and identical are left untouched and
+        are not returned.
+        Args:
+            insert_stmt: A postgres INSERT for the model table.
+            fields (List[str]): Columns provided by the insert.
+        Returns:
+            The statement, returning the id of each written row along with
+            whether it was inserted and whether it was active before.
+        """
+        table = self.model.__table__
+        excluded = insert_stmt.excluded
+        changed = [
+            field
+            for field in fields
+            if field not in self.unique_fields and field != "id"
+        ]
+        values = {field: excluded[field] for field in changed}
+        values.update(is_active=True, deleted_at=None, updated_at=datetime.utcnow())
+
+        # Subqueries in RETURNING see the snapshot taken before the statement.
+        # The target row is referenced literally as RETURNING does not correlate.
+        prior = table.alias("prior")
+        was_active = (
+            select(prior.c.is_active)
+            .where(prior.c.id == literal_column(f'"{table.name}".id'))
+            .scalar_subquery()
+        )
+        return insert_stmt.on_conflict_do_update(
+            index_elements=list(self.unique_fields),
+            set_=values,
+            where=or_(
+                table.c.is_active.isnot(True),
+                *[
+                    table.c[field].is_distinct_from(excluded[field])
+                    for field in changed
+                ],
+            ),
+        ).returning(
+            table.c.id,
+            literal_column("xmax = 0").label("inserted"),
+            was_active.label("was_active"),
+        )
+
+    @staticmethod
+    def _count_outcomes(rows, total: int) -> dict:
+        """Summarize the rows returned by an upsert statement."""
+        outcome = {"inserted": 0, "updated": 0, "reactivated": 0, "unchanged": 0}
+        for row in rows:
+            if row.inserted:
+                outcome["inserted"] += 1
+            elif row.was_active is False:
+                outcome["reactivated"] += 1
+            else:
+                outcome["updated"] += 1
+        outcome["unchanged"] = total - sum(outcome.values())
+        return outcome
+
+    def bulk_upsert(self, data: list) -> dict:
         """Bulk upsert records into the table.
+        Conflicts on the unique key update (and reactivate) the existing row,
+        so every batch is written with a single INSERT ... ON CONFLICT statement.
         Args:
             data (list): List of dictionaries of data to upsert.
+        Returns:
+            dict: Number of records inserted, updated, reactivated and unchanged.
         """
+        use_primary(self.session)
+        self._check_duplicates(data)
+
+        # A multi-row VALUES clause needs the same columns on every row
+        batches = {}
+        for row in data:
+            batches.setdefault(tuple(sorted(row)), []).append(row)
+
+        rows = []
         try:
-            self.session.bulk_insert_mappings(self.model, data)
+            for fields, batch in batches.items():
+                stmt = pg_insert(self.model.__table__).values(batch)
+                stmt = self._upsert_statement(stmt, list(fields))
+                rows.extend(self.session.execute(stmt).all())
         except IntegrityError:
             raise
         except SQLAlchemyError as e:
             raise DatabaseError(f"Database error: {str(e)}", data=data) from e
+        ROWS_INGESTED.labels(self.model.__tablename__).inc(len(data))
+        return self._count_outcomes(rows, total=len(data))
+
+    def _staging_table(self, columns: List[str], first_line: int) -> Table:
+        """Temporary text-typed table the CSV rows are copied into.
+        The identity column numbers the rows after their line in the file.
+        """
+        return Table(
+            f"{self.model.__tablename__}_staging",
+            MetaData(),
+            Column("line", BigInteger, Identity(start=first_line)),
+            *[Column(name, Text) for name in columns],
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="drop",
+        )
+
+    def _check_csv_columns(self, columns: List[str]) -> None:
+        table = self.model.__table__
+        writable = {column.name for column in table.columns} - {
+            "created_at",
+            "updated_at",
+            "deleted_at",
+            "is_active",
+        }
+        required = {
+            column.name
+            for column in table.columns
+            if not column.nullable and not column.primary_key
+        }
+        errors = {}
+        unknown = [name for name in columns if name not in writable]
+        if unknown:
+            errors["unknown columns"] = unknown
+        missing = sorted((required | set(self.unique_fields)) - set(columns))
+        if missing:
+            errors["missing columns"] = missing
+        duplicated = sorted({name for name in columns if columns.count(name) > 1})
+        if duplicated:
+            errors["duplicated columns"] = duplicated
+        if errors:
+            raise InvalidRecords("Invalid CSV columns", errors=errors)
+
+    def _validate_staging(self, staging: Table, columns: List[str]) -> int:
+        """Validate the staged rows with a single scan of the staging table.
+        Checks for missing required values, values that do not parse as the
+        column type, foreign keys to missing or inactive records and repeated
+        unique keys. Requires Postgres 16 for pg_input_is_valid.
+        Args:
+            staging (Table): The staging table holding the raw CSV values.
+            columns (List[str]): Columns loaded from the CSV.
+        Returns:
+            int: Number of staged rows.
+        """
+        table = self.model.__table__
+        dialect = self.session.connection().dialect
+        rows = select(
+            staging,
+            func.count()
+            .over(partition_by=[staging.c[field] for field in self.unique_fields])
+            .label("copies"),
+        ).subquery()
+
+        is_valid = {}
+        checks = {}
+        for name in columns:
+            column = table.c[name]
+            value = rows.c[name]
+            is_valid[name] = func.pg_input_is_valid(
+                value, column.type.compile(dialect=dialect)
+            )
+            if not column.nullable:
+                checks[f"missing {name}"] = value.is_(None)
+            checks[f"invalid {name}"] = and_(value.isnot(None), not_(is_valid[name]))
+
+        for foreign_key in table.foreign_keys:
+            name = foreign_key.parent.name
+            if name not in columns:
+                continue
+            parent = foreign_key.column.table
+            parent_exists = exists().where(
+                foreign_key.column == cast(rows.c[name], foreign_key.column.type),
+                parent.c.is_active.is_(True),
+            )
+            # CASE guarantees the cast only runs on values that parse
+            checks[f"unknown {name}"] = case(
+                (is_valid[name], not_(parent_exists)), else_=False
+            )
+        checks["duplicate key"] = rows.c.copies > 1
+
+        limit = self.max_reported_lines
+        summary = [func.count()]
+        for condition in checks.values():
+            lines = func.array_agg(aggregate_order_by(rows.c.line, rows.c.line))
+            summary.append(func.count().filter(condition))
+            summary.append(
+                type_coerce(lines.filter(condition), ARRAY(BigInteger))[1:limit]
+            )
+        total, *results = self.session.execute(select(*summary)).one()
+
+        errors = {}
+        for index, check in enumerate(checks):
+            count, lines = results[2 * index], results[2 * index + 1]
+            if count:
+                errors[check] = {"count": count, "lines": lines}
+        if errors:
+            raise InvalidRecords("Invalid CSV data", errors=errors)
+        return total
+
+    def copy_from_csv(self, file: IO, columns: List[str], header: bool = True) -> dict:
+        """Load a CSV file into the table.
+        The file is streamed into a temporary staging table with COPY FROM
+        STDIN, validated with set-based queries and merged into the table with
+        a single INSERT ... SELECT ... ON CONFLICT statement.
+        Args:
+            file (IO): File-like object with the CSV data.
+            columns (List[str]): Table columns, in the order they appear in the file.
+            header (bool, optional): Whether the first line is a header. Defaults to True.
+        Returns:
+            dict: Number of records inserted, updated, reactivated and unchanged.
+        """
+        use_primary(self.session)
+        self._check_csv_columns(columns)
+        table = self.model.__table__
+        staging = self._staging_table(columns, first_line=2 if header else 1)
+        connection = self.session.connection()
+        staging.create(connection)
+
+        preparer = connection.dialect.identifier_preparer
+        copy_sql = (
+            f"COPY {preparer.format_table(staging)} "
+            f"({', '.join(preparer.quote(name) for name in columns)}) "
+            f"FROM STDIN WITH (FORMAT csv, HEADER {str(header).lower()})"
+        )
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(copy_sql, file)
+
+        total = self._validate_staging(staging, columns)
+
+        now = datetime.utcnow()
+        source = select(
+            *[cast(staging.c[name], table.c[name].type) for name in columns],
+            literal(now),
+            literal(now),
+            true(),
+        ).order_by(staging.c.line)
+        stmt = pg_insert(table).from_select(
+            [*columns, "created_at", "updated_at", "is_active"], source
+        )
+        upserted = self._upsert_statement(stmt, columns).cte("upserted")
+        counts = select(
+            func.count().filter(upserted.c.inserted).label("inserted"),
+            func.count()
+            .filter(not_(upserted.c.inserted), upserted.c.was_active.isnot(False))
+            .label("updated"),
+            func.count()
+            .filter(not_(upserted.c.inserted), upserted.c.was_active.is_(False))
+            .label("reactivated"),
+        )
+        try:
+            outcome = dict(self.session.execute(counts).one()._mapping)
+        except IntegrityError:
+            raise
+        except SQLAlchemyError as e:
+            raise DatabaseError(f"Database error: {str(e)}") from e
+        outcome["unchanged"] = total - sum(outcome.values())
+        ROWS_INGESTED.labels(self.model.__tablename__).inc(total)
+        return outcome
+
+
+class AsyncBaseStorage:
+    """Async variant of a storage.
+    Each call runs the sync storage on the AsyncSession's underlying session
+    through run_sync, so queries go through asyncpg without blocking the
+    event loop while the storage logic is shared with the sync path.
+    """
+
+    storage_class: Type[BaseStorage] = BaseStorage
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def _run(self, method: str, *args, **kwargs):
+        def call(sync_session: Session):
+            storage = self.storage_class(session=sync_session)
+            return getattr(storage, method)(*args, **kwargs)
+
+        return await self.session.run_sync(call)
+
+    async def read(self, id: int, is_active_only: bool = True) -> BaseModel:
+        return await self._run("read", id, is_active_only=is_active_only)
+
+    async def refresh(self, db_obj: BaseModel) -> BaseModel:
+        return await self._run("refresh", db_obj)
+
+    async def create(self, model: BaseModel) -> BaseModel:
+        return await self._run("create", model)
+
+    async def update(self, id: int, data: dict) -> BaseModel:
+        return await self._run("update", id, data)
+
+    async def upsert(self, data: dict) -> BaseModel:
+        return await self._run("upsert", data)
+
+    async def delete(self, id: int, soft_delete: bool = True) -> None:
+        return await self._run("delete", id, soft_delete=soft_delete)
+
+    async def filter(self, **kwargs) -> List[BaseModel]:
+        return await self._run("filter", **kwargs)
+
+    async def all(
+        self, skip: int = 0, limit: int = 100, cursor: Optional[str] = None
+    ) -> List[BaseModel]:
+        return await self._run("all", skip=skip, limit=limit, cursor=cursor)
+
+    async def rows(
+        self,
+        schema: Type[PydanticBase],
+        skip: int = 0,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+    ) -> List[dict]:
+        return await self._run("rows", schema, skip=skip, limit=limit, cursor=cursor)
+
+    async def stream_rows(
+        self, schema: Type[PydanticBase], batch_size: int = 1000
+    ) -> AsyncIterator[List[dict]]:
+        """Stream every active record, in batches, as rows shaped like a schema.
+        Rows are read from a server-side cursor, so only one batch is held in
+        memory. The export is a single statement, hence every batch comes from
+        the same snapshot even while the table is being written to.
+        Args:
+            schema (Type[PydanticBase]): Response schema whose fields are selected.
+            batch_size (int, optional): Rows fetched per batch. Defaults to 1000.
+        Yields:
+            List[dict]: A batch of records, ordered by id.
+        """
+        storage = self.storage_class(session=self.session.sync_session)
+        query, to_records = storage.export_query(schema)
+        result = await self.session.stream(query)
+        async for partition in result.mappings().partitions(batch_size):
+            yield to_records(partition)
+
+    def next_cursor(
+        self, records: List[Union[BaseModel, dict]], limit: int
+    ) -> Optional[str]:
+        return self.storage_class.next_cursor(records, limit)
+
+    async def count(self, **kwargs) -> int:
+        return await self._run("count", **kwargs)
+
+    async def exists(self, id: int, **kwargs) -> bool:
+        return await self._run("exists", id, **kwargs)
+
+    async def existing_ids(
+        self, ids: Iterable[int], is_active: bool = True
+    ) -> Set[int]:
+        return await self._run("existing_ids", ids, is_active=is_active)
+
+    async def bulk_upsert(self, data: list) -> dict:
+        return await self._run("bulk_upsert", data)
@@ -0,0 +1,177 @@
+import bisect
+import select
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Optional, Set
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import config
+import util.storage as storage_utils
+from util.logger import get_logger
+
+_PENDING_KEY = "invalidate_id_caches"
+
+
+class IdCache:
+    """Per-worker cache of the ids of the active records of a table.
+    Ids are kept as a sorted array of 64 bit integers, so membership checks are
+    binary searches over a compact buffer. Entries expire after a TTL and are
+    dropped whenever a write deactivates or deletes records of the table.
+    """
+
+    def __init__(self, table_name: str, ttl: Optional[float] = None):
+        self.table_name = table_name
+        self.ttl = config.FK_CACHE_TTL if ttl is None else ttl
+        self._ids: Optional[array] = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def is_fresh(self) -> bool:
+        return self._ids is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def load(self, ids: Iterable[int], version: int) -> None:
+        """Replace the cached ids.
+        Args:
+            ids (Iterable[int]): Active ids of the table, in ascending order.
+            version (int): The cache version read before querying the ids. The load
+                is discarded if the cache was invalidated in the meantime.
+        """
+        ids = array("q", ids)
+        with self._lock:
+            if version != self._version:
+                return
+            self._ids = ids
+            self._loaded_at = time.monotonic()
+
+    def missing(self, ids: Iterable[int]) -> Optional[Set[int]]:
+        """Find which ids are not cached.
+        Args:
+            ids (Iterable[int]): IDs to look up.
+        Returns:
+            Optional[Set[int]]: The ids not in the cache, or None if the cache is not loaded.
+        """
+        cached = self._ids
+        if cached is None or not self.is_fresh():
+            return None
+        absent = set()
+        for id in ids:
+            index = bisect.bisect_left(cached, id)
+            if index == len(cached) or cached[index] != id:
+                absent.add(id)
+        return absent
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._ids = None
+
+
+_caches: Dict[str, IdCache] = {}
+
+
+def get_id_cache(table_name: str) -> Optional[IdCache]:
+    """Get the id cache of a table, or None if caching is disabled."""
+    if not config.FK_CACHE_ENABLED:
+        return None
+    if table_name not in _caches:
+        _caches[table_name] = IdCache(table_name)
+    return _caches[table_name]
+
+
+def invalidate_caches(table_name: Optional[str] = None) -> None:
+    """Drop the cached ids of a table, or of every table if none is given."""
+    for name, cache in list(_caches.items()):
+        if table_name is None or name == table_name:
+            cache.invalidate()
+
+
+def mark_stale(session: Session, table_name: str) -> None:
+    """Invalidate the cache of a table once the session commits.
+    Other workers are notified through NOTIFY, which Postgres delivers on commit.
+    Args:
+        session (Session): The session writing to the table.
+        table_name (str): The table being written.
+    """
+    if not config.FK_CACHE_ENABLED:
+        return
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    if table_name not in pending:
+        pending.add(table_name)
+        session.execute(func.pg_notify(config.FK_CACHE_CHANNEL, table_name).select())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    for table_name in session.info.pop(_PENDING_KEY, ()):
+        invalidate_caches(table_name)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+class CacheInvalidationListener(threading.Thread):
+    """Background thread invalidating the id caches on NOTIFY from other workers.
+    It holds a dedicated connection outside of the pool. Every cache is dropped
+    whenever the connection is (re)established, as notifications may have been
+    missed while it was down.
+    """
+
+    def __init__(self, engine: Optional[Engine] = None, channel: Optional[str] = None):
+        super().__init__(name="fk-cache-listener", daemon=True)
+        self.engine = engine or storage_utils.default_engine
+        self.channel = channel or config.FK_CACHE_CHANNEL
+        self.poll_interval = 0.2
+        self.retry_interval = 5.0
+        self._stopped = threading.Event()
+        self.logger = get_logger()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        self.join(timeout)
+
+    def _connect(self):
+        dialect = self.engine.dialect
+        args, kwargs = dialect.create_connect_args(self.engine.url)
+        connection = dialect.connect(*args, **kwargs)
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _listen(self, connection) -> None:
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([connection], [], [], self.poll_interval)
+            if not readable:
+                continue
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                invalidate_caches(notify.payload or None)
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self._connect()
+                invalidate_caches()
+                self._listen(connection)
+            except psycopg2.Error as e:
+                self.logger.warning(f"FK cache listener disconnected: {e}")
+                invalidate_caches()
+                self._stopped.wait(self.retry_interval)
+            finally:
+                if connection is not None:
+                    connection.close()
@@ -1,8 +1,15 @@
 from db.models import Department
-from db.storage.base import BaseStorage
+from db.storage.base import BaseStorage, AsyncBaseStorage
+from db.storage.cache import get_id_cache
 
 
 class DepartmentStorage(BaseStorage):
     def __init__(self, session):
         super().__init__(session)
         self.model = Department
+        self.unique_fields = ("department",)
+        self.id_cache = get_id_cache(self.model.__tablename__)
+
+
+class AsyncDepartmentStorage(AsyncBaseStorage):
+    storage_class = DepartmentStorage
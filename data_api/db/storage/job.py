@@ -1,8 +1,15 @@
 from db.models import Job
-from db.storage.base import BaseStorage
+from db.storage.base import BaseStorage, AsyncBaseStorage
+from db.storage.cache import get_id_cache
 
 
 class JobStorage(BaseStorage):
     def __init__(self, session):
         super().__init__(session)
         self.model = Job
+        self.unique_fields = ("job",)
+        self.id_cache = get_id_cache(self.model.__tablename__)
+
+
+class AsyncJobStorage(AsyncBaseStorage):
+    storage_class = JobStorage
@@ -1,54 +1,62 @@
+from typing import List
+
+from sqlalchemy.orm import joinedload
+
 from db.models import User
 from db.models.base import BaseModel
-from db.storage.base import BaseStorage
+from db.storage.base import BaseStorage, AsyncBaseStorage
 from db.storage.department import DepartmentStorage
 from db.storage.job import JobStorage
 from util.exceptions import BadForeignKey
+from util.storage import use_primary
 
 
 class UserStorage(BaseStorage):
     def __init__(self, session):
         super().__init__(session)
         self.model = User
-
-    def _check_fks(self, data: dict) -> None:
-        job_id = data.get("job_id")
-        department_id = data.get("department_id")
-        if job_id:
-            job_storage = JobStorage(session=self.session)
-            if not job_storage.exists(job_id):
-                raise BadForeignKey(fk_id=job_id, fk_name="job_id")
-
-        if department_id:
-            department_storage = DepartmentStorage(session=self.session)
-            if not department_storage.exists(department_id):
-                raise BadForeignKey(fk_id=department_id, fk_name="department_id")
+        self.unique_fields = ("name", "job_id", "department_id")
+        # Responses nest the job and department, load them in the same query
+        self.load_options = [joinedload(User.job), joinedload(User.department)]
+
+    def _check_fks(self, data: List[dict]) -> None:
+        """Check that the jobs and departments referenced by users exist.
+        Runs one query per foreign key column for the whole batch.
+        Args:
+            data (List[dict]): The user records to check.
+        """
+        # Referenced records may not have reached the replicas yet
+        use_primary(self.session)
+        storages = {
+            "job_id": JobStorage(session=self.session),
+            "department_id": DepartmentStorage(session=self.session),
+        }
+        missing = {}
+        for fk_name, storage in storages.items():
+            fk_ids = {user[fk_name] for user in data if user.get(fk_name) is not None}
+            absent = fk_ids - storage.existing_ids(fk_ids)
+            if absent:
+                missing[fk_name] = sorted(absent)
+        if missing:
+            raise BadForeignKey(missing)
 
     def update(self, id: int, data: dict) -> BaseModel:
-        self._check_fks(data)
+        self._check_fks([data])
         return super().update(id, data)
 
     def create(self, data: BaseModel) -> BaseModel:
         user_data = {"job_id": data.job_id, "department_id": data.department_id}
-        self._check_fks(user_data)
+        self._check_fks([user_data])
         return super().create(data)
 
     def upsert(self, data: dict) -> BaseModel:
-        self._check_fks(data)
+        self._check_fks([data])
         return super().upsert(data)
 
-    def bulk_upsert(self, data: list):
-        jobs_seen = set()
-        departments_seen = set()
-        for user in data:
-            job_fk = user.get("job_id")
-            department_fk = user.get("department_id")
-            user_fks = {}
-            if job_fk not in jobs_seen:
-                user_fks["job_id"] = job_fk
-                jobs_seen.add(job_fk)
-            if department_fk not in departments_seen:
-                user_fks["department_id"] = department_fk
-                departments_seen.add(department_fk)
-            self._check_fks(user_fks)
+    def bulk_upsert(self, data: list) -> dict:
+        self._check_fks(data)
         return super().bulk_upsert(data)
+
+
+class AsyncUserStorage(AsyncBaseStorage):
+    storage_class = UserStorage
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from db.models import engine, async_engine
+from db.replicas import replicas
+from util.logger import get_logger
+from util.metrics import PoolCollector
+from util.storage import get_session, use_primary
+
+router = APIRouter(tags=["monitoring"])
+
+
+def _engines() -> dict:
+    engines = {"primary": engine, "primary_async": async_engine}
+    for replica in replicas.replicas:
+        engines[replica.name] = replica.engine
+        if replica.async_engine is not None:
+            engines[f"{replica.name} (async)"] = replica.async_engine
+    return engines
+
+
+REGISTRY.register(PoolCollector(_engines))
+
+
+@router.get("/metrics", description="Metrics in the Prometheus text format")
+def get_metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@router.get("/health/live", description="Whether the process is up")
+def get_liveness():
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", description="Whether the API can serve requests")
+def get_readiness():
+    try:
+        with get_session() as session:
+            use_primary(session)
+            session.execute(text("SELECT 1"))
+    except DBAPIError as exc:
+        get_logger().warning(f"Not ready, the database is unreachable: {exc}")
+        return JSONResponse(
+            {"status": "unavailable", "detail": "Database unreachable"},
+            status_code=503,
+        )
+    return {"status": "ok", "replicas": replicas.status()}
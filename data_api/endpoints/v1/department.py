@@ -1,56 +1,85 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import conlist
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.exc import IntegrityError
 
+from db.schemas.bulk import BulkUpsertResponse
 from db.schemas.department import (
     DepartmentInsert,
     DepartmentResponse,
 )
-from db.storage.department import DepartmentStorage
+from db.storage.department import DepartmentStorage, AsyncDepartmentStorage
 from util.exceptions import RecordAlreadyExists
-from util.storage import get_session
+from util.storage import copy_csv, get_db
+from util.streaming import (
+    spool_csv_upload,
+    export_response,
+    ExportFormat,
+    CSV_REQUEST_BODY,
+)
 
 router = APIRouter(prefix="/department", tags=["department"])
 
 
 @router.post("/", response_model=DepartmentResponse, status_code=201)
-async def create_job(department: DepartmentInsert):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    department = storage.upsert(department.dict())
-    session.commit()
-    session.refresh(department)
+async def create_job(
+    department: DepartmentInsert, session: AsyncSession = Depends(get_db)
+):
+    storage = AsyncDepartmentStorage(session=session)
+    department = await storage.upsert(department.dict())
+    await session.commit()
+    department = await storage.refresh(department)
     return department
 
 
+@router.get("/export", description="Download all departments")
+async def export_departments(format: ExportFormat = ExportFormat.ndjson):
+    return export_response(
+        AsyncDepartmentStorage, DepartmentResponse, format, "departments"
+    )
+
+
 @router.get("/{department_id}", response_model=DepartmentResponse)
-async def get_job(department_id: int):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    db_obj = storage.read(department_id)
+async def get_job(department_id: int, session: AsyncSession = Depends(get_db)):
+    storage = AsyncDepartmentStorage(session=session)
+    db_obj = await storage.read(department_id)
     return db_obj
 
 
-@router.get("/", response_model=List[DepartmentResponse])
-async def get_jobs(limit: int = 10, offset: int = 0):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    db_obj = storage.all(limit=limit, skip=offset)
-    return db_obj
+@router.get("/", response_model=List[DepartmentResponse], response_class=ORJSONResponse)
+async def get_jobs(
+    limit: int = 10,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+):
+    storage = AsyncDepartmentStorage(session=session)
+    # Rows are selected and encoded as they are, skipping ORM and response model
+    rows = await storage.rows(
+        DepartmentResponse, limit=limit, skip=offset, cursor=cursor
+    )
+    headers = {}
+    next_cursor = storage.next_cursor(rows, limit)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return ORJSONResponse(rows, headers=headers)
 
 
 @router.patch("/{department_id}", response_model=DepartmentResponse)
-async def update_job(department_id: int, job: DepartmentInsert):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    db_obj = storage.update(department_id, job.dict())
+async def update_job(
+    department_id: int, job: DepartmentInsert, session: AsyncSession = Depends(get_db)
+):
+    storage = AsyncDepartmentStorage(session=session)
+    db_obj = await storage.update(department_id, job.dict())
     try:
-        session.commit()
+        await session.commit()
     except IntegrityError:
         raise RecordAlreadyExists(data=job.dict())
-    session.refresh(db_obj)
+    db_obj = await storage.refresh(db_obj)
     return db_obj
 
 
@@ -58,18 +87,37 @@ async def update_job(department_id: int, job: DepartmentInsert):
 async def delete_job(
     department_id: int,
     x_soft_delete: bool = Header(default=True),
+    session: AsyncSession = Depends(get_db),
 ):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    storage.delete(department_id, soft_delete=x_soft_delete)
-    session.commit()
+    storage = AsyncDepartmentStorage(session=session)
+    await storage.delete(department_id, soft_delete=x_soft_delete)
+    await session.commit()
 
 
-@router.post("/bulk", status_code=201)
+@router.post("/bulk", response_model=BulkUpsertResponse, status_code=201)
 async def bulk_insert(
-    departments: conlist(DepartmentInsert, min_items=1, max_items=1000)
+    departments: conlist(DepartmentInsert, min_items=1, max_items=1000),
+    session: AsyncSession = Depends(get_db),
 ):
-    session = get_session()
-    storage = DepartmentStorage(session=session)
-    storage.bulk_upsert([department.dict() for department in departments])
-    session.commit()
+    storage = AsyncDepartmentStorage(session=session)
+    outcome = await storage.bulk_upsert(
+        [department.dict() for department in departments]
+    )
+    await session.commit()
+    return outcome
+
+
+@router.post(
+    "/copy",
+    response_model=BulkUpsertResponse,
+    status_code=201,
+    openapi_extra=CSV_REQUEST_BODY,
+)
+async def copy_departments(request: Request, columns: Optional[str] = None):
+    """Load departments from a text/csv request body.
+    The first line is the header unless `columns` lists the column names.
+    """
+    file, fields = await spool_csv_upload(request, columns)
+    return await run_in_threadpool(
+        copy_csv, DepartmentStorage, file, fields, header=columns is None
+    )
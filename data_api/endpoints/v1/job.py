@@ -1,53 +1,76 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Header
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import conlist
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.exc import IntegrityError
 
+from db.schemas.bulk import BulkUpsertResponse
 from db.schemas.job import JobInsert, JobResponse
-from db.storage.job import JobStorage
+from db.storage.job import JobStorage, AsyncJobStorage
 from util.exceptions import RecordAlreadyExists
-from util.storage import get_session
+from util.storage import copy_csv, get_db
+from util.streaming import (
+    spool_csv_upload,
+    export_response,
+    ExportFormat,
+    CSV_REQUEST_BODY,
+)
 
 router = APIRouter(prefix="/job", tags=["job"])
 
 
 @router.post("/", response_model=JobResponse, status_code=201)
-async def create_job(job: JobInsert):
-    session = get_session()
-    storage = JobStorage(session=session)
-    job = storage.upsert(job.dict())
-    session.commit()
-    session.refresh(job)
+async def create_job(job: JobInsert, session: AsyncSession = Depends(get_db)):
+    storage = AsyncJobStorage(session=session)
+    job = await storage.upsert(job.dict())
+    await session.commit()
+    job = await storage.refresh(job)
     return job
 
 
+@router.get("/export", description="Download all jobs")
+async def export_jobs(format: ExportFormat = ExportFormat.ndjson):
+    return export_response(AsyncJobStorage, JobResponse, format, "jobs")
+
+
 @router.get("/{job_id}", response_model=JobResponse)
-async def get_job(job_id: int):
-    session = get_session()
-    storage = JobStorage(session=session)
-    db_obj = storage.read(job_id)
+async def get_job(job_id: int, session: AsyncSession = Depends(get_db)):
+    storage = AsyncJobStorage(session=session)
+    db_obj = await storage.read(job_id)
     return db_obj
 
 
-@router.get("/", response_model=List[JobResponse])
-async def get_jobs(limit: int = 10, offset: int = 0):
-    session = get_session()
-    storage = JobStorage(session=session)
-    db_obj = storage.all(limit=limit, skip=offset)
-    return db_obj
+@router.get("/", response_model=List[JobResponse], response_class=ORJSONResponse)
+async def get_jobs(
+    limit: int = 10,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+):
+    storage = AsyncJobStorage(session=session)
+    # Rows are selected and encoded as they are, skipping ORM and response model
+    rows = await storage.rows(JobResponse, limit=limit, skip=offset, cursor=cursor)
+    headers = {}
+    next_cursor = storage.next_cursor(rows, limit)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return ORJSONResponse(rows, headers=headers)
 
 
 @router.patch("/{job_id}", response_model=JobResponse)
-async def update_job(job_id: int, job: JobInsert):
-    session = get_session()
-    storage = JobStorage(session=session)
-    db_obj = storage.update(job_id, job.dict())
+async def update_job(
+    job_id: int, job: JobInsert, session: AsyncSession = Depends(get_db)
+):
+    storage = AsyncJobStorage(session=session)
+    db_obj = await storage.update(job_id, job.dict())
     try:
-        session.commit()
+        await session.commit()
     except IntegrityError:
         raise RecordAlreadyExists(data=job.dict())
-    session.refresh(db_obj)
+    db_obj = await storage.refresh(db_obj)
     return db_obj
 
 
@@ -55,16 +78,35 @@ async def update_job(job_id: int, job: JobInsert):
 async def delete_job(
     job_id: int,
     x_soft_delete: bool = Header(default=True),
+    session: AsyncSession = Depends(get_db),
 ):
-    session = get_session()
-    storage = JobStorage(session=session)
-    storage.delete(job_id, soft_delete=x_soft_delete)
-    session.commit()
-
-
-@router.post("/bulk", status_code=201)
-async def bulk_insert(jobs: conlist(JobInsert, min_items=1, max_items=1000)):
-    session = get_session()
-    storage = JobStorage(session=session)
-    storage.bulk_upsert([job.dict() for job in jobs])
-    session.commit()
+    storage = AsyncJobStorage(session=session)
+    await storage.delete(job_id, soft_delete=x_soft_delete)
+    await session.commit()
+
+
+@router.post("/bulk", response_model=BulkUpsertResponse, status_code=201)
+async def bulk_insert(
+    jobs: conlist(JobInsert, min_items=1, max_items=1000),
+    session: AsyncSession = Depends(get_db),
+):
+    storage = AsyncJobStorage(session=session)
+    outcome = await storage.bulk_upsert([job.dict() for job in jobs])
+    await session.commit()
+    return outcome
+
+
+@router.post(
+    "/copy",
+    response_model=BulkUpsertResponse,
+    status_code=201,
+    openapi_extra=CSV_REQUEST_BODY,
+)
+async def copy_jobs(request: Request, columns: Optional[str] = None):
+    """Load jobs from a text/csv request body.
+    The first line is the header unless `columns` lists the column names.
+    """
+    file, fields = await spool_csv_upload(request, columns)
+    return await run_in_threadpool(
+        copy_csv, JobStorage, file, fields, header=columns is None
+    )
@@ -1,40 +1,240 @@
-import io
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from enum import Enum
+from typing import Callable, List, Optional
 
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
-from reports.user import quarterly_hires, department_hires
-from util.streaming import buffer_to_generator
+from db.replicas import read_engine
+from reports.aggregate import (
+    aggregate_query,
+    aggregate_schema,
+    stream_aggregate,
+    Dimension,
+    Measure,
+)
+from reports.analytics import hires_snapshot
+from reports.cache import report_cache, report_etag, report_version
+from reports.formats import (
+    write_report,
+    ReportFormat,
+    ReportSchema,
+    REPORT_MEDIA_TYPES,
+)
+from reports.jobs import report_jobs, JobStatus
+from reports.queries import as_naive_utc, period_label, report_period, Period
+from reports.user import (
+    quarterly_hires_rows,
+    department_hires_rows,
+    QUARTERLY_HIRES_SCHEMA,
+    DEPARTMENT_HIRES_SCHEMA,
+)
+from util.exceptions import InvalidDateRange, RecordNotFound
+from util.metrics import timed_report
 
 router = APIRouter(prefix="/report", tags=["report"])
 
 
-@router.get("/quarterly_hires", description="Download quarterly hires")
-def get_quarterly_hires(year: Optional[int] = None):
-    year = year or datetime.now().year
-    data = quarterly_hires(year)
+class ReportName(str, Enum):
+    quarterly_hires = "quarterly_hires"
+    department_hires = "department_hires"
+
+
+REPORTS = {
+    ReportName.quarterly_hires: (QUARTERLY_HIRES_SCHEMA, quarterly_hires_rows),
+    ReportName.department_hires: (DEPARTMENT_HIRES_SCHEMA, department_hires_rows),
+}
+
+
+def _is_not_modified(
+    request: Request, etag: str, last_modified: Optional[datetime]
+) -> bool:
+    """Evaluate the conditional headers of a GET request."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _report_response(
+    request: Request,
+    name: str,
+    period: Period,
+    format: ReportFormat,
+    schema: ReportSchema,
+    rows: Callable,
+) -> Response:
+    """Serve a report from the cache, or stream it while caching it.
+    Args:
+        request (Request): The incoming request, for its conditional headers.
+        name (str): Name of the report.
+        period (Period): Year, or [start, end) range, of the report.
+        format (ReportFormat): Output format.
+        schema (ReportSchema): Columns of the report.
+        rows (Callable): Function streaming the rows of the report.
+    Returns:
+        Response: The report, or 304 Not Modified if the client has it already.
+    """
+    engine = read_engine()
+    label = period_label(period)
+    version, last_modified = report_version(period, engine)
+    etag = report_etag(name, label, format.value, version)
     headers = {
-        "Content-Disposition": f"attachment; filename=quarterly_hires_{year}.csv"
+        "Content-Disposition": f"attachment; filename={name}_{label}.{format.value}",
+        "Cache-Control": "no-cache",
+        "ETag": etag,
     }
-    buffer = io.StringIO()
-    data.to_csv(buffer, index=False)
+    if last_modified:
+        utc = last_modified.astimezone(timezone.utc)
+        headers["Last-Modified"] = format_datetime(utc, usegmt=True)
+    if _is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
 
-    return StreamingResponse(
-        buffer_to_generator(buffer), media_type="text/csv", headers=headers
+    media_type = REPORT_MEDIA_TYPES[format]
+    key = (name, label, format.value)
+    cached = report_cache.get(key, version)
+    if cached:
+        return Response(cached.body, media_type=media_type, headers=headers)
+    # Rows are encoded batch by batch as they are read from the cursor
+    content = write_report(schema, rows(period, engine=engine), format)
+    content = timed_report(name, content)
+    content = report_cache.store_while_streaming(key, content, version)
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
+@router.get("/quarterly_hires", description="Download quarterly hires")
+def get_quarterly_hires(
+    request: Request,
+    year: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: ReportFormat = ReportFormat.csv,
+):
+    return _report_response(
+        request,
+        "quarterly_hires",
+        report_period(year, start, end),
+        format,
+        QUARTERLY_HIRES_SCHEMA,
+        quarterly_hires_rows,
     )
 
 
 @router.get("/department_hires", description="Download department hires")
-def get_department_hires(year: Optional[int] = None):
-    year = year or datetime.now().year
-    data = department_hires(year)
-    headers = {
-        "Content-Disposition": f"attachment; filename=department_hires_{year}.csv"
-    }
-    buffer = io.StringIO()
-    data.to_csv(buffer, index=False)
+def get_department_hires(
+    request: Request,
+    year: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: ReportFormat = ReportFormat.csv,
+):
+    return _report_response(
+        request,
+        "department_hires",
+        report_period(year, start, end),
+        format,
+        DEPARTMENT_HIRES_SCHEMA,
+        department_hires_rows,
+    )
+
+
+@router.get("/aggregate", description="Download hires aggregated by any dimensions")
+def get_aggregate(
+    dimensions: List[Dimension] = Query(default=[]),
+    measures: List[Measure] = Query(default=[Measure.count]),
+    department_id: List[int] = Query(default=[]),
+    job_id: List[int] = Query(default=[]),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: ReportFormat = ReportFormat.csv,
+):
+    # Repeated dimensions or measures would only repeat their column
+    dimensions = list(dict.fromkeys(dimensions))
+    measures = list(dict.fromkeys(measures))
+    start, end = as_naive_utc(start), as_naive_utc(end)
+    if start is not None and end is not None and start >= end:
+        raise InvalidDateRange(start, end)
+    query = aggregate_query(
+        dimensions,
+        measures,
+        department_ids=department_id,
+        job_ids=job_id,
+        start=start,
+        end=end,
+    )
+    if hires_snapshot.is_fresh() and measures == [Measure.count]:
+        rows = hires_snapshot.aggregate(
+            dimensions,
+            department_ids=department_id,
+            job_ids=job_id,
+            start=start,
+            end=end,
+        )
+        batches = iter([rows])
+    else:
+        batches = stream_aggregate(query)
+    content = write_report(aggregate_schema(dimensions, measures), batches, format)
+    content = timed_report("aggregate", content)
+    name = "_".join(["hires", *[dimension.value for dimension in dimensions]])
+    headers = {"Content-Disposition": f"attachment; filename={name}.{format.value}"}
     return StreamingResponse(
-        buffer_to_generator(buffer), media_type="text/csv", headers=headers
+        content, media_type=REPORT_MEDIA_TYPES[format], headers=headers
+    )
+
+
+@router.post(
+    "/{name}/jobs",
+    status_code=202,
+    description="Render a report in the background, e.g. one over many years",
+)
+def create_report_job(
+    request: Request,
+    name: ReportName,
+    year: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: ReportFormat = ReportFormat.csv,
+):
+    period = report_period(year, start, end)
+    schema, rows = REPORTS[name]
+    # The job reads from the engine the report was versioned against
+    engine = read_engine()
+    label = period_label(period)
+    version, _ = report_version(period, engine)
+    job = report_jobs.submit(
+        key=(name.value, label, format.value, version),
+        filename=f"{name.value}_{label}.{format.value}",
+        media_type=REPORT_MEDIA_TYPES[format],
+        render=lambda: timed_report(
+            name.value, write_report(schema, rows(period, engine=engine), format)
+        ),
     )
+    headers = {"Location": str(request.url_for("get_report_job", job_id=job.id))}
+    return JSONResponse(job.as_dict(), status_code=202, headers=headers)
+
+
+@router.get(
+    "/jobs/{job_id}", description="Get the status, or the file, of a report job"
+)
+def get_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise RecordNotFound(job_id)
+    if job.status == JobStatus.done:
+        return FileResponse(job.path, media_type=job.media_type, filename=job.filename)
+    status_code = 200 if job.status == JobStatus.failed else 202
+    return JSONResponse(job.as_dict(), status_code=status_code)
+
+
+@router.get("/snapshot", description="Size and freshness of the hires snapshot")
+def get_snapshot_stats():
+    return hires_snapshot.stats()
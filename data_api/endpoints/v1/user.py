@@ -1,44 +1,71 @@
-from fastapi import APIRouter, Header
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import conlist
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
+from db.schemas.bulk import BulkUpsertResponse
 from db.schemas.user import UserResponse, UserInsert
-from db.storage.user import UserStorage
-from util.storage import get_session
+from db.storage.user import UserStorage, AsyncUserStorage
+from util.storage import copy_csv, get_db
+from util.streaming import (
+    spool_csv_upload,
+    export_response,
+    ExportFormat,
+    CSV_REQUEST_BODY,
+)
 
 router = APIRouter(prefix="/user", tags=["user"])
 
 
 @router.post("/", response_model=UserResponse, status_code=201)
-async def create_user(user: UserInsert):
-    session = get_session()
-    storage = UserStorage(session=session)
-    user = storage.upsert(user.dict())
-    session.commit()
-    session.refresh(user)
+async def create_user(user: UserInsert, session: AsyncSession = Depends(get_db)):
+    storage = AsyncUserStorage(session=session)
+    user = await storage.upsert(user.dict())
+    await session.commit()
+    user = await storage.refresh(user)
     return user
 
 
-@router.post("/bulk", status_code=201)
-async def create_users(users: conlist(UserInsert, min_items=1, max_items=1000)):
-    session = get_session()
-    storage = UserStorage(session=session)
-    storage.bulk_upsert([user.dict() for user in users])
-    session.commit()
+@router.post("/bulk", response_model=BulkUpsertResponse, status_code=201)
+async def create_users(
+    users: conlist(UserInsert, min_items=1, max_items=1000),
+    session: AsyncSession = Depends(get_db),
+):
+    storage = AsyncUserStorage(session=session)
+    outcome = await storage.bulk_upsert([user.dict() for user in users])
+    await session.commit()
+    return outcome
 
 
-@router.get("/", response_model=list[UserResponse])
-async def get_users(limit: int = 100, offset: int = 0):
-    session = get_session()
-    storage = UserStorage(session=session)
-    db_obj = storage.all(skip=offset, limit=limit)
-    return db_obj
+@router.get("/", response_model=list[UserResponse], response_class=ORJSONResponse)
+async def get_users(
+    limit: int = 100,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    session: AsyncSession = Depends(get_db),
+):
+    storage = AsyncUserStorage(session=session)
+    # Rows are selected and encoded as they are, skipping ORM and response model
+    rows = await storage.rows(UserResponse, skip=offset, limit=limit, cursor=cursor)
+    headers = {}
+    next_cursor = storage.next_cursor(rows, limit)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return ORJSONResponse(rows, headers=headers)
+
+
+@router.get("/export", description="Download all users")
+async def export_users(format: ExportFormat = ExportFormat.ndjson):
+    return export_response(AsyncUserStorage, UserResponse, format, "users")
 
 
 @router.get("/{user_id}", response_model=UserResponse)
-async def get_user(user_id: int):
-    session = get_session()
-    storage = UserStorage(session=session)
-    db_obj = storage.read(user_id)
+async def get_user(user_id: int, session: AsyncSession = Depends(get_db)):
+    storage = AsyncUserStorage(session=session)
+    db_obj = await storage.read(user_id)
     return db_obj
 
 
@@ -46,18 +73,35 @@ async def get_user(user_id: int):
 async def delete_user(
     user_id: int,
     x_soft_delete: bool = Header(default=True),
+    session: AsyncSession = Depends(get_db),
 ):
-    session = get_session()
-    storage = UserStorage(session=session)
-    storage.delete(user_id, soft_delete=x_soft_delete)
-    session.commit()
+    storage = AsyncUserStorage(session=session)
+    await storage.delete(user_id, soft_delete=x_soft_delete)
+    await session.commit()
 
 
 @router.patch("/{user_id}", response_model=UserResponse)
-async def update_user(user_id: int, user: UserInsert):
-    session = get_session()
-    storage = UserStorage(session=session)
-    db_obj = storage.update(user_id, user.dict())
-    session.commit()
-    session.refresh(db_obj)
+async def update_user(
+    user_id: int, user: UserInsert, session: AsyncSession = Depends(get_db)
+):
+    storage = AsyncUserStorage(session=session)
+    db_obj = await storage.update(user_id, user.dict())
+    await session.commit()
+    db_obj = await storage.refresh(db_obj)
     return db_obj
+
+
+@router.post(
+    "/copy",
+    response_model=BulkUpsertResponse,
+    status_code=201,
+    openapi_extra=CSV_REQUEST_BODY,
+)
+async def copy_users(request: Request, columns: Optional[str] = None):
+    """Load users from a text/csv request body.
+    The first line is the header unless `columns` lists the column names.
+    """
+    file, fields = await spool_csv_upload(request, columns)
+    return await run_in_threadpool(
+        copy_csv, UserStorage, file, fields, header=columns is None
+    )
@@ -1,19 +1,34 @@
 from fastapi import FastAPI
 
+import config
 from db.migrate import run_migrations
 from db.models import engine
-from endpoints import v1
+from db.replicas import ReplicaLagMonitor, replicas
+from db.storage.cache import CacheInvalidationListener
+from endpoints import monitoring, v1
+from reports.analytics import hires_snapshot, SnapshotRefresher
+from reports.jobs import report_jobs
 from util.exceptions import override_default_handlers
 from util.logger import get_logger
-from util.middleware import ExceptionMiddleware, LoggingMiddleware
+from util.middleware import (
+    ExceptionMiddleware,
+    LoggingMiddleware,
+    MetricsMiddleware,
+    ProfilingMiddleware,
+    QueryStatsMiddleware,
+)
 
 
 def create_app() -> FastAPI:
     """Create a FastAPI application."""
     api = FastAPI(debug=True, title="Data API", version="1.0.0")
     api.add_middleware(ExceptionMiddleware)
+    api.add_middleware(QueryStatsMiddleware)
+    api.add_middleware(ProfilingMiddleware)
     api.add_middleware(LoggingMiddleware)
+    api.add_middleware(MetricsMiddleware)
     api.include_router(v1.router)
+    api.include_router(monitoring.router)
     override_default_handlers(api)
     return api
 
@@ -28,11 +43,31 @@ def on_startup():
     logger.info("Running migrations...")
     run_migrations()
     logger.info("Migrations complete.")
+    if config.FK_CACHE_ENABLED:
+        app.state.cache_listener = CacheInvalidationListener()
+        app.state.cache_listener.start()
+    if replicas:
+        app.state.replica_monitor = ReplicaLagMonitor(replicas)
+        app.state.replica_monitor.start()
+    if config.ANALYTICS_SNAPSHOT_ENABLED:
+        app.state.snapshot_refresher = SnapshotRefresher(hires_snapshot)
+        app.state.snapshot_refresher.start()
 
 
 @app.on_event("shutdown")
 def on_shutdown():
     """Shutdown the database connection pool."""
+    listener = getattr(app.state, "cache_listener", None)
+    if listener:
+        listener.stop(timeout=5)
+    monitor = getattr(app.state, "replica_monitor", None)
+    if monitor:
+        monitor.stop(timeout=5)
+    refresher = getattr(app.state, "snapshot_refresher", None)
+    if refresher:
+        refresher.stop(timeout=5)
+    report_jobs.shutdown(wait=False)
+    replicas.dispose()
     engine.dispose()
 
 
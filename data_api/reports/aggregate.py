@@ -0,0 +1,164 @@
+from datetime import datetime
+from enum import Enum
+from typing import Iterator, List, Optional, Sequence
+
+from sqlalchemy import BigInteger, Date, Integer, cast, extract, func, select, tuple_
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+
+import config
+from db.models import Department, HiresAggregate, Job, User
+from db.replicas import read_engine
+from reports.formats import ReportSchema
+from reports.queries import is_quarter_start, quarter_of
+
+
+class Dimension(str, Enum):
+    department = "department"
+    job = "job"
+    year = "year"
+    quarter = "quarter"
+    month = "month"
+    day = "day"
+
+
+class Measure(str, Enum):
+    count = "count"
+
+
+DIMENSION_TYPES = {
+    Dimension.department: "string",
+    Dimension.job: "string",
+    Dimension.year: "int64",
+    Dimension.quarter: "int64",
+    Dimension.month: "int64",
+    Dimension.day: "date32",
+}
+MEASURE_TYPES = {Measure.count: "int64"}
+# Dimensions the hires aggregate is grouped by, finer ones need the user table
+AGGREGATE_DIMENSIONS = {
+    Dimension.department,
+    Dimension.job,
+    Dimension.year,
+    Dimension.quarter,
+}
+
+
+def aggregate_schema(
+    dimensions: Sequence[Dimension], measures: Sequence[Measure]
+) -> ReportSchema:
+    """Columns of an aggregation: its dimensions, then its measures."""
+    return [
+        (dimension.value, DIMENSION_TYPES[dimension]) for dimension in dimensions
+    ] + [(measure.value, MEASURE_TYPES[measure]) for measure in measures]
+
+
+def _uses_aggregate(
+    dimensions: Sequence[Dimension],
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> bool:
+    if not set(dimensions) <= AGGREGATE_DIMENSIONS:
+        return False
+    return all(moment is None or is_quarter_start(moment) for moment in (start, end))
+
+
+def aggregate_query(
+    dimensions: Sequence[Dimension],
+    measures: Sequence[Measure],
+    department_ids: Optional[List[int]] = None,
+    job_ids: Optional[List[int]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Select:
+    """Compile an aggregation of hires to one grouped statement.
+    Only whitelisted dimensions and measures are accepted, so no input ends up
+    in the SQL other than as bound parameters. Aggregations the hires aggregate
+    can answer are read from it rather than from the user table.
+    Args:
+        dimensions: Columns to group by, in order.
+        measures: Aggregates to compute for each group.
+        department_ids: Only count hires of these departments.
+        job_ids: Only count hires of these jobs.
+        start: Only count hires from this datetime, included.
+        end: Only count hires until this datetime, excluded.
+    Returns:
+        Select: The statement, ordered by its dimensions.
+    """
+    if _uses_aggregate(dimensions, start, end):
+        source = HiresAggregate
+        # Without dimensions there is always a row, with a NULL sum if none match
+        hires = func.coalesce(func.sum(HiresAggregate.hires), 0)
+        time_columns = {
+            Dimension.year: HiresAggregate.year,
+            Dimension.quarter: cast(HiresAggregate.quarter, Integer),
+        }
+        conditions = []
+        if start is not None:
+            key = tuple_(HiresAggregate.year, HiresAggregate.quarter)
+            conditions.append(key >= tuple_(*quarter_of(start)))
+        if end is not None:
+            key = tuple_(HiresAggregate.year, HiresAggregate.quarter)
+            conditions.append(key < tuple_(*quarter_of(end)))
+    else:
+        source = User
+        hires = func.count()
+        time_columns = {
+            Dimension.year: cast(extract("year", User.datetime), Integer),
+            Dimension.quarter: cast(extract("quarter", User.datetime), Integer),
+            Dimension.month: cast(extract("month", User.datetime), Integer),
+            Dimension.day: cast(User.datetime, Date),
+        }
+        conditions = [User.datetime.isnot(None)]
+        if start is not None:
+            conditions.append(User.datetime >= start)
+        if end is not None:
+            conditions.append(User.datetime < end)
+    if department_ids:
+        conditions.append(source.department_id.in_(department_ids))
+    if job_ids:
+        conditions.append(source.job_id.in_(job_ids))
+
+    columns, from_clause = [], source.__table__
+    for dimension in dimensions:
+        if dimension == Dimension.department:
+            column = Department.department
+            from_clause = from_clause.join(
+                Department.__table__, Department.id == source.department_id
+            )
+        elif dimension == Dimension.job:
+            column = Job.job
+            from_clause = from_clause.join(Job.__table__, Job.id == source.job_id)
+        else:
+            column = time_columns[dimension]
+        columns.append(column)
+    measure_columns = {Measure.count: cast(hires, BigInteger)}
+    return (
+        select(
+            *[column.label(d.value) for column, d in zip(columns, dimensions)],
+            *[measure_columns[measure].label(measure.value) for measure in measures],
+        )
+        .select_from(from_clause)
+        .where(*conditions)
+        .group_by(*columns)
+        .order_by(*columns)
+    )
+
+
+def stream_aggregate(
+    query: Select, engine: Optional[Engine] = None, batch_size: Optional[int] = None
+) -> Iterator[List[tuple]]:
+    """Run an aggregation on a server-side cursor and yield its rows in batches.
+    Args:
+        query: The statement, see aggregate_query.
+        engine: The database engine to use. Defaults to a replica, or the primary.
+        batch_size: Rows fetched from the cursor at a time. Defaults to EXPORT_BATCH_SIZE.
+    Returns:
+        Batches of rows, with the columns of the aggregate_schema.
+    """
+    engine = engine or read_engine()
+    batch_size = batch_size or config.EXPORT_BATCH_SIZE
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(query)
+        for partition in result.partitions(batch_size):
+            yield [tuple(row) for row in partition]
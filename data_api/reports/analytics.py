@@ -0,0 +1,318 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import config
+from db.replicas import read_engine
+from reports.aggregate import Dimension
+from util.logger import get_logger
+
+# Rows are fetched again if updated up to this long before the watermark, for
+# the skew between the clocks of the API, which sets updated_at, and the database
+_WATERMARK_OVERLAP = timedelta(seconds=60)
+_EPOCH = date(1970, 1, 1)
+
+USERS_QUERY = """
+SELECT id, datetime, department_id, job_id, is_active, updated_at
+FROM public."user"
+{where}
+ORDER BY id
+"""
+# Rows not visible yet belong to transactions still running, which set their
+# updated_at after they started. The watermark is the start of the oldest one
+# that has written, by the database clock, so that a long COPY committing after
+# later writes is fetched once committed. A replica does not see the
+# transactions of the primary, only the time of the last one it replayed.
+WATERMARK_QUERY = """
+SELECT LEAST(
+    statement_timestamp(),
+    CASE WHEN pg_is_in_recovery() THEN pg_last_xact_replay_timestamp() END,
+    (SELECT MIN(xact_start) FROM pg_stat_activity WHERE backend_xid IS NOT NULL)
+) AT TIME ZONE 'UTC'
+"""
+
+
+class _Columns:
+    """Columns of the user table as arrays sorted by id. Never modified once
+    built, so queries can keep using them while a refresh builds new ones.
+    """
+
+    def __init__(self, ids, hired_at, department_id, job_id, is_active):
+        self.ids = ids
+        self.hired_at = hired_at
+        self.department_id = department_id
+        self.job_id = job_id
+        self.is_active = is_active
+
+    @property
+    def arrays(self) -> List[np.ndarray]:
+        return [
+            self.ids,
+            self.hired_at,
+            self.department_id,
+            self.job_id,
+            self.is_active,
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays)
+
+    def merge(self, changes: "_Columns") -> "_Columns":
+        """Overwrite the changed rows and add the new ones."""
+        if not len(self.ids):
+            return changes
+        positions = np.searchsorted(self.ids, changes.ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == changes.ids[found]
+        arrays = [array.copy() for array in self.arrays]
+        for array, changed in zip(arrays, changes.arrays):
+            array[positions[found]] = changed[found]
+        if found.all():
+            return _Columns(*arrays)
+        arrays = [
+            np.concatenate([array, changed[~found]])
+            for array, changed in zip(arrays, changes.arrays)
+        ]
+        order = np.argsort(arrays[0], kind="stable")
+        return _Columns(*[array[order] for array in arrays])
+
+
+def _keys(
+    dimension: Dimension, columns: _Columns, mask: np.ndarray, hired_at: np.ndarray
+) -> np.ndarray:
+    """Values of a dimension as integers, for the hires selected by the mask."""
+    if dimension == Dimension.department:
+        return columns.department_id[mask]
+    if dimension == Dimension.job:
+        return columns.job_id[mask]
+    if dimension == Dimension.year:
+        return hired_at.astype("datetime64[Y]").astype(np.int64) + 1970
+    if dimension == Dimension.day:
+        return hired_at.astype("datetime64[D]").astype(np.int64)
+    months = hired_at.astype("datetime64[M]").astype(np.int64) % 12
+    return months // 3 + 1 if dimension == Dimension.quarter else months + 1
+
+
+class _State:
+    def __init__(
+        self,
+        columns: _Columns,
+        departments: Dict[int, str],
+        jobs: Dict[int, str],
+        watermark: Optional[datetime],
+    ):
+        self.columns = columns
+        self.departments = departments
+        self.jobs = jobs
+        self.watermark = watermark
+
+
+class HiresSnapshot:
+    """In-process columnar copy of the user table, for repeated aggregations.
+    Refreshes fetch the users updated since the last one, by their updated_at
+    watermark, see WATERMARK_QUERY. Hard deletes do not show up there, nor on a
+    replica the transactions running longer than the watermark overlap, so the
+    whole table is reloaded every ANALYTICS_FULL_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(
+        self,
+        engine: Optional[Engine] = None,
+        full_refresh_interval: Optional[float] = None,
+        max_lag: Optional[float] = None,
+    ):
+        self.engine = engine
+        self.full_refresh_interval = (
+            config.ANALYTICS_FULL_REFRESH_INTERVAL
+            if full_refresh_interval is None
+            else full_refresh_interval
+        )
+        self.max_lag = config.ANALYTICS_MAX_LAG if max_lag is None else max_lag
+        self._state: Optional[_State] = None
+        self._refresh_lock = threading.Lock()
+        self._refreshed_at: Optional[float] = None
+        self._fully_refreshed_at: Optional[float] = None
+        self._refresh_duration = 0.0
+
+    def _fetch_users(self, connection, since: Optional[datetime]) -> _Columns:
+        where, params = "", {}
+        if since is not None:
+            where, params = "WHERE updated_at > :since", {"since": since}
+        result = connection.execution_options(stream_results=True).execute(
+            text(USERS_QUERY.format(where=where)), params
+        )
+        ids, hired_at, department_id, job_id, is_active = [], [], [], [], []
+        for partition in result.partitions(config.EXPORT_BATCH_SIZE):
+            for row in partition:
+                ids.append(row.id)
+                hired_at.append(row.datetime)
+                department_id.append(row.department_id)
+                job_id.append(row.job_id)
+                is_active.append(row.is_active is not False)
+        return _Columns(
+            np.array(ids, dtype=np.int64),
+            np.array(hired_at, dtype="datetime64[us]"),
+            np.array(department_id, dtype=np.int64),
+            np.array(job_id, dtype=np.int64),
+            np.array(is_active, dtype=bool),
+        )
+
+    def refresh(self, full: bool = False) -> int:
+        """Bring the snapshot up to date with the user table.
+        Args:
+            full (bool): Reload the whole table. Done anyway on the first refresh,
+                and once the full refresh interval has passed.
+        Returns:
+            int: Number of users fetched.
+        """
+        with self._refresh_lock:
+            started = time.monotonic()
+            state = self._state
+            if state is None:
+                full = True
+            elif started - self._fully_refreshed_at >= self.full_refresh_interval:
+                full = True
+            since = None
+            if not full and state.watermark is not None:
+                since = state.watermark - _WATERMARK_OVERLAP
+            engine = self.engine or read_engine()
+            with engine.connect() as connection:
+                # Taken first, the rows committed meanwhile are fetched again
+                watermark = connection.execute(text(WATERMARK_QUERY)).scalar()
+                changes = self._fetch_users(connection, since)
+                departments = dict(
+                    connection.execute(
+                        text("SELECT id, department FROM department")
+                    ).all()
+                )
+                jobs = dict(connection.execute(text("SELECT id, job FROM job")).all())
+            if full:
+                columns = changes
+            else:
+                columns = state.columns.merge(changes)
+            self._state = _State(columns, departments, jobs, watermark)
+            self._refreshed_at = time.monotonic()
+            if full:
+                self._fully_refreshed_at = self._refreshed_at
+            self._refresh_duration = self._refreshed_at - started
+            return len(changes.ids)
+
+    @property
+    def lag(self) -> float:
+        """Seconds since the last refresh, infinite before the first one."""
+        if self._refreshed_at is None:
+            return float("inf")
+        return time.monotonic() - self._refreshed_at
+
+    def is_fresh(self) -> bool:
+        return self._state is not None and self.lag <= self.max_lag
+
+    def stats(self) -> dict:
+        state = self._state
+        return {
+            "rows": len(state.columns.ids) if state else 0,
+            "memory_bytes": state.columns.nbytes if state else 0,
+            "refresh_lag": self.lag if state else None,
+            "refresh_duration": self._refresh_duration,
+            "watermark": (
+                state.watermark.isoformat() if state and state.watermark else None
+            ),
+        }
+
+    def aggregate(
+        self,
+        dimensions: Sequence[Dimension],
+        department_ids: Optional[List[int]] = None,
+        job_ids: Optional[List[int]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[tuple]:
+        """Count hires by dimensions, like aggregate_query does in SQL.
+        Args:
+            dimensions: Columns to group by, in order.
+            department_ids: Only count hires of these departments.
+            job_ids: Only count hires of these jobs.
+            start: Only count hires from this datetime, included.
+            end: Only count hires until this datetime, excluded.
+        Returns:
+            List[tuple]: Rows of the dimensions and the count, ordered by the dimensions.
+        """
+        state = self._state
+        columns = state.columns
+        hired_at = columns.hired_at
+        mask = ~np.isnat(hired_at)
+        if start is not None:
+            mask &= hired_at >= np.datetime64(start, "us")
+        if end is not None:
+            mask &= hired_at < np.datetime64(end, "us")
+        if department_ids:
+            mask &= np.isin(columns.department_id, department_ids)
+        if job_ids:
+            mask &= np.isin(columns.job_id, job_ids)
+        # Hires of unknown departments or jobs are left out, like by an inner join
+        if Dimension.department in dimensions:
+            mask &= np.isin(columns.department_id, list(state.departments))
+        if Dimension.job in dimensions:
+            mask &= np.isin(columns.job_id, list(state.jobs))
+        if not dimensions:
+            return [(int(mask.sum()),)]
+
+        hired_at = hired_at[mask]
+        stacked = np.stack(
+            [_keys(dimension, columns, mask, hired_at) for dimension in dimensions],
+            axis=1,
+        )
+        groups, counts = np.unique(stacked, axis=0, return_counts=True)
+        decoders = {
+            Dimension.department: state.departments.__getitem__,
+            Dimension.job: state.jobs.__getitem__,
+            Dimension.day: lambda days: _EPOCH + timedelta(days=days),
+        }
+        rows = [
+            (
+                *[
+                    decoders.get(dimension, int)(int(value))
+                    for dimension, value in zip(dimensions, group)
+                ],
+                int(count),
+            )
+            for group, count in zip(groups, counts)
+        ]
+        # Groups are sorted by id, reports are ordered by name
+        if Dimension.department in dimensions or Dimension.job in dimensions:
+            rows.sort(key=lambda row: row[:-1])
+        return rows
+
+
+class SnapshotRefresher(threading.Thread):
+    """Background thread refreshing a snapshot at a fixed interval."""
+
+    def __init__(self, snapshot: HiresSnapshot, interval: Optional[float] = None):
+        super().__init__(name="snapshot-refresher", daemon=True)
+        self.snapshot = snapshot
+        self.interval = (
+            config.ANALYTICS_REFRESH_INTERVAL if interval is None else interval
+        )
+        self._stopped = threading.Event()
+        self.logger = get_logger()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        self.join(timeout)
+
+    def run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.snapshot.refresh()
+            except Exception:
+                self.logger.exception("Could not refresh the hires snapshot")
+            self._stopped.wait(self.interval)
+
+
+hires_snapshot = HiresSnapshot()
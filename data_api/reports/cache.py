@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, Iterable, Iterator, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import config
+from reports.queries import period_years, Period
+
+
+class CachedReport:
+    """A rendered report, valid for one version of the hires of its year."""
+
+    def __init__(self, body: bytes, version: int, ttl: float):
+        self.body = body
+        self.version = version
+        self.expires_at = time.monotonic() + ttl
+
+    def is_valid(self, version: int) -> bool:
+        return self.version == version and time.monotonic() < self.expires_at
+
+
+class ReportCache:
+    """In-process LRU cache of rendered reports, with a TTL.
+    Entries are looked up along with the current version of their year, so a
+    change to the hires of a year makes its cached reports miss on every worker.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        max_entry_size: Optional[int] = None,
+    ):
+        self.max_entries = max_entries or config.REPORT_CACHE_SIZE
+        self.ttl = config.REPORT_CACHE_TTL if ttl is None else ttl
+        self.max_entry_size = max_entry_size or config.REPORT_CACHE_MAX_ENTRY_SIZE
+        self._entries: "OrderedDict[Hashable, CachedReport]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, version: int) -> Optional[CachedReport]:
+        """Get a cached report.
+        Args:
+            key (Hashable): The report name, period and format.
+            version (int): The current version of the report's year.
+        Returns:
+            Optional[CachedReport]: The report, or None if it is missing, stale or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not entry.is_valid(version):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, entry: CachedReport) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def store_while_streaming(
+        self, key: Hashable, chunks: Iterable[Union[str, bytes]], version: int
+    ) -> Iterator[bytes]:
+        """Pass the chunks of a report through, caching it once fully sent.
+        Reports larger than the maximum entry size are streamed but not cached.
+        """
+        parts, size = [], 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            yield chunk
+            if parts is not None:
+                size += len(chunk)
+                if size > self.max_entry_size:
+                    parts = None
+                else:
+                    parts.append(chunk)
+        if parts is not None:
+            body = b"".join(parts)
+            self.put(key, CachedReport(body, version, self.ttl))
+
+
+report_cache = ReportCache()
+
+
+def report_version(period: Period, engine: Engine) -> Tuple[int, Optional[datetime]]:
+    """Get the version of the hires of a period.
+    Args:
+        period (Period): The year, or date range.
+        engine (Engine): The engine the report is read from.
+    Returns:
+        Tuple[int, Optional[datetime]]: The version, and when it last changed.
+            Versions of each year only grow, so their sum changes whenever the
+            hires of any year of the period do. Years without hires ever
+            recorded are at version 0.
+    """
+    query = text(
+        "SELECT COALESCE(SUM(version), 0) AS version, MAX(updated_at) AS updated_at "
+        "FROM report_version WHERE year BETWEEN :first_year AND :last_year"
+    )
+    first_year, last_year = period_years(period)
+    with engine.connect() as connection:
+        row = connection.execute(
+            query, {"first_year": first_year, "last_year": last_year}
+        ).first()
+    return row.version, row.updated_at
+
+
+def report_etag(name: str, period: str, format: str, version: int) -> str:
+    return f'"{name}-{period}-{format}-{version}"'
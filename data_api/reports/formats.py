@@ -0,0 +1,111 @@
+import io
+from enum import Enum
+from typing import Iterable, Iterator, List, Tuple
+
+from util.streaming import csv_stream
+
+# Report columns as (name, Arrow type name) pairs
+ReportSchema = List[Tuple[str, str]]
+
+
+class ReportFormat(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+    arrow = "arrow"
+
+
+REPORT_MEDIA_TYPES = {
+    ReportFormat.csv: "text/csv",
+    ReportFormat.parquet: "application/vnd.apache.parquet",
+    ReportFormat.arrow: "application/vnd.apache.arrow.stream",
+}
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what is written until it is drained.
+    Lets the Arrow writers stream their output instead of building it in memory.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_batches(schema, batches: Iterable[List[tuple]]):
+    import pyarrow as pa
+
+    for batch in batches:
+        if not batch:
+            continue
+        columns = list(zip(*batch))
+        yield pa.record_batch(
+            [
+                pa.array(values, type=field.type)
+                for values, field in zip(columns, schema)
+            ],
+            schema=schema,
+        )
+
+
+def _arrow_stream(
+    schema: ReportSchema, batches: Iterable[List[tuple]], format: ReportFormat
+) -> Iterator[bytes]:
+    # Imported here, so that the API starts without loading pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrow_schema = pa.schema(
+        [(name, pa.type_for_alias(type_name)) for name, type_name in schema]
+    )
+    sink = _ChunkSink()
+    if format == ReportFormat.parquet:
+        writer = pq.ParquetWriter(sink, arrow_schema)
+    else:
+        writer = pa.ipc.new_stream(sink, arrow_schema)
+    try:
+        for record_batch in _arrow_batches(arrow_schema, batches):
+            writer.write_batch(record_batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    # The schema, or the Parquet footer, is written on close
+    yield sink.drain()
+
+
+def write_report(
+    schema: ReportSchema, batches: Iterable[List[tuple]], format: ReportFormat
+) -> Iterator[bytes]:
+    """Encode batches of report rows, one chunk per batch.
+    Parquet (a row group per batch) and Arrow IPC stream output is built
+    directly from the rows as Arrow record batches, keeping the column types.
+    Args:
+        schema (ReportSchema): The report columns and their Arrow type names.
+        batches (Iterable[List[tuple]]): Batches of rows, e.g. read from a cursor.
+        format (ReportFormat): The output format.
+    Yields:
+        bytes: The encoded report, as it is produced.
+    """
+    if format == ReportFormat.csv:
+        columns = [name for name, _ in schema]
+        for chunk in csv_stream(columns, batches):
+            yield chunk.encode("utf-8")
+    else:
+        yield from _arrow_stream(schema, batches, format)
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, Hashable, Iterable, Optional
+
+import config
+from util.logger import get_logger
+
+
+class JobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ReportJob:
+    """A report rendered in the background to a file."""
+
+    def __init__(self, key: Hashable, filename: str, media_type: str, directory: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.filename = filename
+        self.media_type = media_type
+        self.path = os.path.join(directory, self.id)
+        self.status = JobStatus.pending
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status.value,
+            "filename": self.filename,
+            "error": self.error,
+        }
+
+
+class ReportJobManager:
+    """Bounded pool of workers rendering reports to files.
+    Identical requests share a job for as long as it has not failed, and
+    finished jobs are kept, along with their files, until their TTL expires.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        workers: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.directory = directory or config.REPORT_JOB_DIR
+        self.ttl = config.REPORT_JOB_TTL if ttl is None else ttl
+        self.workers = workers or config.REPORT_JOB_WORKERS
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, ReportJob] = {}
+        self._by_key: Dict[Hashable, ReportJob] = {}
+        self._lock = threading.Lock()
+        self.logger = get_logger()
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def submit(
+        self,
+        key: Hashable,
+        filename: str,
+        media_type: str,
+        render: Callable[[], Iterable[bytes]],
+    ) -> ReportJob:
+        """Render a report in the background, unless it already is.
+        Args:
+            key (Hashable): Identifies the report, e.g. name, period, format and version.
+            filename (str): Name of the file sent to the client.
+            media_type (str): Media type of the file.
+            render (Callable): Function returning the chunks of the report.
+        Returns:
+            ReportJob: The new job, or the job already rendering the report.
+        """
+        self._expire()
+        with self._lock:
+            job = self._by_key.get(key)
+            if job and job.status != JobStatus.failed:
+                return job
+            os.makedirs(self.directory, exist_ok=True)
+            job = ReportJob(key, filename, media_type, self.directory)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="report-job"
+                )
+            self._executor.submit(self._run, job, render)
+        return job
+
+    def _run(self, job: ReportJob, render: Callable[[], Iterable[bytes]]) -> None:
+        job.status = JobStatus.running
+        partial_path = f"{job.path}.partial"
+        try:
+            with open(partial_path, "wb") as file:
+                for chunk in render():
+                    file.write(chunk)
+            # Finished files appear at once, never half written
+            os.replace(partial_path, job.path)
+        except Exception as exc:
+            self.logger.exception(f"Report job {job.id} failed")
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            job.error = str(exc)
+            job.finished_at = time.monotonic()
+            job.status = JobStatus.failed
+        else:
+            job.finished_at = time.monotonic()
+            job.status = JobStatus.done
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                job
+                for job in self._jobs.values()
+                if job.finished_at is not None and now - job.finished_at > self.ttl
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+                if self._by_key.get(job.key) is job:
+                    del self._by_key[job.key]
+        for job in expired:
+            if os.path.exists(job.path):
+                os.remove(job.path)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers, dropping the jobs not started yet."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+report_jobs = ReportJobManager()
@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, CursorResult, Engine
+from sqlalchemy.pool import StaticPool
+
+import config
+from db.replicas import read_engine
+from util.exceptions import InvalidDateRange
+
+# A year, or a [start, end) range of datetimes
+DateRange = Tuple[datetime, datetime]
+Period = Union[int, DateRange]
+
+# Hires counted by a report, as (department_id, job_id, quarter, hires) rows.
+# Ranges made of whole quarters are read from the hires aggregate through its
+# primary key; any other range from the user table through its datetime index.
+_SOURCES = {
+    "aggregate": (
+        "int, int, int, int",
+        """
+        SELECT department_id, job_id, quarter, hires
+        FROM public.hires_aggregate
+        WHERE (year, quarter) >= ($1, $2) AND (year, quarter) < ($3, $4)
+        """,
+    ),
+    "user": (
+        "timestamp, timestamp",
+        """
+        SELECT department_id, job_id, EXTRACT(QUARTER FROM datetime)::int AS quarter, 1 AS hires
+        FROM public."user"
+        WHERE datetime >= $1 AND datetime < $2
+        """,
+    ),
+}
+
+
+def date_range(period: Period) -> DateRange:
+    """The [start, end) range of a year, or the range itself."""
+    if isinstance(period, int):
+        return datetime(period, 1, 1), datetime(period + 1, 1, 1)
+    return period
+
+
+def as_naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """The user table stores naive datetimes, taken as UTC."""
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def report_period(
+    year: Optional[int], start: Optional[datetime], end: Optional[datetime]
+) -> Period:
+    """Resolve the period requested for a report.
+    Args:
+        year: A calendar year. Defaults to the current year.
+        start: Start of a range, included. Takes precedence over the year.
+        end: End of a range, excluded.
+    Returns:
+        Period: The year, or the range.
+    Raises:
+        InvalidDateRange: If only one end of the range is given, or it is empty.
+    """
+    if start is None and end is None:
+        return year or datetime.now().year
+    if start is None or end is None:
+        raise InvalidDateRange(start, end)
+    start, end = as_naive_utc(start), as_naive_utc(end)
+    if start >= end:
+        raise InvalidDateRange(start, end)
+    return start, end
+
+
+def period_label(period: Period) -> str:
+    """Short name of a period, e.g. for file names: 2021 or 20210701-20220101."""
+    if isinstance(period, int):
+        return str(period)
+    if period == date_range(period[0].year):
+        return str(period[0].year)
+    is_dates = all(moment.time() == datetime.min.time() for moment in period)
+    fmt = "%Y%m%d" if is_dates else "%Y%m%dT%H%M%S"
+    return "-".join(moment.strftime(fmt) for moment in period)
+
+
+def period_years(period: Period) -> Tuple[int, int]:
+    """First and last year a period touches."""
+    start, end = date_range(period)
+    return start.year, (end - timedelta(microseconds=1)).year
+
+
+def split_by_year(start: datetime, end: datetime) -> List[DateRange]:
+    """Split a range at the start of each year."""
+    ranges = []
+    while start < end:
+        boundary = min(datetime(start.year + 1, 1, 1), end)
+        ranges.append((start, boundary))
+        start = boundary
+    return ranges
+
+
+def is_quarter_start(moment: datetime) -> bool:
+    return moment.month % 3 == 1 and moment == datetime(moment.year, moment.month, 1)
+
+
+def quarter_of(moment: datetime) -> Tuple[int, int]:
+    return moment.year, (moment.month - 1) // 3 + 1
+
+
+class ReportQuery:
+    """A report query over a date range, prepared once per connection.
+    Args:
+        name: Name of the prepared statements.
+        sql: The query, selecting from the {source} hires of the range as h.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+    def _prepare(self, connection: Connection, source: str) -> str:
+        statement = f"{self.name}_{source}"
+        # Cleared by the pool along with the statements when it reconnects
+        prepared = connection.info.setdefault("prepared_statements", set())
+        if statement not in prepared:
+            types, hires = _SOURCES[source]
+            sql = self.sql.format(source=f"({hires})")
+            connection.execute(text(f"PREPARE {statement} ({types}) AS {sql}"))
+            prepared.add(statement)
+        return statement
+
+    def execute(
+        self, connection: Connection, start: datetime, end: datetime
+    ) -> CursorResult:
+        """Run the query over a [start, end) range.
+        Args:
+            connection: The connection, keeping its prepared statements.
+            start: Start of the range, included.
+            end: End of the range, excluded.
+        Returns:
+            CursorResult: The rows of the report.
+        """
+        if is_quarter_start(start) and is_quarter_start(end):
+            source, values = "aggregate", [*quarter_of(start), *quarter_of(end)]
+        else:
+            source, values = "user", [start, end]
+        statement = self._prepare(connection, source)
+        params = {f"p{i}": value for i, value in enumerate(values)}
+        placeholders = ", ".join(f":{name}" for name in params)
+        return connection.execute(text(f"EXECUTE {statement}({placeholders})"), params)
+
+
+def run_report(
+    query: ReportQuery,
+    period: Period,
+    merge: Callable[[List[List[tuple]]], List[tuple]],
+    engine: Optional[Engine] = None,
+    batch_size: Optional[int] = None,
+    partial_query: Optional[ReportQuery] = None,
+) -> Iterator[List[tuple]]:
+    """Run a report over a period, in batches of rows.
+    Periods spanning several years are run a year at a time, in parallel on
+    connections of the pool, and their results merged.
+    Args:
+        query: The report query.
+        period: The year, or [start, end) range, of the report.
+        merge: Function merging the rows of each year into the report.
+        engine: The database engine to use. Defaults to a replica, or the primary.
+        batch_size: Rows per batch. Defaults to EXPORT_BATCH_SIZE.
+        partial_query: Query run on each year when it differs from the report query.
+    Returns:
+        Batches of rows of the report.
+    """
+    engine = engine or read_engine()
+    batch_size = batch_size or config.EXPORT_BATCH_SIZE
+    start, end = date_range(period)
+    ranges = split_by_year(start, end)
+    if len(ranges) <= 1:
+        with engine.connect() as connection:
+            result = query.execute(connection, start, end)
+            for partition in result.partitions(batch_size):
+                yield [tuple(row) for row in partition]
+        return
+
+    partial_query = partial_query or query
+
+    def run(year_range: DateRange) -> List[tuple]:
+        with engine.connect() as connection:
+            return [
+                tuple(row) for row in partial_query.execute(connection, *year_range)
+            ]
+
+    workers = min(len(ranges), config.REPORT_MAX_WORKERS)
+    if isinstance(engine.pool, StaticPool):
+        # Every checkout is the same connection, which cannot run queries in parallel
+        workers = 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rows = merge(list(executor.map(run, ranges)))
+    for offset in range(0, len(rows), batch_size):
+        stop = offset + batch_size
+        yield rows[offset:stop]
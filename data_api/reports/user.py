@@ -1,65 +1,172 @@
-from typing import Optional
+from typing import TYPE_CHECKING, Iterator, List, Optional
 
-import pandas as pd
 from sqlalchemy.engine import Engine
 
-from db.models import engine as default_engine
+from reports.queries import run_report, Period, ReportQuery
 
+if TYPE_CHECKING:
+    import pandas as pd
 
-def quarterly_hires(year: int, engine: Optional[Engine] = None) -> pd.DataFrame:
-    """Returns a dataframe of quarterly hires for a given year."""
-    query = f"""
+# Columns of the streamed reports, with their Arrow type names
+QUARTERLY_HIRES_SCHEMA = [
+    ("department_name", "string"),
+    ("job_title", "string"),
+    ("Q1", "int64"),
+    ("Q2", "int64"),
+    ("Q3", "int64"),
+    ("Q4", "int64"),
+]
+DEPARTMENT_HIRES_SCHEMA = [
+    ("id", "int64"),
+    ("department", "string"),
+    ("hired", "int64"),
+]
+QUARTERLY_HIRES_COLUMNS = [name for name, _ in QUARTERLY_HIRES_SCHEMA]
+DEPARTMENT_HIRES_COLUMNS = [name for name, _ in DEPARTMENT_HIRES_SCHEMA]
+
+
+QUARTERLY_HIRES = ReportQuery(
+    "quarterly_hires",
+    """
     SELECT
         d.department as department_name,
         j.job as job_title,
-        concat('Q',EXTRACT(QUARTER FROM datetime)) AS quarter,
-        COUNT(*) AS employee_count
+        COALESCE(SUM(h.hires) FILTER (WHERE h.quarter = 1), 0)::bigint AS "Q1",
+        COALESCE(SUM(h.hires) FILTER (WHERE h.quarter = 2), 0)::bigint AS "Q2",
+        COALESCE(SUM(h.hires) FILTER (WHERE h.quarter = 3), 0)::bigint AS "Q3",
+        COALESCE(SUM(h.hires) FILTER (WHERE h.quarter = 4), 0)::bigint AS "Q4"
     FROM
-        public.user u
-        inner join public.department d on u.department_id = d.id
-        inner join public.job j on u.job_id = j.id
-    WHERE
-        EXTRACT(YEAR FROM datetime) = {year}
+        {source} h
+        inner join public.department d on h.department_id = d.id
+        inner join public.job j on h.job_id = j.id
     GROUP BY
-        department_name, job_title, EXTRACT(QUARTER FROM datetime)
+        department_name, job_title
     ORDER BY
-        department_name, job_title, EXTRACT(QUARTER FROM datetime)
+        department_name, job_title
+    """,
+)
+DEPARTMENT_HIRES = ReportQuery(
+    "department_hires",
     """
-    engine = engine or default_engine
-    data = pd.read_sql_query(query, engine)
-    df_pivot = data.pivot(
-        index=["department_name", "job_title"],
-        columns="quarter",
-        values="employee_count",
-    ).reset_index()
+    WITH hires AS (
+        SELECT
+            d.id as id,
+            d.department as department,
+            SUM(h.hires)::bigint as hired,
+            AVG(SUM(h.hires)) OVER () as mean_hired
+        FROM {source} h inner join public.department d on d.id = h.department_id
+        GROUP BY d.id, d.department
+    )
+    SELECT id, department, hired
+    FROM hires
+    WHERE hired > mean_hired
+    ORDER BY hired DESC, id
+    """,
+)
+# Hires of every department, the mean is only known once all years are merged
+DEPARTMENT_TOTALS = ReportQuery(
+    "department_totals",
+    """
+    SELECT d.id as id, d.department as department, SUM(h.hires)::bigint as hired
+    FROM {source} h inner join public.department d on d.id = h.department_id
+    GROUP BY d.id, d.department
+    """,
+)
 
-    # Fill NaNs with 0 if needed
-    df_pivot.fillna(0, inplace=True)
-    return df_pivot
 
+def _merge_quarterly_hires(results: List[List[tuple]]) -> List[tuple]:
+    counts = {}
+    for rows in results:
+        for department_name, job_title, *quarters in rows:
+            total = counts.setdefault((department_name, job_title), [0, 0, 0, 0])
+            for quarter, count in enumerate(quarters):
+                total[quarter] += count
+    return [(*key, *counts[key]) for key in sorted(counts)]
 
-def department_hires(year: int, engine: Optional[Engine] = None) -> pd.DataFrame:
-    """Returns a dataframe of departmental hires above the global mean for a given year.
+
+def _merge_department_hires(results: List[List[tuple]]) -> List[tuple]:
+    totals = {}
+    for rows in results:
+        for id, department, hired in rows:
+            totals[(id, department)] = totals.get((id, department), 0) + hired
+    if not totals:
+        return []
+    mean_hired = sum(totals.values()) / len(totals)
+    rows = [(*key, hired) for key, hired in totals.items() if hired > mean_hired]
+    return sorted(rows, key=lambda row: (-row[2], row[0]))
+
+
+def quarterly_hires_rows(
+    period: Period, engine: Optional[Engine] = None, batch_size: Optional[int] = None
+) -> Iterator[List[tuple]]:
+    """Stream the quarterly hires of a period, pivoted by quarter.
+    The pivot is done by Postgres, one filtered sum per quarter. Periods over
+    several years add up the quarters of each year.
     Args:
-        year: The year to filter on.
-        engine: The database engine to use. Defaults to the default engine.
+        period: The year, or [start, end) range of datetimes, to report on.
+        engine: The database engine to use. Defaults to a replica, or the primary.
+        batch_size: Rows per batch. Defaults to EXPORT_BATCH_SIZE.
     Returns:
-        A dataframe of quarterly hires for a given year.
+        Batches of rows with the QUARTERLY_HIRES_COLUMNS.
     """
-    query = f"""
-    SELECT d.id as id, d.department as department, COUNT(*) as hired
-    FROM public.user u inner join public.department d on d.id = u.department_id
-    WHERE EXTRACT(YEAR FROM u.datetime) = {year}
-    GROUP BY d.id, d.department;
+    return run_report(
+        QUARTERLY_HIRES,
+        period,
+        _merge_quarterly_hires,
+        engine=engine,
+        batch_size=batch_size,
+    )
+
+
+def department_hires_rows(
+    period: Period, engine: Optional[Engine] = None, batch_size: Optional[int] = None
+) -> Iterator[List[tuple]]:
+    """Stream the departments that hired more than the mean in a period.
+    Counts are compared to their mean with a window over the departments.
+    Args:
+        period: The year, or [start, end) range of datetimes, to report on.
+        engine: The database engine to use. Defaults to a replica, or the primary.
+        batch_size: Rows per batch. Defaults to EXPORT_BATCH_SIZE.
+    Returns:
+        Batches of rows with the DEPARTMENT_HIRES_COLUMNS, by hires in descending order.
     """
-    engine = engine or default_engine
-    data = pd.read_sql_query(query, engine)
+    return run_report(
+        DEPARTMENT_HIRES,
+        period,
+        _merge_department_hires,
+        engine=engine,
+        batch_size=batch_size,
+        partial_query=DEPARTMENT_TOTALS,
+    )
+
+
+def _to_dataframe(batches: Iterator[List[tuple]], columns: List[str]) -> "pd.DataFrame":
+    # pandas is only needed by callers that want a dataframe, not by the API
+    import pandas as pd
+
+    return pd.DataFrame.from_records(
+        [row for batch in batches for row in batch], columns=columns
+    )
+
 
-    mean_hires = data["hired"].mean()
+def quarterly_hires(period: Period, engine: Optional[Engine] = None) -> "pd.DataFrame":
+    """Returns a dataframe of quarterly hires for a given year, or date range.
+    Requires pandas.
+    """
+    return _to_dataframe(
+        quarterly_hires_rows(period, engine=engine), QUARTERLY_HIRES_COLUMNS
+    )
 
-    # Filter departments that hired more than the mean
-    result_df = data[data["hired"] > mean_hires]
 
-    # Sort by number of employees hired in descending order
-    result_df = result_df.sort_values("hired", ascending=False)
-    return result_df
+def department_hires(period: Period, engine: Optional[Engine] = None) -> "pd.DataFrame":
+    """Returns a dataframe of departmental hires above the global mean for a given year.
+    Requires pandas.
+    Args:
+        period: The year, or [start, end) range of datetimes, to filter on.
+        engine: The database engine to use. Defaults to a replica, or the primary.
+    Returns:
+        A dataframe of the departments that hired more than the mean.
+    """
+    return _to_dataframe(
+        department_hires_rows(period, engine=engine), DEPARTMENT_HIRES_COLUMNS
+    )
@@ -3,10 +3,18 @@ from unittest import mock
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.pool import StaticPool
 
 from db.migrate import run_migrations
+from db.storage.department import DepartmentStorage
+from db.storage.job import JobStorage
+from db.storage.user import UserStorage
+from db.storage.cache import invalidate_caches
 from main import create_app
+from reports.cache import report_cache
+from util.pool import pool_options
+from util.query_stats import instrument_engine
 from util.storage import get_session
 
 
@@ -14,20 +22,67 @@ from util.storage import get_session
 def engine_fixture(postgresql):
     connection = f"postgresql+psycopg2://{postgresql.info.user}:@{postgresql.info.host}:{postgresql.info.port}/{postgresql.info.dbname}"
     engine = create_engine(url=connection, poolclass=StaticPool)
+    instrument_engine(engine)
     run_migrations(engine=engine)
+    # Cached ids and reports belong to the database of the previous test
+    invalidate_caches()
+    report_cache.clear()
     return engine
 
 
+@pytest.fixture(name="async_engine")
+def async_engine_fixture(engine):
+    url = engine.url.set(drivername="postgresql+asyncpg")
+    async_engine = create_async_engine(url=url, **pool_options(is_async=True))
+    instrument_engine(async_engine)
+    return async_engine
+
+
 @pytest.fixture(name="session")
 def session_fixture(engine):
     return get_session(engine=engine)
 
 
 @pytest.fixture(name="client")
-def client_fixture(engine):
+def client_fixture(engine, async_engine):
     with mock.patch("util.storage.default_engine", new=engine), mock.patch(
-        "db.migrate.default_engine", new=engine
+        "util.storage.default_async_engine", new=async_engine
+    ), mock.patch("db.migrate.default_engine", new=engine), mock.patch(
+        "db.replicas.primary_engine", new=engine
     ):
         app = create_app()
         with TestClient(app) as client:
             yield client
+            # Pooled asyncpg connections belong to the client's event loop
+            client.portal.call(async_engine.dispose)
+
+
+@pytest.fixture(name="hires")
+def hires_fixture(session):
+    """Users hired in 2020 and 2021, for the report tests."""
+    JobStorage(session=session).bulk_upsert([{"job": "Manager"}, {"job": "Developer"}])
+    DepartmentStorage(session=session).bulk_upsert(
+        [{"department": "HR"}, {"department": "Engineering"}, {"department": "Sales"}]
+    )
+    hires = [
+        # department_id, job_id, datetime
+        (1, 1, "2021-01-15T00:00:00"),
+        (2, 2, "2021-02-15T00:00:00"),
+        (2, 2, "2021-05-15T00:00:00"),
+        (2, 2, "2021-11-15T00:00:00"),
+        (2, 1, "2021-12-15T00:00:00"),
+        (3, 2, "2021-07-15T00:00:00"),
+        (3, 2, "2020-07-15T00:00:00"),
+    ]
+    UserStorage(session=session).bulk_upsert(
+        [
+            {
+                "name": f"User {i}",
+                "datetime": hired_at,
+                "job_id": job_id,
+                "department_id": department_id,
+            }
+            for i, (department_id, job_id, hired_at) in enumerate(hires)
+        ]
+    )
+    session.commit()
@@ -0,0 +1,53 @@
+from sqlalchemy import select, text
+
+from db.aggregates import rebuild_hires_aggregate
+from db.models import HiresAggregate
+from db.storage.user import UserStorage
+
+
+def _aggregate(session):
+    query = select(
+        HiresAggregate.year,
+        HiresAggregate.quarter,
+        HiresAggregate.department_id,
+        HiresAggregate.job_id,
+        HiresAggregate.hires,
+    ).order_by(*HiresAggregate.__table__.primary_key.columns)
+    return [tuple(row) for row in session.execute(query)]
+
+
+class TestHiresAggregate:
+    def test_inserts_are_counted(self, session, hires):
+        assert _aggregate(session) == [
+            (2020, 3, 3, 2, 1),
+            (2021, 1, 1, 1, 1),
+            (2021, 1, 2, 2, 1),
+            (2021, 2, 2, 2, 1),
+            (2021, 3, 3, 2, 1),
+            (2021, 4, 2, 1, 1),
+            (2021, 4, 2, 2, 1),
+        ]
+
+    def test_updates_move_counts(self, session, hires):
+        storage = UserStorage(session=session)
+        storage.update(2, {"datetime": "2021-11-01T00:00:00"})
+        session.commit()
+        rows = _aggregate(session)
+        assert (2021, 1, 2, 2, 1) not in rows
+        assert (2021, 4, 2, 2, 2) in rows
+
+    def test_deletes_remove_counts(self, session, hires):
+        storage = UserStorage(session=session)
+        storage.delete(1, soft_delete=False)
+        session.commit()
+        assert (2021, 1, 1, 1, 1) not in _aggregate(session)
+        session.execute(text('TRUNCATE "user"'))
+        session.commit()
+        assert _aggregate(session) == []
+
+    def test_rebuild_matches_triggers(self, engine, session, hires):
+        maintained = _aggregate(session)
+        session.execute(text("DELETE FROM hires_aggregate"))
+        session.commit()
+        assert rebuild_hires_aggregate(engine) == len(maintained)
+        assert _aggregate(session) == maintained
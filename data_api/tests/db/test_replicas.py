@@ -0,0 +1,71 @@
+import math
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import StaticPool
+
+from db.models import Job
+from db.replicas import Replica, ReplicaSet
+from db.storage.job import JobStorage
+from util.storage import SessionFactory
+
+
+class TestReplicaRouting:
+    @pytest.fixture(name="replica")
+    def replica_fixture(self, engine):
+        # A second engine on the test database stands in for the replica
+        replica = Replica(create_engine(url=engine.url, poolclass=StaticPool))
+        replica.statements = []
+
+        @event.listens_for(replica.engine, "before_cursor_execute")
+        def record(conn, cursor, statement, *args):
+            replica.statements.append(statement)
+
+        yield replica
+        replica.engine.dispose()
+
+    @pytest.fixture(name="routed_session")
+    def routed_session_fixture(self, engine, session, replica):
+        JobStorage(session=session).create(Job(job="Software Engineer"))
+        session.commit()
+        routed = SessionFactory(bind=engine, replicas=ReplicaSet([replica], max_lag=5))
+        yield routed
+        routed.close()
+
+    def test_reads_go_to_replica(self, routed_session, replica):
+        storage = JobStorage(session=routed_session)
+        assert storage.read(1).job == "Software Engineer"
+        assert storage.count() == 1
+        assert len(replica.statements) == 2
+
+    def test_writes_go_to_primary(self, routed_session, replica):
+        storage = JobStorage(session=routed_session)
+        storage.create(Job(job="Data Engineer"))
+        routed_session.flush()
+        # Reads after a write see it, as the session sticks to the primary
+        assert storage.count() == 2
+        assert replica.statements == []
+
+    def test_commit_pins_primary(self, routed_session, replica):
+        storage = JobStorage(session=routed_session)
+        storage.all()
+        routed_session.commit()
+        storage.all()
+        assert len(replica.statements) == 1
+
+    def test_lagging_replica_falls_back_to_primary(self, routed_session, replica):
+        replica.lag = 60.0
+        JobStorage(session=routed_session).all()
+        assert replica.statements == []
+
+    def test_measure_lag(self, replica):
+        # The test database is not in recovery, so it reports no lag
+        assert replica.measure_lag() == 0
+        assert replica.is_usable(max_lag=5)
+
+    def test_unreachable_replica(self, engine):
+        url = engine.url.set(port=1)
+        replica = Replica(create_engine(url=url))
+        assert replica.measure_lag() == math.inf
+        assert not replica.is_usable(max_lag=5)
+        assert ReplicaSet([replica], max_lag=5).choose() is None
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMonitoring:
+    def test_liveness(self, client):
+        response = client.get("/health/live")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok"}
+
+    def test_readiness(self, client):
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok", "replicas": []}
+
+    def test_not_ready_without_database(self, client):
+        unreachable = create_engine("postgresql+psycopg2://user@127.0.0.1:1/db")
+        with mock.patch("util.storage.default_engine", new=unreachable):
+            response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unavailable"
+
+    def test_metrics(self, client):
+        labels = {"method": "POST", "route": "/v1/job/bulk", "status": "201"}
+        requests = sample("http_request_duration_seconds_count", **labels)
+        rows = sample("rows_ingested_total", table="job")
+        response = client.post("/v1/job/bulk", json=[{"job": "A"}, {"job": "B"}])
+        assert response.status_code == 201
+        response = client.get("/v1/job/1")
+        # Run through the async session, and counted in the request
+        assert response.headers["server-timing"].endswith('desc="1 statements"')
+        client.get("/not/a/route")
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert sample("http_request_duration_seconds_count", **labels) == requests + 1
+        assert sample("rows_ingested_total", table="job") == rows + 2
+        assert sample(
+            "http_request_duration_seconds_count",
+            method="GET",
+            route="/v1/job/{job_id}",
+            status="200",
+        )
+        assert sample(
+            "http_request_duration_seconds_count",
+            method="GET",
+            route="unmatched",
+            status="404",
+        )
+        # Counting the scrape itself
+        assert 'http_requests_in_progress{method="GET"} 1.0' in response.text
+        assert 'db_pool_checked_out{engine="primary"}' in response.text
+        assert "db_pool_wait_seconds_total" in response.text
+
+    def test_report_duration(self, client, hires):
+        count = sample("report_duration_seconds_count", report="quarterly_hires")
+        response = client.get("/v1/report/quarterly_hires?year=2021")
+        assert response.status_code == 200
+        after = sample("report_duration_seconds_count", report="quarterly_hires")
+        assert after == count + 1
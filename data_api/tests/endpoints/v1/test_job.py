@@ -147,6 +147,50 @@ class TestJob:
         # Check the response status code and data
         assert response.status_code == 201
 
+    def test_bulk_insert_existing(self, client, session):
+        storage = JobStorage(session=session)
+        storage.bulk_upsert([{"job": f"Job {i}"} for i in range(3)])
+        session.commit()
+        storage.delete(1)
+        session.commit()
+        jobs_data = [{"job": f"Job {i}"} for i in range(5)]
+
+        response = client.post("/v1/job/bulk", json=jobs_data)
+
+        assert response.status_code == 201
+        assert response.json() == {
+            "inserted": 2,
+            "updated": 0,
+            "reactivated": 1,
+            "unchanged": 2,
+        }
+        assert storage.count() == 5
+
+    def test_copy_jobs(self, client, session):
+        storage = JobStorage(session=session)
+        storage.bulk_upsert([{"job": "Job 0"}])
+        session.commit()
+        body = "job\n" + "\n".join(f"Job {i}" for i in range(5))
+
+        response = client.post(
+            "/v1/job/copy", content=body, headers={"Content-Type": "text/csv"}
+        )
+
+        assert response.status_code == 201
+        assert response.json() == {
+            "inserted": 4,
+            "updated": 0,
+            "reactivated": 0,
+            "unchanged": 1,
+        }
+
+    def test_copy_jobs_unknown_column(self, client):
+        response = client.post(
+            "/v1/job/copy", content="title\nJob", headers={"Content-Type": "text/csv"}
+        )
+        assert response.status_code == 400
+        assert response.json()["errors"]["unknown columns"] == ["title"]
+
     def test_bulk_insert_too_many(self, client):
         jobs_data = {"jobs": [{"job": f"Job {i}"} for i in range(1001)]}
 
@@ -172,6 +216,38 @@ class TestJob:
         for i in range(limit):
             assert response.json()[i]["job"] == f"Job {i}"
 
+    def test_export_jobs(self, client, session):
+        storage = JobStorage(session=session)
+        storage.bulk_upsert([{"job": f"Job {i}"} for i in range(5)])
+        session.commit()
+        response = client.get("/v1/job/export?format=csv")
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert lines[0] == "id,job,created_at,updated_at"
+        assert len(lines) == 6
+
+    def test_get_all_jobs_cursor(self, client, session):
+        storage = JobStorage(session=session)
+        storage.bulk_upsert([{"job": f"Job {i}"} for i in range(25)])
+        session.commit()
+        storage.delete(5)
+        session.commit()
+
+        jobs = []
+        response = client.get("/v1/job/?limit=10")
+        jobs.extend(response.json())
+        while "X-Next-Cursor" in response.headers:
+            cursor = response.headers["X-Next-Cursor"]
+            response = client.get(f"/v1/job/?limit=10&cursor={cursor}")
+            assert response.status_code == 200
+            jobs.extend(response.json())
+
+        assert [job["id"] for job in jobs] == [i for i in range(1, 26) if i != 5]
+
+    def test_get_all_jobs_bad_cursor(self, client):
+        response = client.get("/v1/job/?cursor=not-a-cursor")
+        assert response.status_code == 400
+
     def test_get_all_jobs_empty(self, client, session):
         # Send request to the endpoint
         response = client.get("/v1/job/")
@@ -0,0 +1,215 @@
+import io
+import time
+from unittest import mock
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from db.models import User
+from db.storage.user import UserStorage
+from reports.analytics import HiresSnapshot
+
+
+class TestReport:
+    def test_get_quarterly_hires(self, client, hires):
+        response = client.get("/v1/report/quarterly_hires?year=2021")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        assert response.text.splitlines() == [
+            "department_name,job_title,Q1,Q2,Q3,Q4",
+            "Engineering,Developer,1,1,0,1",
+            "Engineering,Manager,0,0,0,1",
+            "HR,Manager,1,0,0,0",
+            "Sales,Developer,0,0,1,0",
+        ]
+
+    def test_get_department_hires(self, client, hires):
+        response = client.get("/v1/report/department_hires?year=2021")
+        assert response.status_code == 200
+        assert response.text.splitlines() == ["id,department,hired", "2,Engineering,4"]
+
+    def test_get_quarterly_hires_parquet(self, client, hires):
+        response = client.get("/v1/report/quarterly_hires?year=2021&format=parquet")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/vnd.apache.parquet"
+        assert "quarterly_hires_2021.parquet" in response.headers["content-disposition"]
+        table = pq.read_table(io.BytesIO(response.content))
+        assert table.schema.field("Q1").type == pa.int64()
+        assert table.to_pylist()[0] == {
+            "department_name": "Engineering",
+            "job_title": "Developer",
+            "Q1": 1,
+            "Q2": 1,
+            "Q3": 0,
+            "Q4": 1,
+        }
+        assert table.num_rows == 4
+
+    def test_get_department_hires_arrow(self, client, hires):
+        response = client.get("/v1/report/department_hires?year=2021&format=arrow")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == (
+            "application/vnd.apache.arrow.stream"
+        )
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.to_pylist() == [{"id": 2, "department": "Engineering", "hired": 4}]
+
+    def test_get_report_formats_cached_apart(self, client, hires):
+        url = "/v1/report/department_hires?year=2021"
+        csv = client.get(url)
+        parquet = client.get(f"{url}&format=parquet")
+        assert csv.headers["etag"] != parquet.headers["etag"]
+        assert client.get(f"{url}&format=parquet").content == parquet.content
+        assert client.get(url).text == csv.text
+
+    def test_get_report_empty_year_arrow(self, client):
+        response = client.get("/v1/report/quarterly_hires?year=1999&format=arrow")
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.num_rows == 0
+        assert table.column_names[-1] == "Q4"
+
+    def test_get_quarterly_hires_date_range(self, client, hires):
+        response = client.get(
+            "/v1/report/quarterly_hires?start=2020-07-01T00:00:00&end=2021-02-01T00:00:00"
+        )
+        assert response.status_code == 200
+        assert "quarterly_hires_20200701-20210201.csv" in (
+            response.headers["content-disposition"]
+        )
+        assert response.text.splitlines() == [
+            "department_name,job_title,Q1,Q2,Q3,Q4",
+            "HR,Manager,1,0,0,0",
+            "Sales,Developer,0,0,1,0",
+        ]
+
+    def test_get_report_invalid_date_range(self, client):
+        response = client.get(
+            "/v1/report/department_hires?start=2021-02-01T00:00:00&end=2021-01-01T00:00:00"
+        )
+        assert response.status_code == 400
+        response = client.get("/v1/report/department_hires?start=2021-02-01T00:00:00")
+        assert response.status_code == 400
+
+    def test_get_aggregate(self, client, hires):
+        response = client.get(
+            "/v1/report/aggregate?dimensions=department&dimensions=quarter"
+            "&department_id=2&department_id=3&start=2021-01-01T00:00:00"
+        )
+        assert response.status_code == 200
+        assert "hires_department_quarter.csv" in response.headers["content-disposition"]
+        assert response.text.splitlines() == [
+            "department,quarter,count",
+            "Engineering,1,1",
+            "Engineering,2,1",
+            "Engineering,4,2",
+            "Sales,3,1",
+        ]
+
+    def test_get_aggregate_by_day_arrow(self, client, hires):
+        response = client.get(
+            "/v1/report/aggregate?dimensions=day&job_id=1&format=arrow"
+        )
+        table = pa.ipc.open_stream(response.content).read_all()
+        assert table.schema.field("day").type == pa.date32()
+        assert table.column("count").to_pylist() == [1, 1]
+
+    def test_get_aggregate_from_snapshot(self, client, engine, hires):
+        url = "/v1/report/aggregate?dimensions=job&dimensions=quarter&start=2021-01-01T00:00:00"
+        expected = client.get(url).text
+        snapshot = HiresSnapshot(engine=engine)
+        snapshot.refresh()
+        with mock.patch("endpoints.v1.report.hires_snapshot", new=snapshot):
+            assert client.get(url).text == expected
+            assert client.get("/v1/report/snapshot").json()["rows"] == 7
+
+    def test_get_aggregate_nothing_matches(self, client, hires):
+        response = client.get("/v1/report/aggregate?job_id=999")
+        assert response.status_code == 200
+        assert response.text.splitlines() == ["count", "0"]
+
+    def test_get_aggregate_rejects_unknown_dimension(self, client):
+        response = client.get("/v1/report/aggregate?dimensions=salary")
+        assert response.status_code == 422
+
+    def test_report_job(self, client, hires):
+        url = "/v1/report/quarterly_hires/jobs?start=2020-01-01T00:00:00&end=2022-01-01T00:00:00"
+        response = client.post(url)
+        assert response.status_code == 202
+        job = response.json()
+        assert response.headers["location"].endswith(f"/v1/report/jobs/{job['id']}")
+        assert client.post(url).json()["id"] == job["id"]
+
+        deadline = time.monotonic() + 5
+        response = client.get(f"/v1/report/jobs/{job['id']}")
+        while response.status_code == 202 and time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = client.get(f"/v1/report/jobs/{job['id']}")
+        assert response.status_code == 200
+        assert "quarterly_hires_20200101-20220101.csv" in (
+            response.headers["content-disposition"]
+        )
+        assert response.text.splitlines()[-1] == "Sales,Developer,0,0,2,0"
+
+    def test_report_job_not_found(self, client):
+        assert client.get("/v1/report/jobs/missing").status_code == 404
+
+    def test_get_report_empty_year(self, client):
+        response = client.get("/v1/report/quarterly_hires?year=1999")
+        assert response.status_code == 200
+        assert response.text.splitlines() == ["department_name,job_title,Q1,Q2,Q3,Q4"]
+
+    def test_report_not_modified(self, client, hires):
+        response = client.get("/v1/report/quarterly_hires?year=2021")
+        etag = response.headers["etag"]
+        assert response.headers["last-modified"]
+        response = client.get(
+            "/v1/report/quarterly_hires?year=2021", headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        response = client.get(
+            "/v1/report/quarterly_hires?year=2021",
+            headers={"If-Modified-Since": response.headers["last-modified"]},
+        )
+        assert response.status_code == 304
+
+    def test_report_invalidated_by_hires_of_its_year(self, client, session, hires):
+        url = "/v1/report/department_hires?year=2021"
+        first = client.get(url)
+        assert client.get(url).headers["etag"] == first.headers["etag"]
+
+        storage = UserStorage(session=session)
+        storage.create(
+            User(name="New", datetime="2020-03-01T00:00:00", job_id=1, department_id=1)
+        )
+        session.commit()
+        assert client.get(url).headers["etag"] == first.headers["etag"]
+
+        for name in ("New", "Newer"):
+            storage.create(
+                User(
+                    name=name,
+                    datetime="2021-03-01T00:00:00",
+                    job_id=1,
+                    department_id=3,
+                )
+            )
+        session.commit()
+        response = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+        assert response.status_code == 200
+        assert response.headers["etag"] != first.headers["etag"]
+        assert response.text.splitlines() == [
+            "id,department,hired",
+            "2,Engineering,4",
+            "3,Sales,3",
+        ]
+
+    def test_report_invalidated_by_department_rename(self, client, hires):
+        url = "/v1/report/department_hires?year=2021"
+        first = client.get(url)
+        response = client.patch("/v1/department/2", json={"department": "Platform"})
+        assert response.status_code == 200
+        response = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+        assert response.status_code == 200
+        assert response.headers["etag"] != first.headers["etag"]
+        assert response.text.splitlines() == ["id,department,hired", "2,Platform,4"]
@@ -1,9 +1,14 @@
+import json
+
 import pytest
+from sqlalchemy import event
 
 from db.models import User
+from db.schemas.user import UserResponse
 from db.storage.department import DepartmentStorage
 from db.storage.job import JobStorage
 from db.storage.user import UserStorage
+from util.pool import pool_stats
 
 
 class TestUser:
@@ -54,6 +59,24 @@ class TestUser:
         response = client.post("/v1/user/", json=payload)
         assert response.status_code == 400
 
+    def test_post_user_fk_deleted_after_cached(self, client, session):
+        self._init_fks(session)
+        payload = {
+            "name": "John Doe",
+            "datetime": "2020-01-01T00:00:00",
+            "job_id": 1,
+            "department_id": 1,
+        }
+        response = client.post("/v1/user/", json=payload)
+        assert response.status_code == 201
+
+        response = client.delete("/v1/job/1")
+        assert response.status_code == 204
+        payload["name"] = "Jane Doe"
+        response = client.post("/v1/user/", json=payload)
+        assert response.status_code == 400
+        assert response.json()["missing"] == {"job_id": [1]}
+
     @pytest.mark.parametrize("limit", [1, 10, 100, 1000])
     def test_get_many_users(self, client, session, limit):
         self._init_fks(session)
@@ -80,6 +103,123 @@ class TestUser:
             assert response.json()[i]["job"]["id"] == 1
             assert response.json()[i]["department"]["id"] == 1
 
+    def test_get_many_users_single_query(self, client, session, async_engine):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        for i in range(100):
+            storage.create(
+                User(
+                    name=f"John Doe {i}",
+                    datetime="2020-01-01T00:00:00",
+                    job_id=i % 10 + 1,
+                    department_id=i % 10 + 1,
+                )
+            )
+        session.commit()
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            if any(table in statement for table in ('"user"', "job", "department")):
+                statements.append(statement)
+
+        sync_engine = async_engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", count_statement)
+        try:
+            response = client.get("/v1/user/?limit=100")
+        finally:
+            event.remove(sync_engine, "before_cursor_execute", count_statement)
+        assert response.status_code == 200
+        assert len(response.json()) == 100
+        assert len(statements) == 1
+
+    def test_get_many_users_matches_response_model(self, client, session):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        for i in range(3):
+            storage.create(
+                User(
+                    name=f"John Doe {i}",
+                    datetime=f"2020-01-01T00:00:0{i}.12345{i}",
+                    job_id=i + 1,
+                    department_id=1,
+                )
+            )
+        session.commit()
+        JobStorage(session=session).delete(2)
+        session.commit()
+        expected = [
+            json.loads(UserResponse.from_orm(user).json()) for user in storage.all()
+        ]
+        response = client.get("/v1/user/")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == expected
+        assert response.json()[1]["job"] is None
+
+    def test_export_users_ndjson(self, client, session):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        for i in range(25):
+            storage.create(
+                User(
+                    name=f"John Doe {i}",
+                    datetime="2020-01-01T00:00:00",
+                    job_id=i % 10 + 1,
+                    department_id=1,
+                )
+            )
+        session.commit()
+        storage.delete(3)
+        session.commit()
+        response = client.get("/v1/user/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        records = [json.loads(line) for line in response.text.splitlines()]
+        assert len(records) == 24
+        assert [record["id"] for record in records] == sorted(
+            record["id"] for record in records
+        )
+        assert records == client.get("/v1/user/?limit=100").json()
+
+    def test_export_users_csv(self, client, session):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        storage.create(
+            User(
+                name="John Doe",
+                datetime="2020-01-01T00:00:00",
+                job_id=2,
+                department_id=1,
+            )
+        )
+        session.commit()
+        JobStorage(session=session).delete(2)
+        session.commit()
+        response = client.get("/v1/user/export?format=csv")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+        header, row = response.text.splitlines()
+        assert header.startswith("id,name,datetime,job.id,job.job,")
+        assert row.startswith("1,John Doe,2020-01-01T00:00:00,,,")
+
+    def test_requests_return_connections(self, client, session, async_engine):
+        self._init_fks(session)
+        payload = {
+            "name": "John Doe",
+            "datetime": "2020-01-01T00:00:00",
+            "job_id": 1,
+            "department_id": 100,
+        }
+        assert client.get("/v1/user/1").status_code == 404
+        assert client.post("/v1/user/", json=payload).status_code == 400
+        payload["department_id"] = 1
+        assert client.post("/v1/user/", json=payload).status_code == 201
+        assert client.get("/v1/user/1").status_code == 200
+        stats = pool_stats(async_engine)
+        assert stats["checked_out"] == 0
+        assert stats["checkouts"] == stats["checkins"]
+        assert stats["leaks"] == 0
+
     def test_get_user(self, client, session):
         self._init_fks(session)
         users_storage = UserStorage(session=session)
@@ -208,6 +348,32 @@ class TestUser:
         assert response.status_code == 201
         assert len(storage.all(limit=count + 1)) == count
 
+    def test_bulk_create_users_reingest(self, client, session):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        payload = [
+            {
+                "name": f"John Doe {i}",
+                "datetime": "2020-01-01T00:00:00",
+                "job_id": 1,
+                "department_id": 1,
+            }
+            for i in range(10)
+        ]
+        response = client.post("/v1/user/bulk", json=payload)
+        assert response.json()["inserted"] == 10
+
+        payload[0]["datetime"] = "2021-01-01T00:00:00"
+        response = client.post("/v1/user/bulk", json=payload)
+        assert response.status_code == 201
+        assert response.json() == {
+            "inserted": 0,
+            "updated": 1,
+            "reactivated": 0,
+            "unchanged": 9,
+        }
+        assert storage.count() == 10
+
     def test_bulk_create_users_bad_fk(self, client, session):
         self._init_fks(session)
         payload = [
@@ -222,6 +388,24 @@ class TestUser:
         response = client.post("/v1/user/bulk", json=payload)
         assert response.status_code == 400
 
+    def test_bulk_create_users_reports_all_bad_fks(self, client, session):
+        self._init_fks(session)
+        payload = [
+            {
+                "name": f"John Doe {i}",
+                "datetime": "2020-01-01T00:00:00",
+                "job_id": 100 + i % 3,
+                "department_id": 1 if i % 2 else 200,
+            }
+            for i in range(10)
+        ]
+        response = client.post("/v1/user/bulk", json=payload)
+        assert response.status_code == 400
+        assert response.json()["missing"] == {
+            "job_id": [100, 101, 102],
+            "department_id": [200],
+        }
+
     def test_bulk_create_duplicate_users(self, client, session):
         self._init_fks(session)
         payload = [
@@ -283,3 +467,40 @@ class TestUser:
         }
         response = client.patch("/v1/user/1", json=payload)
         assert response.status_code == 400
+
+    def test_copy_users(self, client, session):
+        self._init_fks(session)
+        storage = UserStorage(session=session)
+        rows = "\n".join(
+            f"{i},John Doe {i},2021-11-07T02:48:42Z,1,2" for i in range(1, 101)
+        )
+        response = client.post(
+            "/v1/user/copy?columns=id,name,datetime,department_id,job_id",
+            content=rows,
+            headers={"Content-Type": "text/csv"},
+        )
+        assert response.status_code == 201
+        assert response.json()["inserted"] == 100
+        assert storage.count() == 100
+        assert storage.read(1).job_id == 2
+
+    def test_copy_users_bad_rows(self, client, session):
+        self._init_fks(session)
+        body = (
+            "name,datetime,job_id,department_id\n"
+            "John Doe,2021-11-07T02:48:42Z,1,1\n"
+            "Jane Doe,not a date,1,1\n"
+            "Jim Doe,2021-11-07T02:48:42Z,1,100\n"
+        )
+        response = client.post(
+            "/v1/user/copy", content=body, headers={"Content-Type": "text/csv"}
+        )
+        assert response.status_code == 400
+        errors = response.json()["errors"]
+        assert errors["invalid datetime"] == {"count": 1, "lines": [3]}
+        assert errors["unknown department_id"] == {"count": 1, "lines": [4]}
+        assert UserStorage(session=session).count() == 0
+
+    def test_copy_users_not_csv(self, client):
+        response = client.post("/v1/user/copy", json=[])
+        assert response.status_code == 415
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from reports.aggregate import aggregate_query, stream_aggregate, Dimension, Measure
+
+
+def rows(engine, *args, **kwargs):
+    query = aggregate_query(*args, **kwargs)
+    return [row for batch in stream_aggregate(query, engine=engine) for row in batch]
+
+
+def test_aggregate_from_hires_aggregate(engine, hires):
+    query = aggregate_query([Dimension.department, Dimension.year], [Measure.count])
+    assert "hires_aggregate" in str(query)
+    assert rows(engine, [Dimension.department, Dimension.year], [Measure.count]) == [
+        ("Engineering", 2021, 4),
+        ("HR", 2021, 1),
+        ("Sales", 2020, 1),
+        ("Sales", 2021, 1),
+    ]
+
+
+def test_aggregate_from_user_table(engine, hires):
+    dimensions = [Dimension.job, Dimension.month]
+    query = aggregate_query(dimensions, [Measure.count])
+    assert "hires_aggregate" not in str(query)
+    result = rows(
+        engine,
+        dimensions,
+        [Measure.count],
+        department_ids=[2],
+        start=datetime(2021, 1, 1),
+        end=datetime(2021, 12, 1),
+    )
+    assert result == [("Developer", 2, 1), ("Developer", 5, 1), ("Developer", 11, 1)]
+
+
+def test_aggregate_without_dimensions(engine, hires):
+    assert rows(engine, [], [Measure.count], job_ids=[1]) == [(2,)]
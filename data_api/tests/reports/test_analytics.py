@@ -0,0 +1,104 @@
+from datetime import date, datetime, timedelta
+from itertools import combinations
+from unittest import mock
+
+from sqlalchemy import create_engine, text
+
+from db.models import User
+from db.storage.user import UserStorage
+from reports.aggregate import aggregate_query, stream_aggregate, Dimension, Measure
+from reports.analytics import HiresSnapshot
+
+
+def sql_rows(engine, dimensions, **filters):
+    query = aggregate_query(dimensions, [Measure.count], **filters)
+    return [row for batch in stream_aggregate(query, engine=engine) for row in batch]
+
+
+def test_snapshot_matches_sql(engine, hires):
+    snapshot = HiresSnapshot(engine=engine)
+    assert snapshot.refresh() == 7
+    for size in (0, 1, 2):
+        for dimensions in combinations(list(Dimension), size):
+            assert snapshot.aggregate(dimensions) == sql_rows(engine, dimensions)
+    filters = dict(
+        department_ids=[2, 3], start=datetime(2021, 2, 1), end=datetime(2021, 12, 1)
+    )
+    dimensions = [Dimension.job, Dimension.day]
+    assert snapshot.aggregate(dimensions, **filters) == sql_rows(
+        engine, dimensions, **filters
+    )
+    assert snapshot.aggregate([Dimension.day], job_ids=[1]) == [
+        (date(2021, 1, 15), 1),
+        (date(2021, 12, 15), 1),
+    ]
+
+
+def test_snapshot_refreshes_changed_rows(engine, session, hires):
+    snapshot = HiresSnapshot(engine=engine)
+    snapshot.refresh()
+    storage = UserStorage(session=session)
+    storage.update(1, {"department_id": 3})
+    storage.create(
+        User(name="New", datetime="2022-03-01T00:00:00", job_id=1, department_id=1)
+    )
+    session.commit()
+
+    snapshot.refresh()
+    assert snapshot.aggregate([Dimension.department, Dimension.year]) == [
+        ("Engineering", 2021, 4),
+        ("HR", 2022, 1),
+        ("Sales", 2020, 1),
+        ("Sales", 2021, 2),
+    ]
+    stats = snapshot.stats()
+    assert stats["rows"] == 8
+    assert stats["memory_bytes"] > 0
+    assert stats["refresh_lag"] < 60
+
+
+def test_snapshot_fetches_rows_of_transactions_committed_late(engine, session, hires):
+    snapshot = HiresSnapshot(engine=engine)
+    storage = UserStorage(session=session)
+    # The test engine has a single connection, the slow transaction needs its own
+    writer = create_engine(engine.url)
+    with mock.patch("reports.analytics._WATERMARK_OVERLAP", timedelta(0)):
+        snapshot.refresh()
+        with writer.connect() as connection:
+            slow = connection.begin()
+            connection.execute(
+                text(
+                    'INSERT INTO "user" (name, datetime, department_id, job_id, updated_at) '
+                    "VALUES ('Slow', '2022-01-01', 1, 1, now() AT TIME ZONE 'UTC')"
+                )
+            )
+            # Written later, but committed first. Another year, so that the
+            # aggregate rows locked by the slow transaction are not written.
+            storage.create(
+                User(
+                    name="Fast",
+                    datetime="2023-01-01T00:00:00",
+                    job_id=1,
+                    department_id=1,
+                )
+            )
+            session.commit()
+            snapshot.refresh()
+            assert snapshot.aggregate([Dimension.year], start=datetime(2022, 1, 1)) == [
+                (2022, 1)
+            ]
+            slow.commit()
+        writer.dispose()
+        snapshot.refresh()
+    assert snapshot.aggregate([Dimension.year], start=datetime(2022, 1, 1)) == [
+        (2022, 2)
+    ]
+
+
+def test_snapshot_full_refresh_drops_deleted_rows(engine, hires):
+    snapshot = HiresSnapshot(engine=engine, full_refresh_interval=0)
+    snapshot.refresh()
+    with engine.begin() as connection:
+        connection.execute(text('DELETE FROM "user" WHERE department_id = 3'))
+    snapshot.refresh()
+    assert snapshot.aggregate([]) == [(5,)]
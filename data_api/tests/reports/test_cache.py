@@ -0,0 +1,38 @@
+from unittest import mock
+
+from reports.cache import ReportCache
+
+
+def test_report_cache_hit_and_stale_version():
+    cache = ReportCache(max_entries=2, ttl=60, max_entry_size=100)
+    body = b"".join(cache.store_while_streaming("a", ["x,y\n", b"1,2\n"], version=1))
+    assert body == b"x,y\n1,2\n"
+    assert cache.get("a", version=1).body == body
+    assert cache.get("a", version=2) is None
+    assert len(cache) == 0
+
+
+def test_report_cache_evicts_least_recently_used():
+    cache = ReportCache(max_entries=2, ttl=60, max_entry_size=100)
+    for key in ("a", "b"):
+        list(cache.store_while_streaming(key, ["data"], version=1))
+    cache.get("a", version=1)
+    list(cache.store_while_streaming("c", ["data"], version=1))
+    assert cache.get("b", version=1) is None
+    assert cache.get("a", version=1) is not None
+    assert cache.get("c", version=1) is not None
+
+
+def test_report_cache_ttl():
+    cache = ReportCache(max_entries=2, ttl=10, max_entry_size=100)
+    with mock.patch("reports.cache.time.monotonic", return_value=0):
+        list(cache.store_while_streaming("a", ["data"], version=1))
+    with mock.patch("reports.cache.time.monotonic", return_value=11):
+        assert cache.get("a", version=1) is None
+
+
+def test_report_cache_skips_large_reports():
+    cache = ReportCache(max_entries=2, ttl=60, max_entry_size=5)
+    chunks = list(cache.store_while_streaming("a", ["abc", "def"], version=1))
+    assert chunks == [b"abc", b"def"]
+    assert cache.get("a", version=1) is None
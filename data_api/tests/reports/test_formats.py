@@ -0,0 +1,25 @@
+import io
+
+import pyarrow.parquet as pq
+
+from reports.formats import write_report, ReportFormat
+
+SCHEMA = [("name", "string"), ("hired", "int64")]
+BATCHES = [[("HR", 1), ("Sales", 2)], [], [("Engineering", 3)]]
+
+
+class TestWriteReport:
+    def test_write_csv(self):
+        body = b"".join(write_report(SCHEMA, BATCHES, ReportFormat.csv))
+        assert body.decode().splitlines() == [
+            "name,hired",
+            "HR,1",
+            "Sales,2",
+            "Engineering,3",
+        ]
+
+    def test_write_parquet_row_group_per_batch(self):
+        chunks = list(write_report(SCHEMA, BATCHES, ReportFormat.parquet))
+        parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+        assert parquet.metadata.num_row_groups == 2
+        assert parquet.read().column("hired").to_pylist() == [1, 2, 3]
@@ -0,0 +1,61 @@
+import threading
+import time
+
+from reports.jobs import ReportJobManager, JobStatus
+
+
+def wait_for(job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job.status in (JobStatus.pending, JobStatus.running):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return job
+
+
+def test_report_job_writes_file(tmp_path):
+    manager = ReportJobManager(directory=str(tmp_path), workers=1)
+    job = manager.submit("a", "a.csv", "text/csv", lambda: iter([b"x,y\n", b"1,2\n"]))
+    assert wait_for(job).status == JobStatus.done
+    with open(job.path, "rb") as file:
+        assert file.read() == b"x,y\n1,2\n"
+    manager.shutdown()
+
+
+def test_identical_report_jobs_attach_to_running_job(tmp_path):
+    manager = ReportJobManager(directory=str(tmp_path), workers=2)
+    release = threading.Event()
+
+    def render():
+        release.wait(5)
+        yield b"done"
+
+    first = manager.submit("a", "a.csv", "text/csv", render)
+    assert manager.submit("a", "a.csv", "text/csv", render) is first
+    assert manager.submit("b", "b.csv", "text/csv", render) is not first
+    release.set()
+    assert wait_for(first).status == JobStatus.done
+    manager.shutdown()
+
+
+def test_failed_report_job_is_retried(tmp_path):
+    manager = ReportJobManager(directory=str(tmp_path), workers=1)
+
+    def render():
+        raise ValueError("broken")
+        yield b""
+
+    job = wait_for(manager.submit("a", "a.csv", "text/csv", render))
+    assert job.status == JobStatus.failed
+    assert job.error == "broken"
+    assert not list(tmp_path.iterdir())
+    assert manager.submit("a", "a.csv", "text/csv", render) is not job
+    manager.shutdown()
+
+
+def test_finished_report_jobs_expire(tmp_path):
+    manager = ReportJobManager(directory=str(tmp_path), workers=1, ttl=0)
+    job = wait_for(manager.submit("a", "a.csv", "text/csv", lambda: [b"data"]))
+    wait_for(manager.submit("b", "b.csv", "text/csv", lambda: [b"data"]))
+    assert manager.get(job.id) is None
+    assert not (tmp_path / job.id).exists()
+    manager.shutdown()
@@ -1,38 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from unittest import mock
 
-import pandas
-import pandas as pd
+from sqlalchemy import create_engine, text
 
-from reports.user import quarterly_hires, department_hires
-
-mock_quarterly_data = pd.DataFrame(
-    {
-        "department_name": ["HR", "Engineering"],
-        "job_title": ["Manager", "Developer"],
-        "quarter": ["Q1", "Q2"],
-        "employee_count": [5, 10],
-    }
+from reports.queries import date_range
+from util.pool import pool_options
+from reports.user import (
+    QUARTERLY_HIRES,
+    quarterly_hires,
+    department_hires,
+    quarterly_hires_rows,
+    department_hires_rows,
 )
 
-mock_department_data = pd.DataFrame(
-    {"id": [1, 2], "department": ["HR", "Engineering"], "hired": [5, 10]}
-)
+
+def test_quarterly_hires(engine, hires):
+    df = quarterly_hires(2021, engine=engine)
+    assert list(df.columns) == [
+        "department_name",
+        "job_title",
+        "Q1",
+        "Q2",
+        "Q3",
+        "Q4",
+    ]
+    assert df.shape == (4, 6)  # Quarters without hires are filled with 0
+    assert df["Q4"].tolist() == [1, 1, 0, 0]
+
+
+def test_department_hires(engine, hires):
+    df = department_hires(2021, engine=engine)
+    assert list(df.columns) == ["id", "department", "hired"]
+    assert df.shape == (1, 3)  # Only Engineering is above the mean
+
+
+def test_quarterly_hires_empty_year(engine):
+    assert list(quarterly_hires_rows(1999, engine=engine)) == []
+    assert quarterly_hires(1999, engine=engine).shape == (0, 6)
+
+
+def test_quarterly_hires_rows(engine, hires):
+    batches = list(quarterly_hires_rows(2021, engine=engine, batch_size=2))
+    assert len(batches) > 1
+    assert [row for batch in batches for row in batch] == [
+        ("Engineering", "Developer", 1, 1, 0, 1),
+        ("Engineering", "Manager", 0, 0, 0, 1),
+        ("HR", "Manager", 1, 0, 0, 0),
+        ("Sales", "Developer", 0, 0, 1, 0),
+    ]
+
+
+def test_department_hires_rows(engine, hires):
+    rows = [
+        row for batch in department_hires_rows(2021, engine=engine) for row in batch
+    ]
+    assert rows == [(2, "Engineering", 4)]
+
+
+def test_quarterly_hires_rows_over_years(engine, hires):
+    period = (datetime(2020, 1, 1), datetime(2022, 1, 1))
+    rows = [
+        row for batch in quarterly_hires_rows(period, engine=engine) for row in batch
+    ]
+    assert rows == [
+        ("Engineering", "Developer", 1, 1, 0, 1),
+        ("Engineering", "Manager", 0, 0, 0, 1),
+        ("HR", "Manager", 1, 0, 0, 0),
+        ("Sales", "Developer", 0, 0, 2, 0),
+    ]
+
+
+def test_quarterly_hires_rows_partial_quarters(engine, hires):
+    # 2020 is read from the aggregate, January 2021 from the user table
+    period = (datetime(2020, 7, 1), datetime(2021, 2, 1))
+    rows = [
+        row for batch in quarterly_hires_rows(period, engine=engine) for row in batch
+    ]
+    assert rows == [
+        ("HR", "Manager", 1, 0, 0, 0),
+        ("Sales", "Developer", 0, 0, 1, 0),
+    ]
+
+
+def test_department_hires_rows_over_years(engine, hires):
+    period = (datetime(2020, 1, 1), datetime(2022, 1, 1))
+    rows = [
+        row for batch in department_hires_rows(period, engine=engine) for row in batch
+    ]
+    assert rows == [(2, "Engineering", 4)]
 
 
-@mock.patch.object(pandas, "read_sql_query", return_value=mock_quarterly_data)
-def test_quarterly_hires(mock_read_sql_query):
-    df = quarterly_hires(year=2021)
-    assert "department_name" in df.columns
-    assert "job_title" in df.columns
-    assert df.shape == (2, 4)  # 2 rows, 4 columns
-    assert mock_read_sql_query.called
+def test_report_query_prepared_once_per_connection(engine, hires):
+    with engine.connect() as connection:
+        for _ in range(2):
+            QUARTERLY_HIRES.execute(connection, *date_range(2021)).all()
+        assert connection.info["prepared_statements"] == {"quarterly_hires_aggregate"}
+        prepared = connection.execute(
+            text("SELECT count(*) FROM pg_prepared_statements WHERE name = :name"),
+            {"name": "quarterly_hires_aggregate"},
+        ).scalar()
+        assert prepared == 1
 
 
-@mock.patch.object(pandas, "read_sql_query", return_value=mock_department_data)
-def test_department_hires(mock_read_sql_query):
-    df = department_hires(year=2021)
-    assert "id" in df.columns
-    assert "department" in df.columns
-    assert "hired" in df.columns
-    assert df.shape == (1, 3)  # 1 row, 3 columns (only Engineering is above the mean)
-    assert mock_read_sql_query.called
+def test_report_over_years_in_parallel(engine, hires):
+    pooled = create_engine(engine.url, **pool_options())
+    period = (datetime(2019, 1, 1), datetime(2022, 1, 1))
+    with mock.patch.object(
+        ThreadPoolExecutor, "map", autospec=True, side_effect=ThreadPoolExecutor.map
+    ) as executor_map:
+        rows = [
+            row
+            for batch in department_hires_rows(period, engine=pooled)
+            for row in batch
+        ]
+    assert executor_map.call_args.args[0]._max_workers == 3
+    assert rows == [(2, "Engineering", 4)]
+    pooled.dispose()
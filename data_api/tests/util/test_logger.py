@@ -0,0 +1,123 @@
+import json
+import socket
+
+import pytest
+from loguru import logger as loguru_logger
+
+from util.logger import (
+    BatchingSink,
+    GELF_UDP_CHUNK_SIZE,
+    GelfUdpTransport,
+    gelf_message,
+)
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(5)
+    yield server
+    server.close()
+
+
+def encode(message) -> bytes:
+    return json.dumps(gelf_message(message.record, "test"), default=str).encode()
+
+
+def ship(listener, log, **kwargs) -> BatchingSink:
+    """Log through a GELF sink sending to the listener, then flush it."""
+    transport = GelfUdpTransport(*listener.getsockname())
+    sink = BatchingSink(transport, encode=encode, flush_interval=0.05, **kwargs)
+    handler_id = loguru_logger.add(sink.start(), format="{message}")
+    try:
+        log()
+    finally:
+        loguru_logger.remove(handler_id)
+        sink.stop(timeout=5)
+    return sink
+
+
+def received(listener, count: int) -> list:
+    return [json.loads(listener.recv(65536)) for _ in range(count)]
+
+
+def test_gelf_messages_shipped_over_udp(listener):
+    def log():
+        loguru_logger.bind(request_id="abc").warning("Something happened")
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            loguru_logger.exception("Could not do it")
+
+    ship(listener, log)
+    warning, error = received(listener, 2)
+    assert warning["version"] == "1.1"
+    assert warning["host"] == "test"
+    assert warning["short_message"] == "Something happened"
+    assert warning["level"] == 4
+    assert warning["_request_id"] == "abc"
+    assert error["level"] == 3
+    assert "ValueError: broken" in error["full_message"]
+
+
+def test_successful_requests_sampled(listener):
+    def log():
+        loguru_logger.bind(status_code=200).info("Request: GET /v1/user 200")
+        loguru_logger.bind(status_code=500).info("Request: GET /v1/user 500")
+        loguru_logger.info("Started")
+
+    ship(listener, log, success_sample_rate=0)
+    messages = received(listener, 2)
+    assert [message["short_message"] for message in messages] == [
+        "Request: GET /v1/user 500",
+        "Started",
+    ]
+    listener.settimeout(0.2)
+    with pytest.raises(socket.timeout):
+        listener.recv(65536)
+
+
+def test_large_messages_chunked(listener):
+    text = "x" * GELF_UDP_CHUNK_SIZE
+    ship(listener, lambda: loguru_logger.info(text))
+    first = listener.recv(65536)
+    count = first[11]
+    chunks = [first] + [listener.recv(65536) for _ in range(count - 1)]
+    assert count > 1
+    assert {chunk[:2] for chunk in chunks} == {b"\x1e\x0f"}
+    assert len({chunk[2:10] for chunk in chunks}) == 1
+    assert [chunk[10] for chunk in chunks] == list(range(count))
+    message = json.loads(b"".join(chunk[12:] for chunk in chunks))
+    assert message["short_message"] == text
+
+
+def test_records_dropped_when_queue_full():
+    shipped = []
+
+    class ListTransport:
+        def send(self, messages):
+            shipped.extend(messages)
+
+        def close(self):
+            pass
+
+    # Not started, so nothing leaves the queue while logging
+    sink = BatchingSink(ListTransport(), encode=str, queue_size=10)
+    handler_id = loguru_logger.add(sink, format="{message}")
+    try:
+        for index in range(10):
+            loguru_logger.info(f"info {index}")
+        for index in range(5):
+            loguru_logger.warning(f"warning {index}")
+    finally:
+        loguru_logger.remove(handler_id)
+    # Infos are shed at 80% of the queue, warnings only once it is full
+    assert sink.dropped == 2 + 3
+    sink.start()
+    sink.stop(timeout=5)
+    assert [message.strip() for message in shipped] == [
+        *[f"info {index}" for index in range(8)],
+        "warning 0",
+        "warning 1",
+    ]
@@ -0,0 +1,80 @@
+import asyncio
+
+from starlette.applications import Starlette
+from starlette.responses import StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from util.exceptions import RecordNotFound
+from util.middleware import ExceptionMiddleware, LoggingMiddleware
+
+
+async def not_found(request):
+    raise RecordNotFound("7")
+
+
+async def broken(request):
+    raise ValueError("broken")
+
+
+async def stream(request):
+    async def chunks():
+        for chunk in (b"a", b"b", b"c"):
+            yield chunk
+
+    return StreamingResponse(chunks())
+
+
+def create_app():
+    app = Starlette(
+        routes=[
+            Route("/not_found", not_found),
+            Route("/broken", broken),
+            Route("/stream", stream),
+        ]
+    )
+    app.add_middleware(ExceptionMiddleware)
+    app.add_middleware(LoggingMiddleware)
+    return app
+
+
+def test_exceptions_mapped_to_responses():
+    client = TestClient(create_app())
+    response = client.get("/not_found")
+    assert response.status_code == 404
+    assert response.json() == {
+        "detail": "Record with id 7 not found",
+        "record_id": "7",
+    }
+    response = client.get("/broken")
+    assert response.status_code == 500
+    assert response.json() == {"detail": "broken"}
+
+
+def test_streaming_body_passed_through():
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/stream",
+        "raw_path": b"/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"test")],
+        "server": ("test", 80),
+        "client": ("test", 1234),
+    }
+    asyncio.run(create_app()(scope, receive, send))
+    bodies = [m["body"] for m in messages if m["type"] == "http.response.body"]
+    # One message per chunk, nothing buffered by the middleware
+    assert bodies[:3] == [b"a", b"b", b"c"]
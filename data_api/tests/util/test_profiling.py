@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from unittest import mock
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from util.middleware import ProfilingMiddleware
+
+
+def busy_wait(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def async_endpoint(request):
+    busy_wait(0.05)
+    return PlainTextResponse("async")
+
+
+def sync_endpoint(request):
+    # Run in the threadpool by Starlette
+    busy_wait(0.05)
+    return PlainTextResponse("sync")
+
+
+def stream_endpoint(request):
+    def chunks():
+        for _ in range(2):
+            busy_wait(0.025)
+            yield b"chunk"
+
+    return StreamingResponse(chunks())
+
+
+@pytest.fixture(name="profiled_client")
+def profiled_client_fixture(tmp_path):
+    app = Starlette(
+        routes=[
+            Route("/async", async_endpoint),
+            Route("/sync", sync_endpoint),
+            Route("/stream", stream_endpoint),
+        ]
+    )
+    app.add_middleware(ProfilingMiddleware)
+    with mock.patch.multiple(
+        "config",
+        PROFILING_ENABLED=True,
+        PROFILING_TOKEN="secret",
+        PROFILING_DIR=str(tmp_path),
+    ):
+        yield TestClient(app)
+
+
+def profiled_functions(profile: dict) -> set:
+    frames = profile["shared"]["frames"]
+    samples = profile["profiles"][0]["samples"]
+    return {frames[index]["name"] for sample in samples for index in sample}
+
+
+@pytest.mark.parametrize(
+    "path, function",
+    [
+        ("/async", "async_endpoint"),
+        ("/sync", "sync_endpoint"),
+        ("/stream", "chunks"),
+    ],
+)
+def test_inline_profile(profiled_client, path, function):
+    response = profiled_client.get(
+        path, headers={"X-Profile": "secret", "X-Profile-Output": "inline"}
+    )
+    assert response.status_code == 200
+    assert response.headers["x-profile-status"] == "200"
+    assert float(response.headers["x-profile-wall-time"]) >= 0.05
+    profile = response.json()
+    assert profile["profiles"][0]["type"] == "sampled"
+    assert {function, "busy_wait"} <= profiled_functions(profile)
+
+
+def test_profile_saved(profiled_client, tmp_path):
+    response = profiled_client.get(
+        "/sync", headers={"X-Profile": "secret", "X-Profile-Format": "collapsed"}
+    )
+    assert response.status_code == 200
+    assert response.text == "sync"
+    path = tmp_path / f"{response.headers['x-profile-id']}.collapsed.txt"
+    lines = path.read_text().splitlines()
+    assert any("sync_endpoint" in line and "busy_wait" in line for line in lines)
+
+
+def test_sampled_requests_profiled(profiled_client, tmp_path):
+    with mock.patch("config.PROFILING_SAMPLE_RATE", 1.0):
+        response = profiled_client.get("/async")
+    path = tmp_path / f"{response.headers['x-profile-id']}.speedscope.json"
+    assert "async_endpoint" in profiled_functions(json.loads(path.read_text()))
+
+
+def test_invalid_token(profiled_client, tmp_path):
+    response = profiled_client.get("/async", headers={"X-Profile": "guess"})
+    assert response.status_code == 403
+    response = profiled_client.get("/async")
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert os.listdir(tmp_path) == []
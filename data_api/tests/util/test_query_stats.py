@@ -0,0 +1,72 @@
+from unittest import mock
+
+from loguru import logger as loguru_logger
+from sqlalchemy import text
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from util.middleware import QueryStatsMiddleware
+from util.query_stats import track_queries
+
+
+def capture_logs() -> tuple:
+    messages = []
+    return messages, loguru_logger.add(messages.append, format="{message}")
+
+
+def test_statements_tracked(engine):
+    with track_queries() as stats:
+        with engine.connect() as connection:
+            for _ in range(3):
+                connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+    assert stats.count == 4
+    assert stats.duration > 0
+    assert stats.repeated(3) == [("SELECT 1", 3)]
+    # Statements outside of the context are not tracked
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert stats.count == 4
+
+
+def test_slow_queries_logged_with_plan(engine):
+    messages, handler_id = capture_logs()
+    try:
+        with mock.patch("config.DB_SLOW_QUERY_THRESHOLD", 0):
+            with engine.connect() as connection:
+                value = connection.execute(text("SELECT :value"), {"value": 7})
+                assert value.scalar() == 7
+                # The transaction is still usable after the EXPLAIN
+                assert connection.execute(text("SELECT 8")).scalar() == 8
+    finally:
+        loguru_logger.remove(handler_id)
+    slow = [message for message in messages if message.startswith("Slow query")]
+    assert len(slow) == 2
+    assert "SELECT %(value)s" in slow[0]
+    assert "Result" in slow[0]
+
+
+def test_request_statements(engine):
+    def endpoint(request):
+        with engine.connect() as connection:
+            for user_id in range(3):
+                connection.execute(text("SELECT :id"), {"id": user_id})
+        return PlainTextResponse("ok")
+
+    app = Starlette(routes=[Route("/users", endpoint)])
+    app.add_middleware(QueryStatsMiddleware)
+    messages, handler_id = capture_logs()
+    try:
+        with mock.patch("config.DB_REPEATED_QUERY_THRESHOLD", 3):
+            response = TestClient(app).get("/users")
+    finally:
+        loguru_logger.remove(handler_id)
+    assert response.status_code == 200
+    assert response.headers["server-timing"].startswith("db;dur=")
+    assert response.headers["server-timing"].endswith('desc="3 statements"')
+    assert any(
+        "Statement ran 3 times in GET http://testserver/users" in message
+        for message in messages
+    )
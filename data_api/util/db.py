@@ -1,11 +1,14 @@
 import time
+from typing import TYPE_CHECKING
 
-import pandas as pd
 from sqlalchemy.engine import Engine
 from sqlalchemy.exc import OperationalError
 
 from util.logger import get_logger
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 def wait_for_connection(engine):
     logger = get_logger()
@@ -27,10 +30,12 @@ def wait_for_connection(engine):
         raise Exception("Could not connect to the database")
 
 
-def query_to_dataframe(query: str, engine: Engine) -> pd.DataFrame:
-    """Executes a SQL query and returns a dataframe.
+def query_to_dataframe(query: str, engine: Engine) -> "pd.DataFrame":
+    """Executes a SQL query and returns a dataframe. Requires pandas.
     Args:
         query: The SQL query to execute.
         engine: The SQLAlchemy engine to use.
     """
+    import pandas as pd
+
     return pd.read_sql_query(query, engine)
@@ -1,5 +1,6 @@
 import json
-from typing import Optional, Union
+from datetime import datetime
+from typing import Optional, Union, Dict, List
 
 from fastapi import FastAPI
 from fastapi.encoders import jsonable_encoder
@@ -33,10 +34,42 @@ class RecordNotActive(Exception):
 
 
 class BadForeignKey(Exception):
-    def __init__(self, fk_id: str, fk_name: str):
-        self.fk_id = fk_id
-        self.fk_name = fk_name
-        self.message = f"Foreign key {fk_name} with id {fk_id} does not exist"
+    def __init__(self, missing: Dict[str, List[int]]):
+        self.missing = missing
+        # First offending key, kept for clients reading a single foreign key
+        self.fk_name, fk_ids = next(iter(missing.items()))
+        self.fk_id = fk_ids[0]
+        details = ", ".join(f"{name} with ids {ids}" for name, ids in missing.items())
+        self.message = f"Foreign keys do not exist: {details}"
+        super().__init__(self.message)
+
+
+class DuplicateRecords(Exception):
+    def __init__(self, keys: list):
+        self.keys = keys
+        self.message = f"Payload contains duplicate records for keys {keys}"
+        super().__init__(self.message)
+
+
+class InvalidRecords(Exception):
+    def __init__(self, message: str, errors: Optional[dict] = None):
+        self.errors = errors or {}
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidCursor(Exception):
+    def __init__(self, cursor: str):
+        self.cursor = cursor
+        self.message = f"Invalid pagination cursor {cursor}"
+        super().__init__(self.message)
+
+
+class InvalidDateRange(Exception):
+    def __init__(self, start: Optional[datetime], end: Optional[datetime]):
+        self.start = start
+        self.end = end
+        self.message = f"Invalid date range from {start} to {end}"
         super().__init__(self.message)
 
 
@@ -1,8 +1,244 @@
+import atexit
+import json
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+from typing import Callable, List, Optional, TextIO
+
 from loguru import logger as loguru_logger
 
+import config
+
+# Syslog severities of the loguru levels, as GELF expects them
+GELF_LEVELS = {
+    "TRACE": 7,
+    "DEBUG": 7,
+    "INFO": 6,
+    "SUCCESS": 5,
+    "WARNING": 4,
+    "ERROR": 3,
+    "CRITICAL": 2,
+}
+WARNING_LEVEL = 30
+# Past this fill ratio of the queue only warnings and errors are enqueued
+SHED_RATIO = 0.8
+GELF_UDP_CHUNK_SIZE = 8180
+GELF_UDP_MAX_CHUNKS = 128
+
+
+def gelf_message(record: dict, host: str) -> dict:
+    """Build a GELF 1.1 message from a loguru record."""
+    message = record["message"]
+    full_message = message
+    if record["exception"]:
+        exc_type, exc, _ = record["exception"]
+        full_message = f"{message}\n{exc_type.__name__}: {exc}"
+    payload = {
+        "version": "1.1",
+        "host": host,
+        "short_message": message.splitlines()[0] if message else "",
+        "full_message": full_message,
+        "timestamp": record["time"].timestamp(),
+        "level": GELF_LEVELS.get(record["level"].name, 6),
+        "_logger": record["name"],
+        "_function": record["function"],
+        "_line": record["line"],
+        "_process": record["process"].id,
+        "_thread": record["thread"].name,
+    }
+    for key, value in record["extra"].items():
+        if key != "id":
+            payload[f"_{key}"] = (
+                value if isinstance(value, (int, float)) else str(value)
+            )
+    return payload
+
+
+class GelfUdpTransport:
+    """Send GELF messages as UDP datagrams, chunked when too large for one."""
+
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, messages: List[bytes]) -> None:
+        for message in messages:
+            if len(message) <= GELF_UDP_CHUNK_SIZE:
+                self._socket.sendto(message, self.address)
+                continue
+            offsets = range(0, len(message), GELF_UDP_CHUNK_SIZE)
+            chunks = [message[offset:][:GELF_UDP_CHUNK_SIZE] for offset in offsets]
+            if len(chunks) > GELF_UDP_MAX_CHUNKS:
+                continue
+            message_id = os.urandom(8)
+            for sequence, chunk in enumerate(chunks):
+                header = b"\x1e\x0f" + message_id + bytes([sequence, len(chunks)])
+                self._socket.sendto(header + chunk, self.address)
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+class GelfTcpTransport:
+    """Send GELF messages over TCP, null byte delimited, a batch per write."""
+
+    def __init__(self, host: str, port: int, timeout: float = 5.0):
+        self.address = (host, port)
+        self.timeout = timeout
+        self._socket: Optional[socket.socket] = None
+
+    def send(self, messages: List[bytes]) -> None:
+        if self._socket is None:
+            self._socket = socket.create_connection(self.address, self.timeout)
+        try:
+            self._socket.sendall(b"".join(message + b"\0" for message in messages))
+        except OSError:
+            # Reconnect on the next batch
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class StreamTransport:
+    """Write formatted log lines to a stream. Defaults to the current stderr."""
+
+    def __init__(self, stream: Optional[TextIO] = None):
+        self.stream = stream
+
+    def send(self, messages: List[str]) -> None:
+        stream = self.stream or sys.stderr
+        stream.write("".join(messages))
+        stream.flush()
+
+    def close(self) -> None:
+        pass
+
+
+class BatchingSink:
+    """Loguru sink handing records to a background thread, which ships them in
+    batches. Logging only costs the caller a put on a bounded queue:
+    - past SHED_RATIO of the queue, records below WARNING are dropped;
+    - once it is full, every record is dropped;
+    - successful request logs are only kept at the sample rate.
+    Dropped records are counted, and reported once the queue drains.
+    """
+
+    def __init__(
+        self,
+        transport,
+        encode: Callable,
+        queue_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        success_sample_rate: float = 1.0,
+    ):
+        self.transport = transport
+        self.encode = encode
+        self.batch_size = batch_size or config.LOGGER_BATCH_SIZE
+        self.flush_interval = (
+            config.LOGGER_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        )
+        self.success_sample_rate = success_sample_rate
+        self._queue: queue.Queue = queue.Queue(queue_size or config.LOGGER_QUEUE_SIZE)
+        self._shed_size = int(self._queue.maxsize * SHED_RATIO)
+        self.dropped = 0
+        self.failed = 0
+        self._reported_dropped = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="log-shipper", daemon=True
+        )
+
+    def start(self) -> "BatchingSink":
+        self._thread.start()
+        return self
+
+    def _is_sampled_out(self, record: dict) -> bool:
+        status_code = record["extra"].get("status_code")
+        if status_code is None or status_code >= 400:
+            return False
+        return random.random() >= self.success_sample_rate
+
+    def __call__(self, message) -> None:
+        record = message.record
+        is_warning = record["level"].no >= WARNING_LEVEL
+        if not is_warning:
+            if self._is_sampled_out(record):
+                return
+            if self._queue.qsize() >= self._shed_size:
+                self.dropped += 1
+                return
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ship(self, batch: list) -> None:
+        try:
+            self.transport.send([self.encode(message) for message in batch])
+        except Exception as exc:
+            self.failed += len(batch)
+            print(f"Could not ship {len(batch)} log records: {exc}", file=sys.stderr)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._ship(batch)
+            dropped = self.dropped - self._reported_dropped
+            if dropped and self._queue.empty():
+                self._reported_dropped += dropped
+                loguru_logger.warning(f"Dropped {dropped} log records under load")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Ship the records still queued and stop the thread."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self.transport.close()
+
+
+def gelf_sink() -> BatchingSink:
+    host = socket.gethostname()
+    if config.LOGGER_PROTOCOL == "tcp":
+        transport = GelfTcpTransport(config.LOGGER_HOST, config.LOGGER_PORT)
+    else:
+        transport = GelfUdpTransport(config.LOGGER_HOST, config.LOGGER_PORT)
+    return BatchingSink(
+        transport,
+        encode=lambda message: json.dumps(
+            gelf_message(message.record, host), default=str
+        ).encode("utf-8"),
+        success_sample_rate=config.LOGGER_SUCCESS_SAMPLE_RATE,
+    )
+
+
+def console_sink() -> BatchingSink:
+    return BatchingSink(StreamTransport(), encode=str)
+
 
 class Logger:
     _instance = None
+    _sinks: List[BatchingSink] = []
 
     def __new__(cls):
         if cls._instance is None:
@@ -11,8 +247,24 @@ class Logger:
 
     @classmethod
     def _create_logger(cls):
+        # Records are written by background threads, never by the caller
+        loguru_logger.remove()
+        cls._sinks = [console_sink().start()]
+        loguru_logger.add(cls._sinks[0], level=config.LOGGER_LEVEL)
+        if config.LOGGER_GELF_ENABLED:
+            sink = gelf_sink().start()
+            loguru_logger.add(sink, level=config.LOGGER_LEVEL, format="{message}")
+            cls._sinks.append(sink)
+        atexit.register(cls.shutdown)
         return loguru_logger
 
+    @classmethod
+    def shutdown(cls, timeout: float = 5.0) -> None:
+        """Flush the sinks, e.g. when the application stops."""
+        for sink in cls._sinks:
+            sink.stop(timeout)
+        cls._sinks = []
+
 
 def get_logger():
     return Logger()
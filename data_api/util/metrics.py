@@ -0,0 +1,102 @@
+import time
+from typing import Callable, Dict, Iterable, Iterator
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from util.pool import pool_stats
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time until the last chunk of the response is sent",
+    ["method", "route", "status"],
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being handled", ["method"]
+)
+ROWS_INGESTED = Counter(
+    "rows_ingested_total", "Rows written by bulk upserts and CSV loads", ["table"]
+)
+REQUEST_STATEMENTS = Histogram(
+    "http_request_db_statements",
+    "Statements run by a request",
+    ["route"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent running statements in a request", ["route"]
+)
+STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds", "Time to execute a statement"
+)
+REPORT_DURATION = Histogram(
+    "report_duration_seconds",
+    "Time to generate a report, until its last chunk is written",
+    ["report"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+def timed_report(name: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yield the chunks of a report, observing its duration once all are yielded.
+    Args:
+        name (str): Name of the report, used as label.
+        chunks (Iterable[bytes]): The encoded report.
+    Returns:
+        Iterator[bytes]: The same chunks.
+    """
+    start = time.perf_counter()
+    yield from chunks
+    REPORT_DURATION.labels(name).observe(time.perf_counter() - start)
+
+
+class PoolCollector:
+    """Collect the usage of the connection pools when metrics are scraped.
+    Args:
+        engines (Callable): Function returning the engines by name.
+    """
+
+    def __init__(self, engines: Callable[[], Dict[str, object]]):
+        self.engines = engines
+
+    def collect(self):
+        gauges = {
+            "size": GaugeMetricFamily(
+                "db_pool_size", "Connections kept in the pool", labels=["engine"]
+            ),
+            "checked_out": GaugeMetricFamily(
+                "db_pool_checked_out", "Connections in use", labels=["engine"]
+            ),
+            "overflow": GaugeMetricFamily(
+                "db_pool_overflow",
+                "Connections open beyond the pool size",
+                labels=["engine"],
+            ),
+            "max_wait_time": GaugeMetricFamily(
+                "db_pool_max_wait_seconds",
+                "Longest wait for a connection",
+                labels=["engine"],
+            ),
+        }
+        counters = {
+            "checkouts": CounterMetricFamily(
+                "db_pool_checkouts", "Connections checked out", labels=["engine"]
+            ),
+            "wait_time": CounterMetricFamily(
+                "db_pool_wait_seconds",
+                "Time spent waiting for connections",
+                labels=["engine"],
+            ),
+            "leaks": CounterMetricFamily(
+                "db_pool_leaks",
+                "Connections held past the leak threshold",
+                labels=["engine"],
+            ),
+        }
+        for name, engine in self.engines().items():
+            stats = pool_stats(engine)
+            for key, metric in {**gauges, **counters}.items():
+                if key in stats:
+                    metric.add_metric([name], stats[key])
+        yield from gauges.values()
+        yield from counters.values()
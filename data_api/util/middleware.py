@@ -1,77 +1,297 @@
+import random
+import sys
 import time
-from typing import Callable
+import uuid
+from typing import Optional, Tuple
 
 from sqlalchemy.exc import IntegrityError
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import URL, Headers, MutableHeaders
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+import config
 from util.exceptions import (
     RecordNotFound,
     RecordAlreadyExists,
     RecordNotActive,
     DatabaseError,
     BadForeignKey,
+    DuplicateRecords,
+    InvalidRecords,
+    InvalidCursor,
+    InvalidDateRange,
 )
 from util.logger import get_logger
+from util.metrics import (
+    REQUEST_DB_TIME,
+    REQUEST_DURATION,
+    REQUEST_STATEMENTS,
+    REQUESTS_IN_PROGRESS,
+)
+from util.profiling import (
+    is_profiling_token,
+    ProfileFormat,
+    RequestProfiler,
+    PROFILE_MEDIA_TYPES,
+)
+from util.query_stats import track_queries
+
 
+def error_content(exc: Exception) -> Optional[Tuple[int, dict]]:
+    """Map a known exception to the status code and content of its JSON response."""
+    if isinstance(exc, RecordNotFound):
+        return 404, {"detail": str(exc), "record_id": exc.record_id}
+    if isinstance(exc, RecordAlreadyExists):
+        return 409, {"detail": str(exc), "data": exc.data}
+    if isinstance(exc, RecordNotActive):
+        return 410, {"detail": str(exc), "record_id": exc.record_id}
+    if isinstance(exc, DatabaseError):
+        return 500, {"detail": str(exc), "data": exc.data}
+    if isinstance(exc, IntegrityError):
+        return 400, {"detail": str(exc)}
+    if isinstance(exc, BadForeignKey):
+        return 400, {
+            "detail": str(exc),
+            "fk_id": exc.fk_id,
+            "fk_name": exc.fk_name,
+            "missing": exc.missing,
+        }
+    if isinstance(exc, DuplicateRecords):
+        return 400, {"detail": str(exc), "keys": exc.keys}
+    if isinstance(exc, InvalidRecords):
+        return 400, {"detail": str(exc), "errors": exc.errors}
+    if isinstance(exc, InvalidCursor):
+        return 400, {"detail": str(exc), "cursor": exc.cursor}
+    if isinstance(exc, InvalidDateRange):
+        return 400, {
+            "detail": str(exc),
+            "start": exc.start and exc.start.isoformat(),
+            "end": exc.end and exc.end.isoformat(),
+        }
+    return None
 
-class ExceptionMiddleware(BaseHTTPMiddleware):
-    """Middleware to catch exceptions and return a JSON response"""
 
-    def __init__(self, app: Callable, *args, **kwargs):
-        super().__init__(app=app, *args, **kwargs)
+class ExceptionMiddleware:
+    """Middleware to catch exceptions and return a JSON response.
+    Written as plain ASGI, so responses, streamed ones included, are passed
+    through as they are sent.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
         self.logger = get_logger()
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
         try:
-            response = await call_next(request)
-        except RecordNotFound as exc:
-            content = {"detail": str(exc), "record_id": exc.record_id}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=404, content=content)
-        except RecordAlreadyExists as exc:
-            content = {"detail": str(exc), "data": exc.data}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=409, content=content)
-        except RecordNotActive as exc:
-            content = {"detail": str(exc), "record_id": exc.record_id}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=410, content=content)
-        except DatabaseError as exc:
-            content = {"detail": str(exc), "data": exc.data}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=500, content=content)
-        except IntegrityError as exc:
-            content = {"detail": str(exc)}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=400, content=content)
-        except BadForeignKey as exc:
-            content = {"detail": str(exc), "fk_id": exc.fk_id, "fk_name": exc.fk_name}
-            self.logger.error(f"Error Response: {content}")
-            return JSONResponse(status_code=400, content=content)
+            await self.app(scope, receive, send_wrapper)
         except Exception as exc:
-            content = {"detail": str(exc)}
-            self.logger.error(f"Error Response: {content}. Error type: {type(exc)}")
-            return JSONResponse(status_code=500, content=content)
-        return response
+            if response_started:
+                # Too late to send an error response, e.g. a stream failing midway
+                raise
+            error = error_content(exc)
+            if error:
+                status_code, content = error
+                self.logger.error(f"Error Response: {content}")
+            else:
+                status_code, content = 500, {"detail": str(exc)}
+                self.logger.error(f"Error Response: {content}. Error type: {type(exc)}")
+            response = JSONResponse(status_code=status_code, content=content)
+            await response(scope, receive, send)
+
 
+class LoggingMiddleware:
+    """Middleware logging each request with its status and response time.
+    The time runs until the last chunk of the body is sent.
+    """
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: Callable):
-        super().__init__(app)
+    def __init__(self, app: ASGIApp):
+        self.app = app
         self.logger = get_logger()
 
-    async def dispatch(self, request: Request, call_next):
-        start = time.time()
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code: Optional[int] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
         try:
-            response = await call_next(request)
-            response_time = time.time() - start
-            self.logger.info(
-                f"Request: {request.method} {request.url} {response.status_code} - {response_time:.2f}s"
-            )
-            return response
+            await self.app(scope, receive, send_wrapper)
         except Exception as exc:
             self.logger.exception(
-                f"Request: {request.method} {request.url}. An error occurred: {exc}"
+                f"Request: {scope['method']} {URL(scope=scope)}. An error occurred: {exc}"
+            )
+            raise
+        response_time = time.perf_counter() - start
+        self.logger.bind(status_code=status_code).info(
+            f"Request: {scope['method']} {URL(scope=scope)} {status_code} - {response_time:.2f}s"
+        )
+
+
+class MetricsMiddleware:
+    """Middleware recording the duration of each request by route and status,
+    and the number of requests in progress. Requests matching no route share a
+    label, so unknown paths cannot grow the number of series.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+        in_progress = REQUESTS_IN_PROGRESS.labels(scope["method"])
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_progress.dec()
+            # Set by the router once a route matches
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_DURATION.labels(scope["method"], route, status_code).observe(
+                time.perf_counter() - start
+            )
+
+
+class QueryStatsMiddleware:
+    """Middleware attributing database statements to the request running them.
+    The statements run until the response starts, and the time spent on them,
+    are sent in a Server-Timing header. Those run while streaming the body
+    only count in the metrics and in the warning about statements repeated
+    in the request, e.g. lazy loads in a loop.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.logger = get_logger()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append(
+                        "Server-Timing",
+                        f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} statements"',
+                    )
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                REQUEST_STATEMENTS.labels(route).observe(stats.count)
+                REQUEST_DB_TIME.labels(route).observe(stats.duration)
+                threshold = config.DB_REPEATED_QUERY_THRESHOLD
+                for statement, count in stats.repeated(threshold):
+                    self.logger.warning(
+                        f"Statement ran {count} times in {scope['method']} {URL(scope=scope)}, likely an N+1 query: {statement}"
+                    )
+
+
+class ProfilingMiddleware:
+    """Middleware profiling requests on demand, when PROFILING_ENABLED is set.
+    Requests are profiled when sent with an X-Profile header holding the
+    PROFILING_TOKEN, and at random at the PROFILING_SAMPLE_RATE. The profile
+    is written to PROFILING_DIR, under the X-Profile-Id sent with the
+    response, or sent instead of the response with X-Profile-Output: inline.
+    X-Profile-Format picks speedscope (the default) or collapsed stacks.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.logger = get_logger()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not config.PROFILING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        token = headers.get("x-profile")
+        if token is not None:
+            if not is_profiling_token(token):
+                response = JSONResponse(
+                    {"detail": "Invalid profiling token"}, status_code=403
+                )
+                await response(scope, receive, send)
+                return
+            inline = headers.get("x-profile-output") == "inline"
+        elif random.random() < config.PROFILING_SAMPLE_RATE:
+            inline = False
+        else:
+            await self.app(scope, receive, send)
+            return
+        format = ProfileFormat._value2member_map_.get(
+            headers.get("x-profile-format"), ProfileFormat.speedscope
+        )
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        name = f"{scope['method']} {scope['path']}"
+        status_code: Optional[int] = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Profile-Id", profile_id)
+            if not inline:
+                await send(message)
+
+        profiler = RequestProfiler()
+        profiler.start(sys._getframe())
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+        summary = f"{profiler.wall_time:.3f}s wall, {profiler.cpu_time:.3f}s CPU"
+        if inline:
+            response = Response(
+                profiler.render(format, name),
+                media_type=PROFILE_MEDIA_TYPES[format],
+                headers={
+                    "X-Profile-Status": str(status_code),
+                    "X-Profile-Wall-Time": f"{profiler.wall_time:.6f}",
+                    "X-Profile-CPU-Time": f"{profiler.cpu_time:.6f}",
+                },
             )
+            await response(scope, receive, send)
+            self.logger.info(f"Profiled {name} ({summary})")
+            return
+        path = await run_in_threadpool(profiler.save, format, name, profile_id)
+        self.logger.info(f"Profiled {name} ({summary}) to {path}")
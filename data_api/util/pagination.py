@@ -0,0 +1,36 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from util.exceptions import InvalidCursor
+
+
+def encode_cursor(last_id: int) -> str:
+    """Encode the position after a record as an opaque cursor.
+    Args:
+        last_id (int): ID of the last record of the current page.
+    Returns:
+        str: URL safe cursor token.
+    """
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """Decode a cursor produced by encode_cursor.
+    Args:
+        cursor (str, optional): The cursor token.
+    Returns:
+        Optional[int]: ID of the last record already returned, or None for no cursor.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        last_id = json.loads(base64.urlsafe_b64decode(padded))["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as e:
+        raise InvalidCursor(cursor) from e
+    if not isinstance(last_id, int):
+        raise InvalidCursor(cursor)
+    return last_id
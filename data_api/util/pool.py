@@ -0,0 +1,137 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+import config
+from util.logger import get_logger
+
+_CHECKOUT_KEY = "checked_out_at"
+_STATS_KEY = "pool_stats"
+
+
+class PoolStats:
+    """Counters of a connection pool, updated on every checkout and checkin."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.checkins = 0
+        self.leaks = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_time += seconds
+            self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def record_checkin(self, leaked: bool) -> None:
+        with self._lock:
+            self.checkins += 1
+            if leaked:
+                self.leaks += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "leaks": self.leaks,
+            "wait_time": round(self.wait_time, 6),
+            "max_wait_time": round(self.max_wait_time, 6),
+        }
+
+
+class TimedPoolMixin:
+    """Measure how long callers wait for a connection.
+    The time covers waiting on a free slot, opening new connections and the
+    pre-ping, i.e. everything between asking the pool for a connection and
+    getting one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        connection = super().connect()
+        wait = time.perf_counter() - start
+        self.stats.record_wait(wait)
+        connection.info[_CHECKOUT_KEY] = time.monotonic()
+        connection.info[_STATS_KEY] = self.stats
+        logger = get_logger()
+        if wait >= config.DB_POOL_WAIT_WARNING:
+            logger.warning(
+                f"Waited {wait:.3f}s for a database connection. {self.status()}"
+            )
+        else:
+            logger.debug(f"Database connection checked out in {wait:.4f}s")
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+@event.listens_for(Pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    # Registered on every pool, only connections checked out of a timed pool
+    # carry a checkout time
+    checked_out_at = connection_record.info.pop(_CHECKOUT_KEY, None)
+    if checked_out_at is None:
+        return
+    held = time.monotonic() - checked_out_at
+    leaked = held >= config.DB_POOL_LEAK_THRESHOLD
+    stats = connection_record.info.get(_STATS_KEY)
+    if stats is not None:
+        stats.record_checkin(leaked)
+    if leaked:
+        leaks = stats.leaks if stats is not None else "unknown"
+        get_logger().warning(
+            f"Database connection was held for {held:.1f}s before being returned "
+            f"to the pool (possible leak, {leaks} so far)"
+        )
+
+
+def pool_options(is_async: bool = False) -> dict:
+    """Engine keyword arguments for the configured connection pool.
+    Args:
+        is_async (bool, optional): Whether the options are for an async engine. Defaults to False.
+    Returns:
+        dict: Pool class and settings, to be passed to create_engine.
+    """
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": config.DB_POOL_PRE_PING,
+    }
+
+
+def pool_stats(engine) -> dict:
+    """Get the counters and current usage of an engine's pool.
+    Args:
+        engine: A sync or async engine.
+    Returns:
+        dict: Checkouts, checkins, leaks and wait times, plus the current pool size,
+            checked out connections and overflow. Empty if the pool is not instrumented.
+    """
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = getattr(pool, "stats", None)
+    if stats is None:
+        return {}
+    return {
+        **stats.as_dict(),
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
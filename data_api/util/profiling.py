@@ -0,0 +1,180 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextvars import Context, ContextVar
+from enum import Enum
+from types import FrameType
+from typing import Dict, Optional, Tuple
+
+import config
+
+# A frame of a profile: function name, file and first line
+ProfileFrame = Tuple[str, str, int]
+
+_current: ContextVar[Optional["RequestProfiler"]] = ContextVar(
+    "request_profiler", default=None
+)
+
+
+class ProfileFormat(str, Enum):
+    speedscope = "speedscope"
+    collapsed = "collapsed"
+
+
+PROFILE_MEDIA_TYPES = {
+    ProfileFormat.speedscope: "application/json",
+    ProfileFormat.collapsed: "text/plain",
+}
+PROFILE_EXTENSIONS = {
+    ProfileFormat.speedscope: "speedscope.json",
+    ProfileFormat.collapsed: "collapsed.txt",
+}
+
+
+def is_profiling_token(token: str) -> bool:
+    """Check a token against PROFILING_TOKEN, never valid when it is not set."""
+    if not config.PROFILING_TOKEN:
+        return False
+    return hmac.compare_digest(token.encode(), str(config.PROFILING_TOKEN).encode())
+
+
+class RequestProfiler:
+    """Wall clock sampling profiler of one request.
+    A background thread samples the stacks of every thread at a fixed
+    interval, and keeps those running the request:
+    - on the event loop, the stacks going through the frame the profile was
+      started from, i.e. the request's coroutines;
+    - in worker threads, the stacks of the functions run in the request's
+      context, i.e. sync endpoints and streamed bodies sent to the threadpool.
+    Time spent awaiting, e.g. the database, is not sampled and only shows in
+    the wall time.
+    """
+
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = config.PROFILING_INTERVAL if interval is None else interval
+        # Seconds sampled in each stack, outermost frame first
+        self.stacks: Dict[Tuple[ProfileFrame, ...], float] = defaultdict(float)
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self._root: Optional[FrameType] = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="request-profiler", daemon=True
+        )
+
+    def start(self, root: FrameType) -> None:
+        """Start sampling the request.
+        Args:
+            root (FrameType): Frame of the coroutine running the request.
+        """
+        self._root = root
+        self._token = _current.set(self)
+        self._started_at = time.perf_counter()
+        self._cpu_started_at = time.process_time()
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        _current.reset(self._token)
+        self.wall_time = time.perf_counter() - self._started_at
+        # Process wide, so it includes the requests served at the same time
+        self.cpu_time = time.process_time() - self._cpu_started_at
+
+    def _is_request_context(self, frame: FrameType) -> bool:
+        if "context" not in frame.f_code.co_varnames:
+            return False
+        context = frame.f_locals.get("context")
+        return isinstance(context, Context) and context.get(_current) is self
+
+    def _request_stack(self, frame: FrameType) -> Optional[Tuple[ProfileFrame, ...]]:
+        """Frames of a thread's stack running the request, None if it is not."""
+        stack = []
+        while frame is not None:
+            if frame is self._root or self._is_request_context(frame):
+                return tuple(reversed(stack))
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        return None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        sampled_at = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, sampled_at = now - sampled_at, now
+            frames = sys._current_frames()
+            if self._stopped.is_set():
+                # The request is done, the stacks are those of stop()
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = self._request_stack(frame)
+                if stack:
+                    thread = (names.get(thread_id, str(thread_id)), "", 0)
+                    self.stacks[(thread, *stack)] += elapsed
+
+    def speedscope(self, name: str) -> dict:
+        """The samples in the speedscope file format."""
+        frames, indexes, samples, weights = [], {}, [], []
+        for stack, seconds in self.stacks.items():
+            for frame in stack:
+                if frame not in indexes:
+                    indexes[frame] = len(frames)
+                    function, file, line = frame
+                    frames.append({"name": function, "file": file, "line": line})
+            samples.append([indexes[frame] for frame in stack])
+            weights.append(seconds)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "data_api",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+    def collapsed(self) -> str:
+        """The samples as collapsed stacks, in microseconds, for flamegraph.pl."""
+        lines = []
+        for stack, seconds in self.stacks.items():
+            names = [
+                f"{function} ({os.path.basename(file)}:{line})" if file else function
+                for function, file, line in stack
+            ]
+            lines.append(f"{';'.join(names)} {round(seconds * 1e6)}")
+        return "\n".join(lines) + "\n"
+
+    def render(self, format: ProfileFormat, name: str) -> bytes:
+        if format == ProfileFormat.collapsed:
+            return self.collapsed().encode()
+        return json.dumps(self.speedscope(name)).encode()
+
+    def save(self, format: ProfileFormat, name: str, profile_id: str) -> str:
+        """Write the profile to PROFILING_DIR.
+        Returns:
+            str: Path of the file.
+        """
+        os.makedirs(config.PROFILING_DIR, exist_ok=True)
+        path = os.path.join(
+            config.PROFILING_DIR, f"{profile_id}.{PROFILE_EXTENSIONS[format]}"
+        )
+        with open(path, "wb") as file:
+            file.write(self.render(format, name))
+        return path
@@ -0,0 +1,121 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+
+import config
+from util.logger import get_logger
+from util.metrics import STATEMENT_DURATION
+
+_STARTS_KEY = "statement_starts"
+_EXPLAIN_SAVEPOINT = "explain_slow_query"
+_EXPLAINABLE = re.compile(
+    r"^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|EXECUTE)\b", re.IGNORECASE
+)
+
+
+class QueryStats:
+    """Statements run on behalf of a request, counted by their SQL."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, duration: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.duration += duration
+            self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statements run at least threshold times, e.g. by a lazy load in a loop."""
+        with self._lock:
+            return [
+                (statement, count)
+                for statement, count in self.statements.items()
+                if count >= threshold
+            ]
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Attribute the statements run in this context, and in the threads and
+    greenlets it spawns, to new query stats.
+    """
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def _explain(connection, statement: str, parameters) -> Optional[str]:
+    """Plan of a statement, without running it. The EXPLAIN runs in a
+    savepoint, so that a failing one does not abort the caller's transaction.
+    """
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(f"SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+        try:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception:
+            cursor.execute(f"ROLLBACK TO SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+            return None
+        cursor.execute(f"RELEASE SAVEPOINT {_EXPLAIN_SAVEPOINT}")
+        return plan
+    except Exception:
+        # E.g. no transaction to hold a savepoint
+        return None
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(
+    connection, cursor, statement, parameters, context, executemany
+):
+    connection.info.setdefault(_STARTS_KEY, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    connection, cursor, statement, parameters, context, executemany
+):
+    duration = time.perf_counter() - connection.info[_STARTS_KEY].pop()
+    STATEMENT_DURATION.observe(duration)
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, duration)
+    if duration < config.DB_SLOW_QUERY_THRESHOLD:
+        return
+    message = f"Slow query ({duration:.3f}s): {statement}"
+    if config.DB_SLOW_QUERY_EXPLAIN and not executemany:
+        plan = None
+        if _EXPLAINABLE.match(statement):
+            plan = _explain(connection, statement, parameters)
+        if plan:
+            message = f"{message}\n{plan}"
+    get_logger().warning(message)
+
+
+def instrument_engine(engine) -> None:
+    """Time the statements of an engine, for the slow query log and the stats
+    of the current request.
+    Args:
+        engine: A sync or async engine. Instrumenting it again has no effect.
+    """
+    engine = getattr(engine, "sync_engine", engine)
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
@@ -1,6 +1,13 @@
+from typing import IO, AsyncIterator, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session as BaseSession
 
-from db.models import engine as default_engine
+from db.models import engine as default_engine, async_engine as default_async_engine
+from db.replicas import ReplicaSet, replicas
+
+_PRIMARY_KEY = "use_primary"
+_REPLICA_KEY = "replica"
 
 
 class Session(BaseSession):
@@ -12,14 +19,112 @@ class Session(BaseSession):
             raise e
 
 
+def use_primary(session: BaseSession) -> None:
+    """Send the remaining statements of a session to the primary.
+    Args:
+        session (Session): The session, or the sync session of an AsyncSession.
+    """
+    session.info[_PRIMARY_KEY] = True
+
+
+class RoutingSession(Session):
+    """Session sending reads to a replica and writes to the primary.
+    A session reads from a single replica. Once it writes or commits, it sticks
+    to the primary so that later reads in the same request see its own writes.
+    """
+
+    def __init__(
+        self, *args, replicas: Optional[ReplicaSet] = None, is_async=False, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self.is_async = is_async
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        primary = super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if not self.replicas or self._flushing or self.info.get(_PRIMARY_KEY):
+            return primary
+        if getattr(clause, "is_dml", False):
+            return primary
+        if _REPLICA_KEY not in self.info:
+            self.info[_REPLICA_KEY] = self.replicas.choose()
+        replica = self.info[_REPLICA_KEY]
+        if replica is None:
+            return primary
+        return replica.async_engine.sync_engine if self.is_async else replica.engine
+
+    def commit(self) -> None:
+        super().commit()
+        use_primary(self)
+
+
+# Built once, sessions are bound to an engine when created so the default
+# engine can still be swapped (e.g. in tests)
+SessionFactory = sessionmaker(autocommit=False, class_=RoutingSession)
+AsyncSessionFactory = sessionmaker(
+    class_=AsyncSession, sync_session_class=RoutingSession, expire_on_commit=False
+)
+
+
 def get_session(engine: default_engine = None):
-    """Get a session from the sessionmaker.
+    """Get a session from the session factory.
+    The caller owns the session and must close it to return its connection.
+    Reads are routed to the replicas unless an engine is given.
     Args:
         engine (Engine): The engine to use for the session. Defaults to None.
     Returns:
         Session: A session object.
     """
-    engine = engine or default_engine
-    session = sessionmaker(bind=engine, autocommit=False, class_=Session)
-    session = session()
-    return session
+    if engine is not None:
+        return SessionFactory(bind=engine)
+    return SessionFactory(bind=default_engine, replicas=replicas)
+
+
+def get_async_session(engine: AsyncEngine = None) -> AsyncSession:
+    """Get an async session.
+    Objects are not expired on commit, as expired attributes cannot be lazy
+    loaded once the response is serialized outside of the session. Reads are
+    routed to the replicas unless an engine is given.
+    Args:
+        engine (AsyncEngine): The engine to use for the session. Defaults to None.
+    Returns:
+        AsyncSession: A session object, to be used as an async context manager.
+    """
+    if engine is not None:
+        return AsyncSessionFactory(bind=engine)
+    return AsyncSessionFactory(
+        bind=default_async_engine, replicas=replicas, is_async=True
+    )
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency providing one session per request.
+    The session is closed once the request is handled, which rolls back any
+    uncommitted work and returns its connection to the pool even on errors.
+    Yields:
+        AsyncSession: The request's session.
+    """
+    async with get_async_session() as session:
+        yield session
+
+
+def copy_csv(storage_class, file: IO[bytes], columns: List[str], header: bool) -> dict:
+    """Load a CSV file through a storage class in its own session.
+    Meant to run in a worker thread, as COPY blocks until the load is merged.
+    Args:
+        storage_class: The storage class of the target table.
+        file (IO[bytes]): The CSV file. It is closed once loaded.
+        columns (List[str]): Table columns, in the order they appear in the file.
+        header (bool): Whether the first line of the file is a header.
+    Returns:
+        dict: Number of records inserted, updated, reactivated and unchanged.
+    """
+    session = get_session()
+    try:
+        storage = storage_class(session=session)
+        outcome = storage.copy_from_csv(file, columns, header=header)
+        session.commit()
+        return outcome
+    finally:
+        session.close()
+        file.close()
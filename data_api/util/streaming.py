@@ -1,11 +1,197 @@
+import codecs
+import csv
 import io
+import tempfile
+from datetime import date
+from enum import Enum
+from typing import (
+    IO,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel as PydanticBase
+from starlette.requests import Request
 
-def buffer_to_generator(buffer: io.StringIO):
-    """Convert a buffer to a generator.
-    This is useful for creating streaming responses
+import config
+from util.storage import get_async_session
+
+# OpenAPI description of endpoints that take a CSV file as the request body
+CSV_REQUEST_BODY = {
+    "requestBody": {
+        "content": {"text/csv": {"schema": {"type": "string", "format": "binary"}}},
+        "required": True,
+    }
+}
+
+
+async def spool_request_body(request: Request, max_size: int = None) -> IO[bytes]:
+    """Stream a request body into a temporary file.
+    The body is kept in memory up to max_size bytes and rolled over to disk
+    after that, so large uploads are never held in memory as a whole.
+    Args:
+        request (Request): The incoming request.
+        max_size (int, optional): Bytes kept in memory. Defaults to COPY_SPOOL_MAX_SIZE.
+    Returns:
+        IO[bytes]: The file with the body, positioned at the start.
+    """
+    max_size = max_size or config.COPY_SPOOL_MAX_SIZE
+    file = tempfile.SpooledTemporaryFile(max_size=max_size)
+    async for chunk in request.stream():
+        file.write(chunk)
+    file.seek(0)
+    return file
+
+
+def read_csv_header(file: IO[bytes]) -> List[str]:
+    """Read the column names from the first line of a CSV file.
+    The file is rewound afterwards.
+    Args:
+        file (IO[bytes]): The CSV file.
+    Returns:
+        List[str]: The column names.
+    """
+    line = codecs.decode(file.readline(), "utf-8-sig")
+    file.seek(0)
+    return [name.strip() for name in next(csv.reader([line]), [])]
+
+
+async def spool_csv_upload(
+    request: Request, columns: Optional[str] = None
+) -> Tuple[IO[bytes], List[str]]:
+    """Spool a text/csv request body and resolve its columns.
+    Args:
+        request (Request): The incoming request.
+        columns (str, optional): Comma separated column names for files without
+            a header line. Defaults to None, reading them from the header.
+    Returns:
+        Tuple[IO[bytes], List[str]]: The spooled file and its column names.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("text/csv"):
+        raise HTTPException(status_code=415, detail="Expected a text/csv body")
+    file = await spool_request_body(request)
+    if columns:
+        return file, [name.strip() for name in columns.split(",")]
+    return file, read_csv_header(file)
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def schema_columns(schema: Type[PydanticBase]) -> List[str]:
+    """Flat column names of a schema, nested fields as `<field>.<nested field>`."""
+    columns = []
+    for name, field in schema.__fields__.items():
+        if isinstance(field.type_, type) and issubclass(field.type_, PydanticBase):
+            columns.extend(f"{name}.{nested}" for nested in field.type_.__fields__)
+        else:
+            columns.append(name)
+    return columns
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def csv_chunk(rows: Iterable[Iterable]) -> str:
+    """Encode a batch of rows as CSV lines."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([_csv_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def csv_stream(columns: List[str], batches: Iterable[List[tuple]]) -> Iterator[str]:
+    """Encode batches of rows as CSV, one chunk per batch.
+    The header is sent before the first batch is read, so the response starts
+    right away, and only one batch is held in memory at a time.
+    Args:
+        columns (List[str]): The header.
+        batches (Iterable[List[tuple]]): Batches of rows, e.g. read from a cursor.
+    Yields:
+        str: The CSV lines of the header and of each batch.
+    """
+    yield csv_chunk([columns])
+    for batch in batches:
+        yield csv_chunk(batch)
+
+
+async def ndjson_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[bytes]:
+    """Encode batches of records as newline delimited JSON, one chunk per batch."""
+    async for batch in batches:
+        yield b"".join(orjson.dumps(record) + b"\n" for record in batch)
+
+
+async def csv_chunks(
+    columns: List[str], batches: AsyncIterator[List[dict]]
+) -> AsyncIterator[str]:
+    """Encode batches of records as CSV, one chunk per batch.
+    The header is sent before the first batch is read. Nested records are
+    flattened into the `<field>.<nested field>` columns.
+    """
+    yield csv_chunk([columns])
+    paths = [column.split(".") for column in columns]
+    async for batch in batches:
+        rows = []
+        for record in batch:
+            row = []
+            for path in paths:
+                value = record
+                for key in path:
+                    value = value[key] if value is not None else None
+                row.append(value)
+            rows.append(row)
+        yield csv_chunk(rows)
+
+
+def export_response(
+    storage_class, schema: Type[PydanticBase], format: ExportFormat, name: str
+) -> StreamingResponse:
+    """Stream every active record of a table.
+    The export opens its own session, held for as long as the response streams.
     Args:
-        buffer (io.StringIO): A buffer containing the data to be streamed
+        storage_class: The async storage class of the table.
+        schema (Type[PydanticBase]): Response schema of the records.
+        format (ExportFormat): NDJSON or CSV.
+        name (str): Base name of the downloaded file.
+    Returns:
+        StreamingResponse: The streamed records.
     """
-    buffer.seek(0)
-    yield buffer.getvalue()
+
+    async def batches() -> AsyncIterator[List[dict]]:
+        async with get_async_session() as session:
+            storage = storage_class(session=session)
+            async for batch in storage.stream_rows(
+                schema, batch_size=config.EXPORT_BATCH_SIZE
+            ):
+                yield batch
+
+    if format == ExportFormat.csv:
+        content = csv_chunks(schema_columns(schema), batches())
+    else:
+        content = ndjson_chunks(batches())
+    headers = {"Content-Disposition": f"attachment; filename={name}.{format.value}"}
+    return StreamingResponse(
+        content, media_type=EXPORT_MEDIA_TYPES[format], headers=headers
+    )